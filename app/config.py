@@ -14,9 +14,10 @@
 
 # Standard Library
 from functools import lru_cache
+from typing import Optional
 
 # Third Party
-from pydantic import BaseSettings
+from pydantic import BaseSettings, PositiveInt
 
 # --------------------------------------------------------------
 
@@ -57,11 +58,39 @@ def get_brainpep_settings() -> BrainPEPSettings:
     return BrainPEPSettings()
 
 
+class KeycloakSettings(BaseSettings):
+    keycloak_max_connections: int = 100
+    keycloak_max_keepalive_connections: int = 20
+    keycloak_keepalive_expiry: float = 5
+    keycloak_http2: bool = False
+    keycloak_timeout: float = 10
+    keycloak_token_timeout: float = 25
+    keycloak_pool_timeout: float = 5
+    keycloak_retries: int = 2
+    keycloak_retry_backoff: float = 0.1
+    keycloak_retry_max_backoff: float = 1
+    keycloak_breaker_threshold: int = 5
+    keycloak_breaker_reset_timeout: float = 30
+    keycloak_outbox_batch_size: int = 50
+    keycloak_outbox_poll_interval: float = 1
+    keycloak_outbox_backoff: float = 1
+    keycloak_outbox_max_backoff: float = 300
+
+    class Config:
+        env_file = ".env"
+
+
+@lru_cache(maxsize=1)
+def get_keycloak_settings() -> KeycloakSettings:
+    return KeycloakSettings()
+
+
 # --------------------------------------------------------------
 
 
 class DatabaseSettings(BaseSettings):
     connection_number: int
+    migrate_on_startup: bool = True
     postgres_db: str
     postgres_host: str
     postgres_port: int
@@ -87,7 +116,18 @@ class SecuritySettings(BaseSettings):
     jws_private_key: str
     jws_public_key: str
     jws_algorithm: str
+    jws_cache_size: int = 4096
+    jws_cache_bytes: int = 4 * 1024 * 1024
+    jws_cache_ttl: float = 300
+    crypto_executor: str = "inline"
+    crypto_executor_workers: int = 4
+    crypto_executor_max_pending: int = 1024
+    bearer_cache_size: int = 4096
+    bearer_cache_ttl: float = 300
     realm_public_key: str
+    realm_jwks_url: Optional[str] = None
+    realm_jwks_refresh_interval: float = 3600
+    realm_jwks_min_refresh_interval: float = 30
 
     class Config:
         env_file = ".env"
@@ -99,3 +139,42 @@ def get_security_settings() -> SecuritySettings:
 
 
 # --------------------------------------------------------------
+
+
+class CacheSettings(BaseSettings):
+    service_cache_size: int = 1024
+    service_cache_ttl: float = 60
+    signed_policy_cache_size: int = 8192
+    signed_policy_cache_ttl: float = 300
+    token_expiry_margin: float = 10
+    token_refresh_ahead: float = 60
+    policy_catalogue_ttl: float = 3600
+    user_identifier_cache_size: int = 8192
+    user_identifier_cache_ttl: float = 86400
+
+    class Config:
+        env_file = ".env"
+
+
+@lru_cache(maxsize=1)
+def get_cache_settings() -> CacheSettings:
+    return CacheSettings()
+
+
+# --------------------------------------------------------------
+
+
+class GatewaySettings(BaseSettings):
+    # An unbounded queue would disable the backpressure
+    stream_max_pending: PositiveInt = 64
+
+    class Config:
+        env_file = ".env"
+
+
+@lru_cache(maxsize=1)
+def get_gateway_settings() -> GatewaySettings:
+    return GatewaySettings()
+
+
+# --------------------------------------------------------------
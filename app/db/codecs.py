@@ -0,0 +1,64 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard library
+from typing import Any
+
+# Third party
+from asyncpg import Connection
+from orjson import dumps, loads
+
+# ---------------------------------------------------------------------------------------
+
+JSONB_VERSION = b"\x01"
+"""Version of the binary format of jsonb, prefixed to the json text"""
+
+
+def encode_jsonb(value: Any) -> bytes:
+    """
+    Encode a value in the binary format of jsonb
+
+    :param value: value to encode
+    :return: jsonb value
+    """
+    return JSONB_VERSION + dumps(value)
+
+
+def decode_jsonb(data: bytes) -> Any:
+    """
+    Decode a jsonb value received in binary format
+
+    :param data: jsonb value
+    :return: decoded value
+    """
+    return loads(data[1:])
+
+
+async def set_json_codecs(connection: Connection):
+    """
+    Exchange json and jsonb values in binary format, decoded and encoded with orjson,
+    so the rows are decoded once into python objects
+
+    :param connection: connection opened by the pool
+    """
+    await connection.set_type_codec(
+        "jsonb",
+        encoder=encode_jsonb,
+        decoder=decode_jsonb,
+        schema="pg_catalog",
+        format="binary",
+    )
+    await connection.set_type_codec(
+        "json", encoder=dumps, decoder=loads, schema="pg_catalog", format="binary"
+    )
@@ -0,0 +1,175 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard library
+import asyncio
+from typing import List, NamedTuple, Tuple
+
+# Third party
+from asyncpg import connect, Connection
+from asyncpg.exceptions import InvalidCatalogNameError, DuplicateDatabaseError
+
+# Internal
+from .query import (
+    ALTER_TABLE,
+    CREATE_DATABASE,
+    CREATE_INDEX,
+    CREATE_TABLE,
+    MIGRATION,
+    SETTINGS,
+)
+
+# ---------------------------------------------------------------------------------------
+
+
+class Migration(NamedTuple):
+    version: int
+    """Version reached once the migration is applied"""
+
+    description: str
+    """What the migration does"""
+
+    statements: Tuple[str, ...]
+    """Statements executed in a single transaction"""
+
+
+MIGRATIONS = (
+    Migration(
+        1,
+        "service and device mapping tables",
+        (CREATE_TABLE["service_mapping"], CREATE_TABLE["device_mapping"]),
+    ),
+    Migration(
+        2,
+        "indexes of the dashboard lookups",
+        (CREATE_INDEX["device_mapping_user"], CREATE_INDEX["service_mapping_user"]),
+    ),
+    Migration(
+        3,
+        "signed device policies",
+        (ALTER_TABLE["device_mapping_signature"],),
+    ),
+    Migration(
+        4,
+        "user identifiers mapping",
+        (CREATE_TABLE["user_identifier"],),
+    ),
+    Migration(
+        5,
+        "outbox of the keycloak resource operations",
+        (CREATE_TABLE["keycloak_outbox"], CREATE_INDEX["keycloak_outbox_service"]),
+    ),
+    Migration(
+        6,
+        "compact signed device policies",
+        (ALTER_TABLE["device_mapping_compact_signature"],),
+    ),
+)
+"""Schema migrations, in order of version"""
+
+MIGRATION_LOCK = 0x42524149
+"""Advisory lock that serializes the processes applying the migrations"""
+
+# ---------------------------------------------------------------------------------------
+
+
+async def create_database():
+    """
+    Create the database if it doesn't exist
+    """
+    # Connect to Database template
+    sys_conn = await connect(
+        host=SETTINGS.postgres_host,
+        user=SETTINGS.postgres_user,
+        port=SETTINGS.postgres_port,
+        password=SETTINGS.postgres_pwd,
+        database="template1",
+    )
+    try:
+        await sys_conn.execute(CREATE_DATABASE)
+    except DuplicateDatabaseError:
+        # Another process created the database
+        pass
+    finally:
+        # Disconnect from database template
+        await sys_conn.close()
+
+
+async def apply_migrations(connection: Connection) -> List[int]:
+    """
+    Apply the migrations not yet recorded in the database
+
+    :param connection: connection to the database
+    :return: versions applied
+    """
+    applied_versions = []
+    await connection.execute(MIGRATION["lock"], MIGRATION_LOCK)
+    try:
+        await connection.execute(MIGRATION["create_table"])
+        already_applied = {
+            record["version"] for record in await connection.fetch(MIGRATION["applied"])
+        }
+        for migration in MIGRATIONS:
+            if migration.version in already_applied:
+                continue
+            async with connection.transaction():
+                for statement in migration.statements:
+                    await connection.execute(statement)
+                await connection.execute(
+                    MIGRATION["insert"], migration.version, migration.description
+                )
+            applied_versions.append(migration.version)
+    finally:
+        await connection.execute(MIGRATION["unlock"], MIGRATION_LOCK)
+    return applied_versions
+
+
+async def migrate() -> List[int]:
+    """
+    Create the database if needed and bring its schema to the last version
+
+    :return: versions applied
+    """
+    try:
+        connection = await connect(
+            user=SETTINGS.postgres_user,
+            password=SETTINGS.postgres_pwd,
+            database=SETTINGS.postgres_db,
+            host=SETTINGS.postgres_host,
+            port=SETTINGS.postgres_port,
+        )
+    except InvalidCatalogNameError:
+        await create_database()
+        connection = await connect(
+            user=SETTINGS.postgres_user,
+            password=SETTINGS.postgres_pwd,
+            database=SETTINGS.postgres_db,
+            host=SETTINGS.postgres_host,
+            port=SETTINGS.postgres_port,
+        )
+    try:
+        return await apply_migrations(connection)
+    finally:
+        await connection.close()
+
+
+# ---------------------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    versions = asyncio.run(migrate())
+    if versions:
+        print(f"Applied migrations: {', '.join(map(str, versions))}")
+    else:
+        print("Database schema already up to date")
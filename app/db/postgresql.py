@@ -14,109 +14,254 @@
 
 
 # Standard library
+import asyncio
+from contextlib import asynccontextmanager
+from enum import Enum
 from functools import lru_cache
-import time
-from typing import List, Optional
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 # Third party
-from asyncpg import connect, create_pool, Connection
-from asyncpg.exceptions import (
-    PostgresError,
-    InvalidCatalogNameError,
-    DuplicateDatabaseError,
-)
+from asyncpg import Connection, connect, create_pool
+from asyncpg.exceptions import PostgresError, UniqueViolationError
 from asyncpg.pool import Pool
 from fastapi import status, HTTPException
 
 # Internal
-from .query import (
-    CREATE_DATABASE,
-    CREATE_TABLE,
-    DELETE,
-    INSERT,
-    SELECT,
-    SETTINGS,
-    UPDATE,
+from .migrations import migrate
+from .query import DEVICE_CHANNEL, SETTINGS
+from .codecs import set_json_codecs
+from .statements import STATEMENTS
+
+from ..config import get_cache_settings
+from ..internals.cache import TTLCache
+from ..internals.logger import get_logger, log_postgres_error
+from ..internals.metrics import register_metrics
+from ..internals.policy.engine import (
+    CompiledDevice,
+    CompiledService,
+    compile_service,
+    filter_services,
 )
-
-from ..internals.logger import log_postgres_error
 from app.models.brain_pep.device import Device
-from app.models.brain_pep.service import Service, GatewayService
+from app.models.brain_pep.service import Service
 
 # ---------------------------------------------------------------------------------------
 
 
+_CACHE_SETTINGS = get_cache_settings()
+"""Cache Settings"""
+
+LISTEN_RETRY_INTERVAL = 1
+"""Seconds before connecting again the listener of the device policies"""
+
+LISTEN_MAX_RETRY_INTERVAL = 30
+"""Max seconds before connecting again the listener, doubled at every failure"""
+
+OUTBOX_LOCK = 0x4F555442
+"""Advisory lock held by the process pushing the outbox to keycloak"""
+
+
+class OutboxOperation(str, Enum):
+    insert = "insert"
+    update = "update"
+    delete = "delete"
+
+
+class OutboxEntry(NamedTuple):
+    """Keycloak operation committed together with a service"""
+
+    id: int
+    """Position in the outbox"""
+    service_id: str
+    """Service of the operation"""
+    username: str
+    """Owner of the service"""
+    operation: OutboxOperation
+    """Operation to push"""
+    resource: Optional[dict]
+    """Service to push, None for the deletions"""
+    keycloak_identifier: Optional[str]
+    """Keycloak resource, None if the creation is not yet pushed"""
+    attempts: int
+    """Attempts already failed"""
+
+
 class DataBase:
     pool: Pool = None
     """Connection pool to the database"""
 
-    @staticmethod
-    async def __create_table_service_mapping(sys_conn: Connection):
-        await sys_conn.execute(CREATE_TABLE["service_mapping"])
+    service_cache = TTLCache(
+        _CACHE_SETTINGS.service_cache_size, _CACHE_SETTINGS.service_cache_ttl
+    )
+    """Compiled services indexed by their identifier"""
 
-    @staticmethod
-    async def __create_table_device_mapping(sys_conn: Connection):
-        await sys_conn.execute(CREATE_TABLE["device_mapping"])
+    _service_cache_epoch: int = 0
+    """Incremented at every local write to discard lookups started before it"""
+
+    device_listener: Optional[asyncio.Task] = None
+    """Receives the writes of the device policies committed by every worker"""
+
+    device_listener_connected: bool = False
+    """True while the listener receives the writes of the device policies"""
+
+    device_listener_failures: int = 0
+    """Number of times the listener failed"""
 
     @classmethod
     async def connect(cls) -> None:
         """
-        Create a connection pool to the database
+        Create a connection pool to the database, applying the schema migrations
+        first unless they are run as a separate step
         """
-        try:
-            # Try to create a connection pool to the Database
-            cls.pool = await create_pool(
-                user=SETTINGS.postgres_user,
-                password=SETTINGS.postgres_pwd,
-                database=SETTINGS.postgres_db,
-                host=SETTINGS.postgres_host,
-                port=SETTINGS.postgres_port,
-                max_size=SETTINGS.connection_number,
+        if SETTINGS.migrate_on_startup:
+            await migrate()
+
+        cls.pool = await create_pool(
+            **cls._connection_settings(),
+            max_size=SETTINGS.connection_number,
+            init=cls.init_connection,
+            # The statements are prepared once for the whole life of the connection
+            max_cached_statement_lifetime=0,
+        )
+
+    @staticmethod
+    def _connection_settings() -> dict:
+        """
+        Settings of the connections to the database
+
+        :return: arguments of asyncpg connect
+        """
+        return {
+            "user": SETTINGS.postgres_user,
+            "password": SETTINGS.postgres_pwd,
+            "database": SETTINGS.postgres_db,
+            "host": SETTINGS.postgres_host,
+            "port": SETTINGS.postgres_port,
+        }
+
+    @classmethod
+    def listen_device_changes(cls, on_change: Callable[[Optional[str]], None]):
+        """
+        Receive in background the writes of the device policies committed by every
+        worker, on a dedicated connection outside of the pool
+
+        :param on_change: called with the identifier of the device written, or with
+                          None when some notifications may have been lost
+        """
+        if cls.device_listener is None:
+            cls.device_listener = asyncio.get_running_loop().create_task(
+                cls._listen_devices(on_change)
             )
 
-        except InvalidCatalogNameError:
-            # Flag that indicates if the tables must be created
-            create_tables = True
-            # Connect to Database template
-            sys_conn = await connect(
-                host=SETTINGS.postgres_host,
-                user=SETTINGS.postgres_user,
-                port=SETTINGS.postgres_port,
-                password=SETTINGS.postgres_pwd,
-                database="template1",
+    @classmethod
+    async def _listen_devices(cls, on_change: Callable[[Optional[str]], None]):
+        """
+        Listen to the writes of the device policies, connecting again when the
+        connection is lost
+
+        :param on_change: called with the identifier of the device written, or with
+                          None when some notifications may have been lost
+        """
+        failures = 0
+        while True:
+            try:
+                await cls._listen_connection(on_change)
+                await get_logger().warning({"msg": "Device listener disconnected"})
+            except Exception as error:
+                # Any failure, the cancellation aside, must not stop the listener
+                cls.device_listener_failures += 1
+                await get_logger().error(
+                    {"msg": "Device listener failed", "error": repr(error)}
+                )
+            failures = 0 if cls.device_listener_connected else failures + 1
+            cls.device_listener_connected = False
+            try:
+                # Forget what was written while nobody was listening
+                on_change(None)
+            except Exception as error:
+                await get_logger().error(
+                    {"msg": "Device caches not invalidated", "error": repr(error)}
+                )
+            await asyncio.sleep(
+                min(LISTEN_MAX_RETRY_INTERVAL, LISTEN_RETRY_INTERVAL * 2**failures)
             )
+
+    @classmethod
+    async def _listen_connection(cls, on_change: Callable[[Optional[str]], None]):
+        """
+        Listen to the writes of the device policies until the connection is lost
+
+        :param on_change: called with the identifier of the device written, or with
+                          None when some notifications may have been lost
+        """
+        connection = await connect(**cls._connection_settings())
+        closed = asyncio.Event()
+        errors: List[Exception] = []
+
+        def notify(_connection, _pid, _channel, device_id: str):
             try:
-                # Create Database
-                await sys_conn.execute(CREATE_DATABASE)
+                on_change(device_id)
+            except Exception as error:
+                # The write is lost, connect again to forget everything
+                errors.append(error)
+                closed.set()
 
-            except DuplicateDatabaseError:
-                # Another process created the database so set create_tables to False
-                create_tables = False
+        try:
+            connection.add_termination_listener(lambda _: closed.set())
+            await connection.add_listener(DEVICE_CHANNEL, notify)
+            cls.device_listener_connected = True
+            # Forget what was written while nobody was listening
+            on_change(None)
+            await closed.wait()
+            if errors:
+                raise errors[0]
+        finally:
+            try:
+                await connection.close()
+            except Exception:
+                connection.terminate()
 
-            finally:
-                # Disconnect from database template
-                await sys_conn.close()
-
-            # Create a connection pool to the Database
-            cls.pool = await create_pool(
-                user=SETTINGS.postgres_user,
-                password=SETTINGS.postgres_pwd,
-                database=SETTINGS.postgres_db,
-                host=SETTINGS.postgres_host,
-                port=SETTINGS.postgres_port,
-                max_size=SETTINGS.connection_number,
-            )
+    @classmethod
+    def device_listener_stats(cls) -> dict:
+        """
+        Device listener statistics
 
-            # Check if the tables must be created
-            if create_tables:
-                async with cls.pool.acquire() as connection:
-                    # Create tables
-                    await cls.__create_table_service_mapping(connection)
-                    await cls.__create_table_device_mapping(connection)
+        :return: state and failures of the listener
+        """
+        return {
+            "alive": cls.device_listener is not None and not cls.device_listener.done(),
+            "connected": cls.device_listener_connected,
+            "failures": cls.device_listener_failures,
+        }
+
+    @staticmethod
+    async def init_connection(connection: Connection):
+        """
+        Set up a connection opened by the pool, the codecs must be set before
+        preparing the statements that use them
+
+        :param connection: new connection
+        """
+        await set_json_codecs(connection)
+        await STATEMENTS.init(connection)
 
     @classmethod
     async def insert_device(
-        cls, keycloak_identifier: str, device: Device, username: str
+        cls,
+        keycloak_identifier: str,
+        device: Device,
+        username: str,
+        signature: str,
+        compact_signature: bytes,
     ):
         """
         Insert device in the database
@@ -124,18 +269,27 @@ class DataBase:
         :param keycloak_identifier: uuid associated to the mapping
         :param device: Device to store
         :param username: client
+        :param signature: signed device policies
+        :param compact_signature: signed device policies in the compact layout
         """
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(
-                    INSERT["device"],
-                    *(
-                        keycloak_identifier,
-                        device.device_id,
-                        username,
-                        device.json(exclude_none=True),
-                    ),
-                )
+                async with connection.transaction():
+                    await STATEMENTS.execute(
+                        connection,
+                        "insert_device",
+                        *(
+                            keycloak_identifier,
+                            device.device_id,
+                            username,
+                            device.dict(exclude_none=True),
+                            signature,
+                            compact_signature,
+                        ),
+                    )
+                    await STATEMENTS.execute(
+                        connection, "notify_device", device.device_id
+                    )
 
         except PostgresError as error:
             await log_postgres_error(error)
@@ -148,19 +302,36 @@ class DataBase:
             )
 
     @classmethod
-    async def update_device(cls, device: Device, username: str):
+    async def update_device(
+        cls, device: Device, username: str, signature: str, compact_signature: bytes
+    ) -> bool:
         """
         Update device mapping
 
         :param device: device to update
         :param username: client
+        :param signature: signed device policies
+        :param compact_signature: signed device policies in the compact layout
+        :return: True if the device of the client was found
         """
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(
-                    UPDATE["device"],
-                    *(device.json(exclude_none=True), device.device_id, username),
-                )
+                async with connection.transaction():
+                    command_status = await STATEMENTS.execute(
+                        connection,
+                        "update_device",
+                        *(
+                            device.dict(exclude_none=True),
+                            signature,
+                            compact_signature,
+                            device.device_id,
+                            username,
+                        ),
+                    )
+                    await STATEMENTS.execute(
+                        connection, "notify_device", device.device_id
+                    )
+            return command_status != "UPDATE 0"
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
@@ -181,7 +352,11 @@ class DataBase:
         """
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(DELETE["device"], *(device_id, username))
+                async with connection.transaction():
+                    await STATEMENTS.execute(
+                        connection, "delete_device", *(device_id, username)
+                    )
+                    await STATEMENTS.execute(connection, "notify_device", device_id)
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
@@ -202,12 +377,39 @@ class DataBase:
         """
         try:
             async with cls.pool.acquire() as conn:
-                device_json = await conn.fetchval(SELECT["device"], device_id)
-                if device_json is None:
+                device_data = await STATEMENTS.fetchval(
+                    conn, "select_device", device_id
+                )
+                if device_data is None:
                     raise HTTPException(
                         status_code=status.HTTP_404_NOT_FOUND, detail="device not found"
                     )
-                return Device.parse_raw(device_json)
+                return Device.parse_obj(device_data)
+        except PostgresError as error:
+            await log_postgres_error(error)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "resource": "Device",
+                    "status": "Something went wrong extracting the data",
+                },
+            )
+
+    @classmethod
+    async def extract_device_signature(
+        cls, device_id: str
+    ) -> Tuple[Device, Optional[str]]:
+        """
+        Extract device info and its signed policies
+
+        :param device_id: Device identifier
+        :return: requested device and its signature, None if it was never signed
+        """
+        try:
+            async with cls.pool.acquire() as conn:
+                device_row = await STATEMENTS.fetchrow(
+                    conn, "select_device_signature", device_id
+                )
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
@@ -217,6 +419,99 @@ class DataBase:
                     "status": "Something went wrong extracting the data",
                 },
             )
+        if device_row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="device not found"
+            )
+        return Device.parse_obj(device_row["policy_list"]), device_row["signature"]
+
+    @classmethod
+    async def extract_device_compact_signature(
+        cls, device_id: str
+    ) -> Tuple[Device, Optional[bytes]]:
+        """
+        Extract device info and its signed policies in the compact layout
+
+        :param device_id: Device identifier
+        :return: requested device and its compact signature, None if it was never
+                 signed
+        """
+        try:
+            async with cls.pool.acquire() as conn:
+                device_row = await STATEMENTS.fetchrow(
+                    conn, "select_device_compact_signature", device_id
+                )
+        except PostgresError as error:
+            await log_postgres_error(error)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "resource": "Device",
+                    "status": "Something went wrong extracting the data",
+                },
+            )
+        if device_row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="device not found"
+            )
+        return (
+            Device.parse_obj(device_row["policy_list"]),
+            device_row["compact_signature"],
+        )
+
+    @classmethod
+    async def store_device_signature(cls, device_id: str, signature: str) -> str:
+        """
+        Store the signature of a device signed on read, unless another worker
+        stored one in the meantime
+
+        :param device_id: Device identifier
+        :param signature: signed device policies
+        :return: signature stored
+        """
+        try:
+            async with cls.pool.acquire() as conn:
+                return await STATEMENTS.fetchval(
+                    conn, "update_device_signature", *(device_id, signature)
+                )
+        except PostgresError as error:
+            await log_postgres_error(error)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "resource": "Device",
+                    "status": "Something went wrong storing the data",
+                },
+            )
+
+    @classmethod
+    async def store_device_compact_signature(
+        cls, device_id: str, compact_signature: bytes
+    ) -> bytes:
+        """
+        Store the compact signature of a device signed on read, unless another
+        worker stored one in the meantime
+
+        :param device_id: Device identifier
+        :param compact_signature: signed device policies in the compact layout
+        :return: compact signature stored
+        """
+        try:
+            async with cls.pool.acquire() as conn:
+                return await STATEMENTS.fetchval(
+                    conn,
+                    "update_device_compact_signature",
+                    *(device_id, compact_signature),
+                )
+        except PostgresError as error:
+            await log_postgres_error(error)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "resource": "Device",
+                    "status": "Something went wrong storing the data",
+                },
+            )
 
     @classmethod
     async def extract_all_devices(
@@ -231,11 +526,11 @@ class DataBase:
         """
         try:
             async with cls.pool.acquire() as conn:
-                device_list = await conn.fetch(
-                    SELECT["device_list"], *(username, keycloak_identifier)
+                device_list = await STATEMENTS.fetch(
+                    conn, "select_device_list", *(username, keycloak_identifier)
                 )
                 return [
-                    Device.parse_raw(device["policy_list"])
+                    Device.parse_obj(device["policy_list"])
                     for device in device_list
                     if device["policy_list"]
                 ]
@@ -250,28 +545,48 @@ class DataBase:
             )
 
     @classmethod
-    async def insert_service(
-        cls, keycloak_identifier: str, username: str, service: Service
-    ):
+    def invalidate_service(cls, service_id: str):
         """
-        Insert service in the database
+        Invalidate the cached service after a local write
+
+        :param service_id: service identifier
+        """
+        cls._service_cache_epoch += 1
+        cls.service_cache.pop(service_id)
+
+    @classmethod
+    async def insert_service(cls, username: str, service: Service):
+        """
+        Insert service in the database, together with the creation of its keycloak
+        resource
 
-        :param keycloak_identifier: keycloak identifier
         :param username: client
         :param service: service
         """
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(
-                    INSERT["service"],
-                    *(
-                        keycloak_identifier,
-                        service.name,
-                        username,
-                        service.json(exclude_none=True),
-                    ),
-                )
+                async with connection.transaction():
+                    data = service.dict(exclude_none=True)
+                    await STATEMENTS.execute(
+                        connection,
+                        "insert_service",
+                        *(None, service.name, username, data),
+                    )
+                    await STATEMENTS.execute(
+                        connection,
+                        "outbox_insert",
+                        *(service.name, username, OutboxOperation.insert, data),
+                    )
+            cls.invalidate_service(service.name)
 
+        except UniqueViolationError:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "resource": "Service",
+                    "status": "Service already exists",
+                },
+            )
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
@@ -285,17 +600,24 @@ class DataBase:
     @classmethod
     async def update_service(cls, service: Service, username: str):
         """
-        Update device mapping
+        Update service mapping, together with the update of its keycloak resource
 
         :param service: service to update
         :param username: client
         """
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(
-                    UPDATE["service"],
-                    *(service.json(exclude_none=True), service.name, username),
-                )
+                async with connection.transaction():
+                    data = service.dict(exclude_none=True)
+                    await STATEMENTS.execute(
+                        connection, "update_service", *(data, service.name, username)
+                    )
+                    await STATEMENTS.execute(
+                        connection,
+                        "outbox_insert_mapped",
+                        *(service.name, username, OutboxOperation.update, data),
+                    )
+            cls.invalidate_service(service.name)
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
@@ -307,24 +629,25 @@ class DataBase:
             )
 
     @classmethod
-    async def extract_service_keycloak_identifier(
-        cls, service_id: str, username: str
-    ) -> str:
+    async def extract_all_services(cls, username: str) -> List[Service]:
         """
-        Extract keycloak identifier associated to the service
-        :param service_id: Service of interest
-        :param username: client
-        :return: keycloak identifier
+        Extract all services associated to the user
+
+        :param username: user
+        :return: Service list
         """
         try:
             async with cls.pool.acquire() as connection:
-                return await connection.fetchval(
-                    SELECT["service_keycloak_id"],
-                    *(
-                        service_id,
-                        username,
-                    ),
+                service_list = await STATEMENTS.fetch(
+                    connection,
+                    "select_service_list",
+                    username,
                 )
+                return [
+                    Service.parse_obj(service["policy_list"])
+                    for service in service_list
+                    if service["policy_list"]
+                ]
 
         except PostgresError as error:
             await log_postgres_error(error)
@@ -337,108 +660,309 @@ class DataBase:
             )
 
     @classmethod
-    async def extract_all_services(cls, username: str) -> List[Service]:
+    async def delete_service(cls, service_id: str, username: str):
         """
-        Extract all services associated to the user
+        Delete service from the database, together with its keycloak resource
 
-        :param username: user
-        :return: Service list
+        :param service_id: service identifier
+        :param username: client
         """
         try:
             async with cls.pool.acquire() as connection:
-                service_list = await connection.fetch(
-                    SELECT["service_list"],
-                    username,
-                )
-                return [
-                    Service.parse_raw(service["policy_list"])
-                    for service in service_list
-                    if service["policy_list"]
-                ]
-
+                async with connection.transaction():
+                    await STATEMENTS.execute(
+                        connection,
+                        "outbox_insert_mapped",
+                        *(service_id, username, OutboxOperation.delete, None),
+                    )
+                    await STATEMENTS.execute(
+                        connection, "delete_service", *(service_id, username)
+                    )
+            cls.invalidate_service(service_id)
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail={
                     "resource": "Service",
-                    "status": "Something went wrong extracting the data",
+                    "status": "Something went wrong deleting the data",
                 },
             )
 
     @classmethod
-    async def delete_service(cls, service_id: str, username: str):
+    async def extract_service_map(
+        cls, service_id_list: List[str]
+    ) -> Dict[str, CompiledService]:
         """
-        Delete device from the database
+        Extract the requested services from the cache, fetching the missing ones
+        from the database with a single query
 
-        :param service_id: service identifier
-        :param username: client
+        :param service_id_list: identifiers of the services of interest
+        :return: found compiled services indexed by their identifier
         """
+        service_map = {}
+        missing_id_set = set()
+        for service_id in service_id_list:
+            service = cls.service_cache.get(service_id)
+            if service is None:
+                missing_id_set.add(service_id)
+            else:
+                service_map[service_id] = service
+
+        if not missing_id_set:
+            return service_map
+
+        # Lookups that overlap a local write must not repopulate the cache
+        epoch = cls._service_cache_epoch
         try:
             async with cls.pool.acquire() as connection:
-                await connection.execute(DELETE["service"], *(service_id, username))
+                service_rows = await STATEMENTS.fetch(
+                    connection, "select_policy_list_batch", list(missing_id_set)
+                )
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail={
                     "resource": "Service",
-                    "status": "Something went wrong deleting the data",
+                    "status": "Something went wrong extracting the data",
                 },
             )
 
+        for service_row in service_rows:
+            # Keep the first row found, as the single lookup used to do
+            if service_row["service_id"] not in service_map:
+                service = compile_service(
+                    Service.parse_obj(service_row["policy_list"])
+                )
+                service_map[service_row["service_id"]] = service
+                if epoch == cls._service_cache_epoch:
+                    cls.service_cache.set(service_row["service_id"], service)
+        return service_map
+
+    @staticmethod
+    def _requested_services(
+        service_map: Dict[str, CompiledService], service_id_list: List[str]
+    ) -> List[CompiledService]:
+        """
+        Extract the requested services keeping their order
+
+        :param service_map: compiled services indexed by their identifier
+        :param service_id_list: identifiers of the services of interest
+        :return: compiled services requested
+        """
+        compiled_service_list = []
+        for service_id in service_id_list:
+            compiled_service = service_map.get(service_id)
+            if compiled_service is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"service {service_id} not found",
+                )
+            compiled_service_list.append(compiled_service)
+        return compiled_service_list
+
     @classmethod
     async def filter_service_list(
-        cls, gateway_service: GatewayService
+        cls, service_id_list: List[str], device: CompiledDevice
     ) -> List[Optional[Service]]:
         """
         Extract a list of service from the database
 
-        :param gateway_service: message to be routed by the gateway towards the services
+        :param service_id_list: services towards which the gateway routes the message
+        :param device: compiled policies of the device that sent the message
         :return: Services requested
         """
+        service_map = await cls.extract_service_map(service_id_list)
+        return filter_services(
+            cls._requested_services(service_map, service_id_list), device
+        )
+
+    @classmethod
+    async def filter_service_batch(
+        cls, message_list: List[Tuple[List[str], CompiledDevice]]
+    ) -> List[Union[List[Service], HTTPException]]:
+        """
+        Filter the services of many messages fetching all of them at once, a service
+        not found fails only the messages requesting it
 
+        :param message_list: services requested and compiled device of every message
+        :return: Services allowed for every message or its error, in the same order
+        """
+        service_map = await cls.extract_service_map(
+            [
+                service_id
+                for service_id_list, _ in message_list
+                for service_id in service_id_list
+            ]
+        )
+        result_list = []
+        for service_id_list, device in message_list:
+            try:
+                result_list.append(
+                    filter_services(
+                        cls._requested_services(service_map, service_id_list), device
+                    )
+                )
+            except HTTPException as error:
+                result_list.append(error)
+        return result_list
+
+    @classmethod
+    @asynccontextmanager
+    async def outbox_lock(cls) -> AsyncIterator[Optional[Connection]]:
+        """
+        Try to become the only process pushing the outbox to keycloak, the
+        operations of the outbox run on the connection holding the lock so a batch
+        uses a single connection of the pool
+
+        :return: connection holding the lock until the end of the block, None if
+                 another process holds it
+        """
+        async with cls.pool.acquire() as connection:
+            locked = await STATEMENTS.fetchval(
+                connection, "outbox_try_lock", OUTBOX_LOCK
+            )
+            try:
+                yield connection if locked else None
+            finally:
+                if locked:
+                    await STATEMENTS.execute(connection, "outbox_unlock", OUTBOX_LOCK)
+
+    @staticmethod
+    async def extract_outbox_batch(
+        connection: Connection, limit: int
+    ) -> List[OutboxEntry]:
+        """
+        Extract the oldest pending operation of every service, if it is due
+
+        :param connection: connection holding the outbox lock
+        :param limit: max number of operations
+        :return: operations to push to keycloak
+        """
+        return [
+            OutboxEntry(*record)._replace(
+                operation=OutboxOperation(record["operation"])
+            )
+            for record in await STATEMENTS.fetch(connection, "outbox_pending", limit)
+        ]
+
+    @staticmethod
+    async def complete_outbox_entry(
+        connection: Connection,
+        entry: OutboxEntry,
+        keycloak_identifier: Optional[str] = None,
+    ):
+        """
+        Remove an operation pushed to keycloak
+
+        :param connection: connection holding the outbox lock
+        :param entry: operation pushed
+        :param keycloak_identifier: identifier of the resource created by the operation
+        """
+        async with connection.transaction():
+            if keycloak_identifier is not None:
+                # The operations enqueued while the resource was being created
+                args = (entry.id, entry.service_id, entry.username)
+                await STATEMENTS.execute(
+                    connection, "outbox_map_pending", *args, keycloak_identifier
+                )
+                await STATEMENTS.execute(
+                    connection, "outbox_map_service", *args, keycloak_identifier
+                )
+            await STATEMENTS.execute(connection, "outbox_delete", entry.id)
+
+    @classmethod
+    async def discard_outbox_insert(cls, connection: Connection, entry: OutboxEntry):
+        """
+        Remove the creation of a resource refused by keycloak together with its
+        service, unless the service was created again meanwhile, so the name is
+        free again and the service isn't served without its resource
+
+        :param connection: connection holding the outbox lock
+        :param entry: creation refused
+        """
+        async with connection.transaction():
+            await STATEMENTS.execute(
+                connection,
+                "outbox_discard_service",
+                *(entry.id, entry.service_id, entry.username),
+            )
+            await STATEMENTS.execute(connection, "outbox_delete", entry.id)
+        cls.invalidate_service(entry.service_id)
+
+    @staticmethod
+    async def postpone_outbox_entry(
+        connection: Connection, entry: OutboxEntry, delay: float, error: str
+    ):
+        """
+        Retry later an operation keycloak failed
+
+        :param connection: connection holding the outbox lock
+        :param entry: operation failed
+        :param delay: seconds before the next attempt
+        :param error: reason of the failure
+        """
+        await STATEMENTS.execute(
+            connection, "outbox_postpone", *(entry.id, delay, error)
+        )
+
+    @staticmethod
+    async def extract_outbox_backlog(connection: Connection) -> Tuple[int, float]:
+        """
+        Size of the outbox
+
+        :param connection: connection holding the outbox lock
+        :return: number of pending operations and seconds since the oldest one
+        """
+        count, age = await STATEMENTS.fetchrow(connection, "outbox_backlog")
+        return count, float(age or 0)
+
+    @classmethod
+    async def extract_user_identifier(cls, keycloak_id: str) -> Optional[str]:
+        """
+        Extract the identifier of the user stored in keycloak attributes
+
+        :param keycloak_id: User identifier
+        :return: identifier, None if the user is not yet mapped
+        """
         try:
-            service_list = []
             async with cls.pool.acquire() as connection:
-                for service_id in gateway_service.service_list:
-                    service_json = await connection.fetchval(
-                        SELECT["policy_list"], service_id
-                    )
-                    if service_json is None:
-                        raise HTTPException(
-                            status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"service {service_id} not found",
-                        )
-                    service = Service.parse_raw(service_json)
-                    service_scopes_set = set(service.resource_scopes)
-                    control_flag = True
-                    if "storage_policy" in service_scopes_set:
-                        service_scopes_set = service_scopes_set.difference(
-                            {"storage_policy"}
-                        )
-                        if gateway_service.sign_device.storage_policy:
-                            if (
-                                gateway_service.sign_device.storage_policy.timestamp()
-                                < time.time()
-                            ):
-                                control_flag = False
-                        else:
-                            control_flag = False
-
-                    if control_flag:
-                        if service_scopes_set.issubset(
-                            set(gateway_service.sign_device.policy_list)
-                        ):
-                            service_list.append(service)
-            return service_list
+                return await STATEMENTS.fetchval(
+                    connection, "select_user_identifier", keycloak_id
+                )
+
         except PostgresError as error:
             await log_postgres_error(error)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail={
-                    "resource": "Service",
-                    "status": "Something went wrong storing the data",
+                    "resource": "User",
+                    "status": "Something went wrong extracting the data",
+                },
+            )
+
+    @classmethod
+    async def insert_user_identifier(cls, keycloak_id: str, identifier: str):
+        """
+        Store the identifier of the user stored in keycloak attributes
+
+        :param keycloak_id: User identifier
+        :param identifier: identifier of the attributes associated to the user
+        """
+        try:
+            async with cls.pool.acquire() as connection:
+                await STATEMENTS.execute(
+                    connection, "insert_user_identifier", *(keycloak_id, identifier)
+                )
+
+        except PostgresError as error:
+            await log_postgres_error(error)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail={
+                    "resource": "User",
+                    "status": "Something went wrong inserting the data",
                 },
             )
 
@@ -447,6 +971,14 @@ class DataBase:
         """
         Disconnect from the database
         """
+        if cls.device_listener is not None:
+            cls.device_listener.cancel()
+            try:
+                await cls.device_listener
+            except asyncio.CancelledError:
+                pass
+            cls.device_listener = None
+            cls.device_listener_connected = False
         await cls.pool.close()
 
 
@@ -459,4 +991,8 @@ def get_database() -> DataBase:
     return DataBase()
 
 
+register_metrics("service_cache", DataBase.service_cache.stats)
+register_metrics("device_listener", DataBase.device_listener_stats)
+
+
 # ---------------------------------------------------------------------------------------
@@ -43,16 +43,71 @@ CREATE_TABLE = {
                     policy_list jsonb,
                     PRIMARY KEY(device_id, username)
                     );""",
+    "user_identifier": """
+                    CREATE TABLE IF NOT EXISTS "user_identifier" (
+                    keycloak_id text PRIMARY KEY,
+                    identifier text NOT NULL
+                    );""",
+    "keycloak_outbox": """
+                    CREATE TABLE IF NOT EXISTS "keycloak_outbox" (
+                    id bigserial PRIMARY KEY,
+                    service_id text NOT NULL,
+                    username text NOT NULL,
+                    operation text NOT NULL,
+                    resource jsonb,
+                    keycloak_identifier text,
+                    attempts integer NOT NULL DEFAULT 0,
+                    next_attempt_at timestamptz NOT NULL DEFAULT now(),
+                    last_error text,
+                    created_at timestamptz NOT NULL DEFAULT now()
+                    );""",
 }
 """Create database table"""
 
+CREATE_INDEX = {
+    "device_mapping_user": """
+                    CREATE INDEX IF NOT EXISTS "device_mapping_user_idx"
+                    ON "device_mapping" (username, keycloak_identifier);""",
+    "service_mapping_user": """
+                    CREATE INDEX IF NOT EXISTS "service_mapping_user_idx"
+                    ON "service_mapping" (username);""",
+    "keycloak_outbox_service": """
+                    CREATE INDEX IF NOT EXISTS "keycloak_outbox_service_idx"
+                    ON "keycloak_outbox" (service_id, username, id);""",
+}
+"""Create the indexes used by the lookups not covered by the primary keys"""
+
+ALTER_TABLE = {
+    "device_mapping_signature": """
+                    ALTER TABLE "device_mapping" ADD COLUMN IF NOT EXISTS signature text;""",
+    "device_mapping_compact_signature": """
+                    ALTER TABLE "device_mapping" ADD COLUMN IF NOT EXISTS compact_signature bytea;""",
+}
+"""Alter database table"""
+
+MIGRATION = {
+    "create_table": """
+                    CREATE TABLE IF NOT EXISTS "schema_migrations" (
+                    version integer PRIMARY KEY,
+                    description text,
+                    applied_at timestamptz NOT NULL DEFAULT now()
+                    );""",
+    "applied": "SELECT version FROM schema_migrations;",
+    "insert": "INSERT INTO schema_migrations (version, description) VALUES ($1, $2);",
+    "lock": "SELECT pg_advisory_lock($1);",
+    "unlock": "SELECT pg_advisory_unlock($1);",
+}
+"""Keep track of the applied schema migrations"""
+
 
 SELECT = {
-    "device": "SELECT policy_list::jsonb FROM device_mapping WHERE device_id = $1;",
-    "device_list": "SELECT policy_list::jsonb FROM device_mapping WHERE username = $1 AND keycloak_identifier = $2;",
-    "service_keycloak_id": "SELECT keycloak_identifier FROM service_mapping WHERE service_id = $1 AND username = $2;",
-    "service_list": "SELECT policy_list::json FROM service_mapping WHERE username = $1;",
-    "policy_list": "SELECT policy_list::json FROM service_mapping WHERE service_id = $1;",
+    "device": "SELECT policy_list FROM device_mapping WHERE device_id = $1;",
+    "device_signature": "SELECT policy_list, signature FROM device_mapping WHERE device_id = $1;",
+    "device_compact_signature": "SELECT policy_list, compact_signature FROM device_mapping WHERE device_id = $1;",
+    "device_list": "SELECT policy_list FROM device_mapping WHERE username = $1 AND keycloak_identifier = $2;",
+    "service_list": "SELECT policy_list FROM service_mapping WHERE username = $1;",
+    "policy_list_batch": "SELECT service_id, policy_list FROM service_mapping WHERE service_id = ANY($1::text[]);",
+    "user_identifier": "SELECT identifier FROM user_identifier WHERE keycloak_id = $1;",
 }
 "Extract data"
 
@@ -74,16 +129,103 @@ INSERT = {
         keycloak_identifier,
         device_id,
         username,
-        policy_list) VALUES ($1, $2, $3, $4);
+        policy_list,
+        signature,
+        compact_signature) VALUES ($1, $2, $3, $4, $5, $6);
+    """,
+    "user_identifier": """
+        INSERT INTO user_identifier (
+        keycloak_id,
+        identifier) VALUES ($1, $2)
+        ON CONFLICT (keycloak_id) DO UPDATE SET identifier = EXCLUDED.identifier;
     """,
 }
 """Insert data in the database"""
 
+OUTBOX = {
+    "insert": """
+        INSERT INTO keycloak_outbox (
+        service_id,
+        username,
+        operation,
+        resource) VALUES ($1, $2, $3, $4);
+    """,
+    "insert_mapped": """
+        INSERT INTO keycloak_outbox (
+        service_id,
+        username,
+        operation,
+        resource,
+        keycloak_identifier)
+        SELECT service_id, username, $3, $4::jsonb, keycloak_identifier
+        FROM service_mapping WHERE service_id = $1 AND username = $2;
+    """,
+    "pending": """
+        SELECT id, service_id, username, operation, resource, keycloak_identifier, attempts
+        FROM (
+            SELECT DISTINCT ON (service_id, username) *
+            FROM keycloak_outbox ORDER BY service_id, username, id
+        ) AS head
+        WHERE next_attempt_at <= now() ORDER BY id LIMIT $1;
+    """,
+    "delete": "DELETE FROM keycloak_outbox WHERE id = $1;",
+    "postpone": """
+        UPDATE keycloak_outbox SET
+        attempts = attempts + 1,
+        next_attempt_at = now() + make_interval(secs => $2),
+        last_error = $3
+        WHERE id = $1;
+    """,
+    "map_pending": """
+        UPDATE keycloak_outbox SET keycloak_identifier = $4
+        WHERE service_id = $2 AND username = $3 AND id > $1 AND keycloak_identifier IS NULL
+        AND id < COALESCE((
+            SELECT min(id) FROM keycloak_outbox
+            WHERE service_id = $2 AND username = $3 AND id > $1 AND operation = 'insert'
+        ), 9223372036854775807);
+    """,
+    "map_service": """
+        UPDATE service_mapping SET keycloak_identifier = $4
+        WHERE service_id = $2 AND username = $3 AND NOT EXISTS (
+            SELECT 1 FROM keycloak_outbox
+            WHERE service_id = $2 AND username = $3 AND id > $1 AND operation = 'insert'
+        );
+    """,
+    "discard_service": """
+        DELETE FROM service_mapping
+        WHERE service_id = $2 AND username = $3 AND NOT EXISTS (
+            SELECT 1 FROM keycloak_outbox
+            WHERE service_id = $2 AND username = $3 AND id > $1 AND operation = 'insert'
+        );
+    """,
+    "backlog": "SELECT count(*), extract(epoch FROM now() - min(created_at)) FROM keycloak_outbox;",
+    "try_lock": "SELECT pg_try_advisory_lock($1);",
+    "unlock": "SELECT pg_advisory_unlock($1);",
+}
+"""Keycloak operations committed together with the services, pushed in background"""
+
 UPDATE = {
+    "device_signature": """
+        UPDATE device_mapping SET signature = COALESCE(signature, $2) WHERE device_id = $1
+        RETURNING signature;
+        """,
+    "device_compact_signature": """
+        UPDATE device_mapping SET compact_signature = COALESCE(compact_signature, $2)
+        WHERE device_id = $1 RETURNING compact_signature;
+        """,
     "device": """
-        UPDATE device_mapping SET policy_list = $1 WHERE device_id = $2 AND username = $3;
+        UPDATE device_mapping SET policy_list = $1, signature = $2, compact_signature = $3
+        WHERE device_id = $4 AND username = $5;
         """,
     "service": """
         UPDATE service_mapping SET policy_list = $1 WHERE service_id = $2 AND username = $3;
         """,
 }
+
+DEVICE_CHANNEL = "device_policies"
+"""Channel notified with the device identifier when the policies of a device change"""
+
+NOTIFY = {
+    "device": f"SELECT pg_notify('{DEVICE_CHANNEL}', $1);",
+}
+"""Notify the other workers, delivered when the transaction commits"""
@@ -0,0 +1,208 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard library
+from inspect import signature
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+# Third party
+from asyncpg import Connection, Record
+
+# Internal
+from .query import DELETE, INSERT, NOTIFY, OUTBOX, SELECT, UPDATE
+from ..internals.metrics import register_metrics
+
+# ---------------------------------------------------------------------------------------
+
+
+def _can_prepare_cached() -> bool:
+    """
+    Check if the installed asyncpg can prepare a statement in the statement cache of
+    a connection, a private api
+
+    :return: False if the statements must be prepared at their first use
+    """
+    prepare = getattr(Connection, "_prepare", None)
+    return prepare is not None and "use_cache" in signature(prepare).parameters
+
+
+CAN_PREPARE_CACHED = _can_prepare_cached()
+"""True if the statements can be prepared as soon as a connection is opened"""
+
+
+class StatementStats:
+    """Calls and timings of a statement"""
+
+    def __init__(self):
+        self.calls = 0
+        """Number of executions"""
+        self.errors = 0
+        """Number of executions failed"""
+        self.time = 0.0
+        """Seconds spent executing the statement"""
+        self.max_time = 0.0
+        """Slowest execution"""
+
+    def record(self, seconds: float):
+        """
+        Record an execution
+
+        :param seconds: duration of the execution
+        """
+        self.calls += 1
+        self.time += seconds
+        self.max_time = max(self.max_time, seconds)
+
+    def stats(self) -> dict:
+        """
+        Statement statistics
+
+        :return: counters and timings in milliseconds
+        """
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": self.time * 1000,
+            "mean_ms": self.time * 1000 / (self.calls or 1),
+            "max_ms": self.max_time * 1000,
+        }
+
+
+class StatementRegistry:
+    """
+    Statements of the service, executed through the statement cache of the
+    connections so the database parses and plans them only once per connection.
+    The pool must disable the expiration of the cached statements, by default they
+    are prepared again after 300 seconds
+    """
+
+    def __init__(self, statements: Dict[str, str]):
+        """
+        :param statements: queries indexed by their name
+        """
+        self.statements = statements
+        self._stats: Dict[str, StatementStats] = {
+            name: StatementStats() for name in statements
+        }
+
+    async def init(self, connection: Connection):
+        """
+        Prepare every statement on a new connection, to use as init of the pool.
+        The public Connection.prepare doesn't fill the statement cache and its
+        handles become invalid once the connection is released to the pool, so the
+        private api is used when available
+
+        :param connection: connection opened by the pool
+        """
+        if not CAN_PREPARE_CACHED:
+            return
+        for query in self.statements.values():
+            await connection._prepare(query, use_cache=True)
+
+    async def _run(self, connection: Connection, name: str, method: str, *args) -> Any:
+        """
+        Execute a prepared statement recording its timing
+
+        :param connection: acquired connection
+        :param name: name of the statement
+        :param method: execute, fetch, fetchrow or fetchval
+        :param args: arguments of the statement
+        :return: result of the method
+        """
+        query = self.statements[name]
+        stats = self._stats[name]
+        start = perf_counter()
+        try:
+            return await getattr(connection, method)(query, *args)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.record(perf_counter() - start)
+
+    async def execute(self, connection: Connection, name: str, *args) -> str:
+        """
+        Execute a statement
+
+        :param connection: acquired connection
+        :param name: name of the statement
+        :param args: arguments of the statement
+        :return: status of the command
+        """
+        return await self._run(connection, name, "execute", *args)
+
+    async def fetch(self, connection: Connection, name: str, *args) -> List[Record]:
+        """
+        Execute a statement returning all the rows
+
+        :param connection: acquired connection
+        :param name: name of the statement
+        :param args: arguments of the statement
+        :return: rows
+        """
+        return await self._run(connection, name, "fetch", *args)
+
+    async def fetchrow(
+        self, connection: Connection, name: str, *args
+    ) -> Optional[Record]:
+        """
+        Execute a statement returning the first row
+
+        :param connection: acquired connection
+        :param name: name of the statement
+        :param args: arguments of the statement
+        :return: first row, None if there are none
+        """
+        return await self._run(connection, name, "fetchrow", *args)
+
+    async def fetchval(self, connection: Connection, name: str, *args) -> Any:
+        """
+        Execute a statement returning the first value of the first row
+
+        :param connection: acquired connection
+        :param name: name of the statement
+        :param args: arguments of the statement
+        :return: value, None if there are no rows
+        """
+        return await self._run(connection, name, "fetchval", *args)
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Statistics of the statements executed at least once
+
+        :return: calls and timings of every statement
+        """
+        return {
+            name: stats.stats() for name, stats in self._stats.items() if stats.calls
+        }
+
+
+STATEMENTS = StatementRegistry(
+    {
+        f"{group}_{name}": query
+        for group, queries in (
+            ("select", SELECT),
+            ("insert", INSERT),
+            ("update", UPDATE),
+            ("delete", DELETE),
+            ("outbox", OUTBOX),
+            ("notify", NOTIFY),
+        )
+        for name, query in queries.items()
+    }
+)
+"""Statements executed by the service, indexed by their group and name"""
+
+register_metrics("database_statements", STATEMENTS.stats)
@@ -0,0 +1,184 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+# ----------------------------------------------------------------------------------
+
+
+class TTLCache:
+    """
+    Bounded in memory cache with LRU eviction and a time to live for every entry
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_bytes: Optional[int] = None):
+        """
+        :param maxsize: max number of entries stored
+        :param ttl: seconds after which an entry is considered expired
+        :param max_bytes: max sum of the sizes of the entries, unbounded if None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        """Number of lookups that found a valid entry"""
+        self.misses = 0
+        """Number of lookups that found nothing or an expired entry"""
+        self.evictions = 0
+        """Number of entries removed to respect the size bound"""
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Optional[Any]:
+        """
+        Extract a valid entry from the cache
+
+        :param key: entry key
+        :param default: value returned if the entry is missing or expired
+        :return: cached value
+        """
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expiration, size, value = item
+        if expiration < monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+        self, key: Hashable, value: Any, size: int = 0, ttl: Optional[float] = None
+    ):
+        """
+        Store an entry, evicting the least recently used ones if the cache is full
+
+        :param key: entry key
+        :param value: value to store
+        :param size: size in bytes of the entry, used only if max_bytes is set
+        :param ttl: time to live of the entry if shorter than the one of the cache
+        """
+        if self.maxsize <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._remove(key)
+        self._data[key] = (monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._data) > self.maxsize or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            _, (_, evicted_size, _) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        """
+        Remove an entry updating the size of the cache
+
+        :param key: entry key
+        """
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def pop(self, key: Hashable):
+        """
+        Invalidate an entry
+
+        :param key: entry key
+        """
+        self._remove(key)
+
+    def clear(self):
+        """Invalidate all the entries"""
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Cache statistics
+
+        :return: size and counters of the cache
+        """
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# ----------------------------------------------------------------------------------
+
+
+class SingleFlight:
+    """
+    Run at most one refresh at a time in the event loop, concurrent callers share it
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def running(self) -> bool:
+        """Check if a refresh is running in the current event loop"""
+        return (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is asyncio.get_running_loop()
+        )
+
+    def start(self, function: Callable[..., Awaitable], *args: Any) -> asyncio.Task:
+        """
+        Start a refresh unless one is already running
+
+        :param function: coroutine function performing the refresh
+        :param args: arguments of the function
+        :return: running refresh
+        """
+        if not self.running():
+            self._task = asyncio.get_running_loop().create_task(function(*args))
+            # The errors of the refreshes nobody waits for are handled by the function
+            self._task.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+        return self._task
+
+    async def run(self, function: Callable[..., Awaitable], *args: Any) -> Any:
+        """
+        Wait for the running refresh, starting it if needed
+
+        :param function: coroutine function performing the refresh
+        :param args: arguments of the function
+        :return: result of the refresh
+        """
+        # A cancelled caller must not stop the refresh shared with the others
+        return await asyncio.shield(self.start(function, *args))
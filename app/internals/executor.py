@@ -0,0 +1,155 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+# Internal
+from .metrics import register_metrics
+from ..config import get_security_settings
+
+# ----------------------------------------------------------------------------------
+
+
+class CryptoExecutor:
+    """
+    Run the cpu bound cryptographic operations outside of the event loop
+    """
+
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        """
+        :param kind: inline to run the operations in the event loop, thread or process
+        :param workers: number of threads or processes
+        :param max_pending: max operations waiting for a worker, the ones exceeding
+                            the bound wait for a free slot before being submitted
+        """
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        if kind == "thread":
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix="crypto")
+        elif kind == "process":
+            self._executor = ProcessPoolExecutor(workers)
+        elif kind != "inline":
+            raise ValueError(f"unknown crypto executor {kind}")
+
+        self.pending = 0
+        """Operations submitted and not yet completed"""
+        self.max_queue_depth = 0
+        """Max number of operations found waiting for a worker"""
+        self.completed = 0
+        """Operations completed by the workers"""
+        self.inline = 0
+        """Operations run in the event loop"""
+        self.waiting = 0
+        """Operations waiting for a free slot in the queue"""
+        self.max_waiting = 0
+        """Max number of operations found waiting for a free slot"""
+
+    @property
+    def isolated(self) -> bool:
+        """True if the workers don't share the memory of the event loop"""
+        return self.kind == "process"
+
+    @property
+    def queue_depth(self) -> int:
+        """Operations waiting for a worker"""
+        return max(0, self.pending - self.workers)
+
+    async def run(self, function: Callable, *args: Any) -> Any:
+        """
+        Run a function in a worker
+
+        :param function: function to run, must be picklable for the process workers
+        :param args: arguments of the function
+        :return: result of the function
+        """
+        if self._executor is None:
+            self.inline += 1
+            return function(*args)
+
+        if self._slots is None:
+            # Created in the running loop, python 3.9 binds it to the loop at creation
+            self._slots = asyncio.Semaphore(self.workers + self.max_pending)
+        if self._slots.locked():
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await self._slots.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, function, *args
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def shutdown(self):
+        """Stop the workers"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """
+        Executor statistics
+
+        :return: size, queue depth and counters of the executor
+        """
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "inline": self.inline,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_crypto_executor() -> CryptoExecutor:
+    """Obtain as a singleton the executor of the cryptographic operations"""
+    settings = get_security_settings()
+    return CryptoExecutor(
+        settings.crypto_executor,
+        settings.crypto_executor_workers,
+        settings.crypto_executor_max_pending,
+    )
+
+
+def close_crypto_executor():
+    """
+    Stop the workers of the instantiated executor
+    """
+    get_crypto_executor().shutdown()
+    get_crypto_executor.cache_clear()
+
+
+register_metrics("crypto_executor", lambda: get_crypto_executor().stats())
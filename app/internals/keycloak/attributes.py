@@ -13,6 +13,7 @@
 """
 
 # Standard Library
+from functools import lru_cache
 from typing import Optional
 
 # Third Party
@@ -22,14 +23,30 @@ from httpx import HTTPStatusError, RequestError
 from pydantic import ValidationError
 
 # Internal
+from ..cache import TTLCache
 from ..logger import log_http_status_error, log_http_request_error
+from ..metrics import register_metrics
 from ..session import get_keycloak_session
-from ...config import get_brainpep_settings
+from ...config import get_brainpep_settings, get_cache_settings
 from ...models.keycloak.attributes import Attributes
 
 # ------------------------------------------------------------------------------
 
 
+@lru_cache(maxsize=1)
+def get_user_identifier_cache() -> TTLCache:
+    """Obtain as a singleton the identifiers of the users indexed by keycloak id"""
+    settings = get_cache_settings()
+    return TTLCache(
+        settings.user_identifier_cache_size, settings.user_identifier_cache_ttl
+    )
+
+
+register_metrics("user_identifier_cache", lambda: get_user_identifier_cache().stats())
+
+# ------------------------------------------------------------------------------
+
+
 async def get_user_identifier(
     admin_token: str,
     keycloak_id: str,
@@ -41,6 +58,11 @@ async def get_user_identifier(
     :param keycloak_id: User identifier
     :return: Identifier of the attributes associated to the user
     """
+    # The identifier never changes once set, ask keycloak only the first time
+    cache = get_user_identifier_cache()
+    identifier = cache.get(keycloak_id)
+    if identifier is not None:
+        return identifier
 
     # Get settings
     settings = get_brainpep_settings()
@@ -50,17 +72,20 @@ async def get_user_identifier(
     try:
         # Get user attributes
         response = await connection.get(
-            f"{url}", headers={"Authorization": f"Bearer {admin_token}"}, timeout=10
+            f"{url}", headers={"Authorization": f"Bearer {admin_token}"}
         )
         try:
             # Check if the token is expired
             response.raise_for_status()
             try:
-                return Attributes.parse_raw(
+                identifier = Attributes.parse_raw(
                     response.content
                 ).attributes.device_policy_list
             except ValidationError:
                 return None
+            if identifier:
+                cache.set(keycloak_id, identifier)
+            return identifier
 
         except HTTPStatusError as exc:
             await log_http_status_error(exc, admin_token)
@@ -100,11 +125,11 @@ async def set_user_identifier(admin_token: str, user_id: str) -> str:
             url,
             json={"attributes": {"device_policy_list": identifier}},
             headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10,
         )
         try:
             # Check if everything is ok
             response.raise_for_status()
+            get_user_identifier_cache().set(user_id, identifier)
             return identifier
 
         except HTTPStatusError as exc:
@@ -0,0 +1,206 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from functools import lru_cache
+from time import monotonic
+from typing import Dict, Optional
+
+# Third Party
+from httpx import HTTPStatusError, RequestError
+from jose import jwk, JWTError
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+from orjson import loads
+
+# Internal
+from ..cache import SingleFlight
+from ..logger import get_logger, log_http_request_error
+from ..metrics import register_metrics
+from ..session import get_keycloak_session
+from ...config import get_security_settings
+
+# ------------------------------------------------------------------------------
+
+
+class RealmKeySet:
+    """
+    Public keys published by keycloak to verify the tokens of the realm, indexed by kid
+    """
+
+    def __init__(
+        self,
+        url: str,
+        algorithm: str,
+        refresh_interval: float,
+        min_refresh_interval: float,
+    ):
+        """
+        :param url: url of the realm certs (JWKS)
+        :param algorithm: algorithm of the keys that don't declare it
+        :param refresh_interval: seconds after which the keys are refreshed
+                                 in background
+        :param min_refresh_interval: min seconds between two refreshes caused by
+                                     tokens signed with an unknown kid
+        """
+        self.url = url
+        self.algorithm = algorithm
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Key] = {}
+        self._refreshed_at: Optional[float] = None
+        self._refreshing = SingleFlight()
+
+        self.refreshes = 0
+        """Number of successful refreshes"""
+        self.failed_refreshes = 0
+        """Number of refreshes failed"""
+        self.rate_limited = 0
+        """Number of unknown kid not refreshed to respect the min interval"""
+
+    def _parse(self, content: bytes) -> Dict[str, Key]:
+        """
+        Prepare the signature keys of a JWKS
+
+        :param content: JWKS
+        :return: prepared keys indexed by kid
+        """
+        document = loads(content)
+        keys = {}
+        for key_data in document.get("keys", []) if isinstance(document, dict) else []:
+            if "kid" not in key_data or key_data.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[key_data["kid"]] = jwk.construct(
+                    key_data, key_data.get("alg", self.algorithm)
+                )
+            except JWKError:
+                # Key of an algorithm not supported
+                continue
+        return keys
+
+    async def _fetch(self):
+        """
+        Download the keys, keeping the previous ones if something goes wrong
+        """
+        self._refreshed_at = monotonic()
+        client = get_keycloak_session()
+        try:
+            response = await client.get(self.url)
+            response.raise_for_status()
+            self._keys = self._parse(response.content)
+            self.refreshes += 1
+
+        except HTTPStatusError as error:
+            self.failed_refreshes += 1
+            await get_logger().warning(
+                {
+                    "msg": "Can't refresh the realm keys",
+                    "url": error.request.url,
+                    "status_code": error.response.status_code,
+                }
+            )
+
+        except RequestError as error:
+            self.failed_refreshes += 1
+            await log_http_request_error(error)
+
+        except ValueError:
+            self.failed_refreshes += 1
+            await get_logger().warning({"msg": "Invalid JWKS", "url": self.url})
+
+    async def refresh(self):
+        """
+        Refresh the keys, waiting for the refresh already running if any
+        """
+        await self._refreshing.run(self._fetch)
+
+    def _lookup(self, kid: Optional[str]) -> Optional[Key]:
+        """
+        Find the key of a kid
+
+        :param kid: key identifier, if missing the only key published is used
+        :return: prepared key
+        """
+        if kid is None:
+            return next(iter(self._keys.values())) if len(self._keys) == 1 else None
+        return self._keys.get(kid)
+
+    async def get_key(self, kid: Optional[str]) -> Key:
+        """
+        Obtain the key used to sign a token
+
+        :param kid: key identifier declared in the token header
+        :return: prepared key
+        """
+        if self._refreshed_at is None:
+            await self.refresh()
+        elif monotonic() - self._refreshed_at >= self.refresh_interval:
+            # Keep using the current keys while the new ones are downloaded
+            self._refreshing.start(self._fetch)
+
+        key = self._lookup(kid)
+        if key is None:
+            if self._refreshing.running() or (
+                monotonic() - self._refreshed_at >= self.min_refresh_interval
+            ):
+                # Key rotated after the last refresh
+                await self.refresh()
+                key = self._lookup(kid)
+            else:
+                self.rate_limited += 1
+
+        if key is None:
+            raise JWTError(f"Unknown key {kid}")
+        return key
+
+    def stats(self) -> dict:
+        """
+        Key set statistics
+
+        :return: size and counters of the key set
+        """
+        return {
+            "keys": len(self._keys),
+            "refreshes": self.refreshes,
+            "failed_refreshes": self.failed_refreshes,
+            "rate_limited": self.rate_limited,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_realm_key_set() -> Optional[RealmKeySet]:
+    """
+    Obtain as a singleton the key set of the realm
+
+    :return: key set, None if the tokens are verified with the static REALM_PUBLIC_KEY
+    """
+    settings = get_security_settings()
+    if not settings.realm_jwks_url:
+        return None
+    return RealmKeySet(
+        settings.realm_jwks_url,
+        settings.algorithm,
+        settings.realm_jwks_refresh_interval,
+        settings.realm_jwks_min_refresh_interval,
+    )
+
+
+def _realm_key_set_stats() -> dict:
+    """Statistics of the key set, empty if the key set is not used"""
+    key_set = get_realm_key_set()
+    return {} if key_set is None else key_set.stats()
+
+
+register_metrics("realm_key_set", _realm_key_set_stats)
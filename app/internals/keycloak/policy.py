@@ -13,6 +13,8 @@
 """
 
 # Standard Library
+from functools import lru_cache
+from time import monotonic
 from typing import Optional, List
 
 # Third Party
@@ -20,16 +22,20 @@ from fastapi import HTTPException, status
 from httpx import HTTPStatusError, RequestError
 
 # Internal
-from .token import get_admin_token
+from .token import get_admin_token, get_admin_token_manager
+from ..cache import SingleFlight
 from ..logger import log_http_status_error, log_http_request_error
+from ..metrics import register_metrics
 from ..session import get_keycloak_session
-from ...config import get_brainpep_settings
+from ...config import get_brainpep_settings, get_cache_settings
 from ...models.keycloak.role import parse_roles
 
 # ------------------------------------------------------------------------------
 
 
-async def get_available_policies(admin_token: Optional[str] = None) -> List[str]:
+async def _request_available_policies(
+    admin_token: Optional[str] = None,
+) -> Optional[List[str]]:
     """
     Extract a Policies from BrainPep-API
 
@@ -49,7 +55,6 @@ async def get_available_policies(admin_token: Optional[str] = None) -> List[str]
         response = await client.get(
             settings.policy_request_url,
             headers={"Authorization": f"Bearer {admin_token}"},
-            timeout=10,
         )
         try:
             # Check if the token is expired
@@ -58,6 +63,9 @@ async def get_available_policies(admin_token: Optional[str] = None) -> List[str]
 
         except HTTPStatusError as error:
             await log_http_status_error(error, admin_token)
+            if error.response.status_code == status.HTTP_401_UNAUTHORIZED:
+                # Stop using a token keycloak rejected before its expiration
+                get_admin_token_manager().discard(admin_token)
 
     except RequestError as error:
         # Something went wrong during the connection
@@ -66,3 +74,107 @@ async def get_available_policies(admin_token: Optional[str] = None) -> List[str]
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Can't contact Keycloak service",
         )
+
+
+# ------------------------------------------------------------------------------
+
+
+class PolicyCatalogue:
+    """
+    Policies available on the system, refreshed in background once expired and
+    served from memory while keycloak can't be contacted
+    """
+
+    def __init__(self, ttl: float):
+        """
+        :param ttl: seconds after which the policies are refreshed
+        """
+        self.ttl = ttl
+        self._policies: Optional[List[str]] = None
+        self._fetched_at = 0.0
+        self._refreshing = SingleFlight()
+
+        self.hits = 0
+        """Number of lookups served with valid policies"""
+        self.stale_hits = 0
+        """Number of lookups served with expired policies while refreshing them"""
+        self.misses = 0
+        """Number of lookups that waited for keycloak"""
+        self.failed_refreshes = 0
+        """Number of refreshes failed"""
+
+    async def _fetch(self, admin_token: Optional[str]) -> Optional[List[str]]:
+        """
+        Download the policies, keeping the last known ones if something goes wrong
+
+        :param admin_token: Administrator token
+        :return: Policies
+        """
+        try:
+            policies = await _request_available_policies(admin_token)
+        except HTTPException:
+            self.failed_refreshes += 1
+            if self._policies is None:
+                raise
+            return self._policies
+
+        if policies is None:
+            # Keycloak refused the request, already logged
+            self.failed_refreshes += 1
+            return self._policies
+
+        self._policies = policies
+        self._fetched_at = monotonic()
+        return policies
+
+    async def get(self, admin_token: Optional[str] = None) -> Optional[List[str]]:
+        """
+        Obtain the available policies
+
+        :param admin_token: Administrator token, used if keycloak must be contacted
+        :return: Policies
+        """
+        if self._policies is None:
+            self.misses += 1
+            policies = await self._refreshing.run(self._fetch, admin_token)
+            return None if policies is None else list(policies)
+
+        if monotonic() - self._fetched_at >= self.ttl:
+            self.stale_hits += 1
+            self._refreshing.start(self._fetch, admin_token)
+        else:
+            self.hits += 1
+        return list(self._policies)
+
+    def stats(self) -> dict:
+        """
+        Catalogue statistics
+
+        :return: size and counters of the catalogue
+        """
+        return {
+            "size": 0 if self._policies is None else len(self._policies),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "failed_refreshes": self.failed_refreshes,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_policy_catalogue() -> PolicyCatalogue:
+    """Obtain as a singleton the catalogue of the available policies"""
+    return PolicyCatalogue(get_cache_settings().policy_catalogue_ttl)
+
+
+register_metrics("policy_catalogue", lambda: get_policy_catalogue().stats())
+
+
+async def get_available_policies(admin_token: Optional[str] = None) -> List[str]:
+    """
+    Extract a Policies from BrainPep-API, using the catalogue in memory
+
+    :param admin_token: Administrator token, used if keycloak must be contacted
+    :return: Policies
+    """
+    return await get_policy_catalogue().get(admin_token)
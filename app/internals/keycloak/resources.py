@@ -20,7 +20,7 @@ from fastapi import HTTPException, status
 from httpx import HTTPStatusError, RequestError
 
 # Internal
-from .token import get_brain_pep_token
+from .token import get_brain_pep_token, get_client_token_manager
 from ..logger import log_http_status_error, log_http_request_error
 from ..session import get_keycloak_session
 from ...config import get_brainpep_settings
@@ -28,6 +28,9 @@ from ...models.brain_pep.service import Service, get_service_id
 
 # ------------------------------------------------------------------------------
 
+UNREACHABLE = "Can't contact Brain-Pep-Api service"
+"""Detail of the errors raised when keycloak can't be contacted"""
+
 
 async def _get_token_url(identifier: Optional[str] = None) -> Tuple[str, str]:
     """
@@ -45,6 +48,17 @@ async def _get_token_url(identifier: Optional[str] = None) -> Tuple[str, str]:
     return token, f"{settings.resource_request_url}"
 
 
+def _discard_rejected_token(error: HTTPStatusError, token: str):
+    """
+    Stop using a token keycloak rejected before its expiration
+
+    :param error: error of the request
+    :param token: token used in the request
+    """
+    if error.response.status_code == status.HTTP_401_UNAUTHORIZED:
+        get_client_token_manager().discard(token)
+
+
 async def insert_resource(resource: Service) -> str:
     """
     Insert resource on keycloak
@@ -66,6 +80,7 @@ async def insert_resource(resource: Service) -> str:
             return get_service_id(response.content)
         except HTTPStatusError as error:
             await log_http_status_error(error, token)
+            _discard_rejected_token(error, token)
             raise HTTPException(
                 status_code=error.response.status_code, detail=str(repr(error))
             )
@@ -74,7 +89,7 @@ async def insert_resource(resource: Service) -> str:
         await log_http_request_error(error)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Can't contact Brain-Pep-Api service",
+            detail=UNREACHABLE,
         )
 
 
@@ -98,6 +113,7 @@ async def update_resource(identifier: str, resource: Service) -> None:
             response.raise_for_status()
         except HTTPStatusError as error:
             await log_http_status_error(error, token)
+            _discard_rejected_token(error, token)
             raise HTTPException(
                 status_code=error.response.status_code, detail=str(repr(error))
             )
@@ -106,7 +122,7 @@ async def update_resource(identifier: str, resource: Service) -> None:
         await log_http_request_error(error)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Can't contact Brain-Pep-Api service",
+            detail=UNREACHABLE,
         )
 
 
@@ -129,6 +145,7 @@ async def delete_resource(identifier: str) -> None:
             response.raise_for_status()
         except HTTPStatusError as error:
             await log_http_status_error(error, token)
+            _discard_rejected_token(error, token)
             raise HTTPException(
                 status_code=error.response.status_code, detail=str(repr(error))
             )
@@ -137,5 +154,5 @@ async def delete_resource(identifier: str) -> None:
         await log_http_request_error(error)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Can't contact Brain-Pep-Api service",
+            detail=UNREACHABLE,
         )
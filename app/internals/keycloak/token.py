@@ -12,20 +12,28 @@
  ******************************************************************************
 """
 
+# Standard Library
+from functools import lru_cache
+from time import monotonic
+from typing import Optional
+
 # Third Party
 from fastapi import status, HTTPException
 from httpx import HTTPStatusError, RequestError
 
 # Internal
 from .constants import ADMIN_DATA, CLIENT_DATA
-from ..session import get_keycloak_session
+from ..cache import SingleFlight
+from ..metrics import register_metrics
+from ..session import get_keycloak_session, keycloak_timeout
 from ..logger import get_logger, log_http_status_error, log_http_request_error
+from ...config import get_cache_settings, get_keycloak_settings
 from ...models.security import Token
 
 # ----------------------------------------------------------------------------------
 
 
-async def _get_token(url: str, data: dict) -> str:
+async def _get_token(url: str, data: dict) -> Token:
     """
     Extract a Token from keycloak
 
@@ -40,7 +48,7 @@ async def _get_token(url: str, data: dict) -> str:
         response = await connection.post(
             url=url,
             data=data,
-            timeout=25,
+            timeout=keycloak_timeout(get_keycloak_settings().keycloak_token_timeout),
         )
         try:
             response.raise_for_status()
@@ -56,7 +64,165 @@ async def _get_token(url: str, data: dict) -> str:
             detail="Can't contact Keycloak service",
         )
 
-    return Token.parse_raw(response.content).access_token
+    return Token.parse_raw(response.content)
+
+
+# ----------------------------------------------------------------------------------
+
+
+class TokenManager:
+    """
+    Keep a Keycloak access token until shortly before it expires, refreshing it
+    in background when it is about to expire
+    """
+
+    def __init__(
+        self, url: str, data: dict, expiry_margin: float, refresh_ahead: float
+    ):
+        """
+        :param url: Url to request the token
+        :param data: credentials to request the token
+        :param expiry_margin: seconds before the expiration after which a token
+                              is not used anymore
+        :param refresh_ahead: seconds before the expiration after which a token
+                              is refreshed in background, at most half of its
+                              validity
+        """
+        self.url = url
+        self.data = data
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = refresh_ahead
+        self._token: Optional[Token] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._refresh_expires_at: Optional[float] = None
+        self._refreshing = SingleFlight()
+
+        self.hits = 0
+        """Number of tokens served without contacting keycloak"""
+        self.requests = 0
+        """Number of tokens requested with the credentials"""
+        self.refreshes = 0
+        """Number of tokens requested with the refresh token"""
+        self.discarded = 0
+        """Number of tokens rejected by keycloak before their expiration"""
+
+    def _can_refresh(self, now: float) -> bool:
+        """Check if the refresh token can still be used"""
+        if self._token is None or self._token.refresh_token is None:
+            return False
+        return self._refresh_expires_at is None or now < self._refresh_expires_at
+
+    async def _request(self) -> str:
+        """
+        Obtain a new access token, using the refresh token if possible
+
+        :return: access token
+        """
+        now = monotonic()
+        token = None
+        if self._can_refresh(now):
+            data = {
+                "grant_type": "refresh_token",
+                "refresh_token": self._token.refresh_token,
+                "client_id": self.data["client_id"],
+            }
+            if "client_secret" in self.data:
+                data["client_secret"] = self.data["client_secret"]
+            try:
+                token = await _get_token(self.url, data)
+                self.refreshes += 1
+            except HTTPException:
+                # Session closed by keycloak, use the credentials
+                pass
+        if token is None:
+            token = await _get_token(self.url, self.data)
+            self.requests += 1
+
+        if token.expires_in is None:
+            # Validity unknown, the token can't be reused
+            self._token = None
+        else:
+            self._token = token
+            self._expires_at = now + token.expires_in - self.expiry_margin
+            # A short lived token would be refreshed on every call
+            self._refresh_at = (
+                now + token.expires_in - min(self.refresh_ahead, token.expires_in / 2)
+            )
+            self._refresh_expires_at = (
+                now + token.refresh_expires_in - self.expiry_margin
+                if token.refresh_expires_in
+                else None
+            )
+        return token.access_token
+
+    async def get_token(self) -> str:
+        """
+        Obtain a valid access token
+
+        :return: access token
+        """
+        now = monotonic()
+        if self._token is not None and now < self._expires_at:
+            if now >= self._refresh_at:
+                # Keep using the current token while the new one is requested
+                self._refreshing.start(self._request)
+            self.hits += 1
+            return self._token.access_token
+        return await self._refreshing.run(self._request)
+
+    def discard(self, access_token: str):
+        """
+        Stop using a token keycloak rejected, the next call obtains a new one
+
+        :param access_token: token rejected
+        """
+        if self._token is not None and self._token.access_token == access_token:
+            self._token = None
+            self.discarded += 1
+
+    def stats(self) -> dict:
+        """
+        Token manager statistics
+
+        :return: counters of the token manager
+        """
+        return {
+            "hits": self.hits,
+            "requests": self.requests,
+            "refreshes": self.refreshes,
+            "discarded": self.discarded,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_admin_token_manager() -> TokenManager:
+    """Obtain as a singleton the manager of the administrator token"""
+    settings = get_cache_settings()
+    return TokenManager(
+        ADMIN_DATA["url"],
+        ADMIN_DATA["data"],
+        settings.token_expiry_margin,
+        settings.token_refresh_ahead,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_client_token_manager() -> TokenManager:
+    """Obtain as a singleton the manager of the BrainPep-Api client token"""
+    settings = get_cache_settings()
+    return TokenManager(
+        CLIENT_DATA["url"],
+        CLIENT_DATA["data"],
+        settings.token_expiry_margin,
+        settings.token_refresh_ahead,
+    )
+
+
+register_metrics("admin_token", lambda: get_admin_token_manager().stats())
+register_metrics("client_token", lambda: get_client_token_manager().stats())
+
+# ----------------------------------------------------------------------------------
 
 
 async def get_admin_token() -> str:
@@ -65,7 +231,7 @@ async def get_admin_token() -> str:
 
     :return: BrainPepApi valid token
     """
-    return await _get_token(ADMIN_DATA["url"], ADMIN_DATA["data"])
+    return await get_admin_token_manager().get_token()
 
 
 async def get_brain_pep_token() -> str:
@@ -74,4 +240,4 @@ async def get_brain_pep_token() -> str:
 
     :return: BrainPepApi valid token
     """
-    return await _get_token(CLIENT_DATA["url"], CLIENT_DATA["data"])
+    return await get_client_token_manager().get_token()
@@ -0,0 +1,96 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+# ----------------------------------------------------------------------------------
+
+_METRICS: Dict[str, Callable[[], dict]] = {}
+"""Providers of the metrics exposed by the worker"""
+
+
+def register_metrics(name: str, provider: Callable[[], dict]):
+    """
+    Expose the metrics of a component
+
+    :param name: name of the component
+    :param provider: function returning the current metrics of the component
+    """
+    _METRICS[name] = provider
+
+
+def collect_metrics() -> Dict[str, dict]:
+    """
+    Collect the current metrics of all the components
+
+    :return: metrics of every component
+    """
+    return {name: provider() for name, provider in _METRICS.items()}
+
+
+# ----------------------------------------------------------------------------------
+
+
+class StageLatency:
+    """
+    Latency of the stages of a request, to see which one dominates when they run
+    concurrently
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, List[float]] = {}
+        """Stage name -> [count, total seconds, max seconds]"""
+
+    def record(self, stage: str, seconds: float):
+        """
+        Record the duration of a stage
+
+        :param stage: name of the stage
+        :param seconds: duration
+        """
+        stats = self._stages.setdefault(stage, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    async def measure(self, stage: str, awaitable: Awaitable) -> Any:
+        """
+        Await a stage recording its duration, failed stages included
+
+        :param stage: name of the stage
+        :param awaitable: stage to run
+        :return: result of the stage
+        """
+        start = perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def stats(self) -> dict:
+        """
+        Stage statistics
+
+        :return: count and latencies in milliseconds of every stage
+        """
+        return {
+            stage: {
+                "count": count,
+                "mean_ms": total * 1000 / count,
+                "max_ms": maximum * 1000,
+            }
+            for stage, (count, total, maximum) in self._stages.items()
+        }
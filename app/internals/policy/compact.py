@@ -0,0 +1,193 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+
+Compact signed policies, a binary alternative to the JWS for constrained gateways.
+All the integers are big endian:
+
+    +---------+-----------+-----------+-------------+------------+-----------+
+    | version | id length | device id | policy mask | storage    | signature |
+    | uint8   | uint8     | utf-8     | uint32      | int64      |           |
+    +---------+-----------+-----------+-------------+------------+-----------+
+
+The policy mask has the bit of every policy of the device set, in the order of the
+Policy enum. The storage is the epoch until which the data can be stored, 0 if it
+can't be stored. The signature covers all the preceding bytes and is computed with
+the key and the algorithm of the JWS.
+"""
+
+# Standard Library
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from typing import Tuple
+
+# Third Party
+from fastapi import HTTPException, status
+from orjson import dumps
+
+# Internal
+from .engine import CompiledDevice, compile_device
+from ..executor import get_crypto_executor
+from ...models.brain_pep.device import Device
+from ...security.keys import get_policy_signer, get_policy_verifier
+from ...security.policy_rsa import get_verified_token_cache
+
+# ---------------------------------------------------------------------------------------
+
+COMPACT_MEDIA_TYPE = "application/vnd.brainpep.policy"
+"""Media type requested by the gateways that want the compact signed policies"""
+
+COMPACT_VERSION = 1
+"""Version of the layout"""
+
+_HEADER = struct.Struct(">BB")
+"""Version and length of the device id"""
+
+_POLICIES = struct.Struct(">Iq")
+"""Policy mask and storage expiration"""
+
+# ---------------------------------------------------------------------------------------
+
+
+def encode_compact_policies(device: Device) -> bytes:
+    """
+    Encode the policies of a device, without the signature
+
+    :param device: device to encode
+    :return: policies in the compact layout
+    """
+    compiled = compile_device(device)
+    device_id = compiled.device_id.encode()
+    if len(device_id) > 255:
+        raise ValueError("device id too long for the compact layout")
+    return b"".join(
+        (
+            _HEADER.pack(COMPACT_VERSION, len(device_id)),
+            device_id,
+            _POLICIES.pack(compiled.mask, int(compiled.storage_expiration or 0)),
+        )
+    )
+
+
+def decode_compact_policies(token: bytes) -> Tuple[bytes, CompiledDevice, bytes]:
+    """
+    Decode signed compact policies, without verifying the signature
+
+    :param token: signed compact policies
+    :return: signed bytes, compiled device and signature
+    """
+    try:
+        version, id_length = _HEADER.unpack_from(token)
+        if version != COMPACT_VERSION:
+            raise ValueError(f"unknown compact policies version {version}")
+        offset = _HEADER.size + id_length
+        device_id = token[_HEADER.size : offset].decode()
+        mask, storage_expiration = _POLICIES.unpack_from(token, offset)
+    except (struct.error, UnicodeDecodeError) as error:
+        raise ValueError(error)
+
+    offset += _POLICIES.size
+    return (
+        token[:offset],
+        CompiledDevice(
+            device_id=device_id,
+            mask=mask,
+            storage_expiration=storage_expiration or None,
+        ),
+        token[offset:],
+    )
+
+
+def to_text(token: bytes) -> str:
+    """
+    Convert signed compact policies to be sent inside a json
+
+    :param token: signed compact policies
+    :return: token in base64url format without padding
+    """
+    return urlsafe_b64encode(token).rstrip(b"=").decode()
+
+
+def from_text(text: str) -> bytes:
+    """
+    Convert signed compact policies received inside a json
+
+    :param text: token in base64url format
+    :return: signed compact policies
+    """
+    try:
+        return urlsafe_b64decode(text + "=" * (-len(text) % 4))
+    except (Base64Error, ValueError) as error:
+        raise ValueError(error)
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def sign_compact(message: bytes) -> bytes:
+    """
+    Append the signature to the compact policies
+
+    :param message: policies in the compact layout
+    :return: signed compact policies
+    """
+    return message + get_policy_signer().key.sign(message)
+
+
+def verify_compact(message: bytes, signature: bytes) -> bool:
+    """
+    Verify the signature of the compact policies
+
+    :param message: signed bytes
+    :param signature: signature
+    :return: True if the signature is valid
+    """
+    return get_policy_verifier().key.verify(message, signature)
+
+
+async def sign_compact_policies(device: Device) -> bytes:
+    """
+    Sign the policies of a device in the compact layout in the crypto executor
+
+    :param device: device to sign
+    :return: signed compact policies
+    """
+    return await get_crypto_executor().run(
+        sign_compact, encode_compact_policies(device)
+    )
+
+
+async def verify_compact_policies(text: str) -> CompiledDevice:
+    """
+    Verify signed compact policies in the crypto executor, the cached signatures
+    are returned without leaving the event loop
+
+    :param text: signed compact policies in base64url format
+    :return: compiled device
+    """
+    cache = get_verified_token_cache()
+    policies = cache.get(text)
+    if policies is not None:
+        return CompiledDevice(**policies)
+
+    try:
+        message, device, signature = decode_compact_policies(from_text(text))
+        valid = await get_crypto_executor().run(verify_compact, message, signature)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid jws"
+        )
+    cache.set(text, device.device_id, dumps(device._asdict()))
+    return device
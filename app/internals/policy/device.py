@@ -12,15 +12,192 @@
  ******************************************************************************
 """
 
+# Standard Library
+import asyncio
+from functools import lru_cache
+from hashlib import blake2b
+from typing import List, NamedTuple, Optional, Tuple
+
+# Third Party
+from fastapi import HTTPException, status
+
 # Internal
-from ..keycloak.attributes import get_user_identifier, set_user_identifier
+from .compact import from_text, sign_compact_policies
+from ..cache import TTLCache
+from ..keycloak.attributes import (
+    get_user_identifier,
+    get_user_identifier_cache,
+    set_user_identifier,
+)
 from ..keycloak.token import get_admin_token
 from ..keycloak.policy import get_available_policies
+from ..metrics import StageLatency, register_metrics
+from ...config import get_cache_settings
 from ...db.postgresql import get_database
 from ...models.brain_pep.device import Device, UserDevicesPolicy
 from ...models.response import PolicyUpdated
-from ...models.security import Requester, SignedMessage
-from ...security.policy_rsa import sign_user_policies
+from ...models.security import Requester
+from ...security.policy_rsa import get_verified_token_cache, sign_user_policies_async
+
+# ---------------------------------------------------------------------------------------
+
+
+class SignedPolicies(NamedTuple):
+    """Signed policies of a device"""
+
+    signature: str
+    """JWS containing the device policies"""
+
+    etag: str
+    """Version of the signed policies"""
+
+
+class CompactPolicies(NamedTuple):
+    """Signed policies of a device in the compact layout"""
+
+    token: bytes
+    """Signed compact policies"""
+
+    etag: str
+    """Version of the signed policies"""
+
+
+def _etag(signed: bytes) -> str:
+    """
+    Compute the version of signed policies
+
+    :param signed: signed policies
+    :return: quoted ETag
+    """
+    return f'"{blake2b(signed, digest_size=16).hexdigest()}"'
+
+
+def signed_policies(signature: str) -> SignedPolicies:
+    """
+    Associate to a signature its version
+
+    :param signature: JWS containing the device policies
+    :return: signed policies
+    """
+    return SignedPolicies(signature=signature, etag=_etag(signature.encode()))
+
+
+def compact_policies(token: bytes) -> CompactPolicies:
+    """
+    Associate to signed compact policies their version
+
+    :param token: signed compact policies
+    :return: signed compact policies
+    """
+    return CompactPolicies(token=token, etag=_etag(token))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check if the version known by the client is still valid
+
+    :param if_none_match: value of the If-None-Match header
+    :param etag: current version
+    :return: True if the client already has the current version
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@lru_cache(maxsize=1)
+def get_signed_policy_store() -> TTLCache:
+    """Obtain as a singleton the store of the signed device policies"""
+    settings = get_cache_settings()
+    return TTLCache(settings.signed_policy_cache_size, settings.signed_policy_cache_ttl)
+
+
+@lru_cache(maxsize=1)
+def get_compact_policy_store() -> TTLCache:
+    """Obtain as a singleton the store of the compact signed device policies"""
+    settings = get_cache_settings()
+    return TTLCache(settings.signed_policy_cache_size, settings.signed_policy_cache_ttl)
+
+
+def invalidate_device_policies(device_id: Optional[str]):
+    """
+    Forget the signed policies of a device written by any worker
+
+    :param device_id: device identifier, None to forget the policies of every device
+    """
+    if device_id is None:
+        get_signed_policy_store().clear()
+        get_compact_policy_store().clear()
+        return
+    get_signed_policy_store().pop(device_id)
+    get_compact_policy_store().pop(device_id)
+    # Tokens signed with the previous policies must be verified again
+    get_verified_token_cache().invalidate_device(device_id)
+
+
+register_metrics("signed_policy_cache", lambda: get_signed_policy_store().stats())
+register_metrics("compact_policy_cache", lambda: get_compact_policy_store().stats())
+
+DASHBOARD_LATENCY = StageLatency()
+"""Latency of the stages of the devices dashboard"""
+
+register_metrics("device_dashboard", DASHBOARD_LATENCY.stats)
+
+
+# ---------------------------------------------------------------------------------------
+
+
+async def resolve_user_identifier(
+    keycloak_id: str, create: bool = False
+) -> Optional[str]:
+    """
+    Obtain the identifier of the user, looking in memory, then in the database and
+    only at last in keycloak, so a worker just started doesn't need keycloak
+
+    :param keycloak_id: User identifier
+    :param create: generate and store the identifier if the user doesn't have one
+    :return: Identifier of the attributes associated to the user
+    """
+    identifier = get_user_identifier_cache().get(keycloak_id)
+    if identifier is not None:
+        return identifier
+
+    database = get_database()
+    identifier = await database.extract_user_identifier(keycloak_id)
+    if identifier is not None:
+        get_user_identifier_cache().set(keycloak_id, identifier)
+        return identifier
+
+    # Obtain an admin token
+    admin_token = await get_admin_token()
+    # Extract user identifier from keycloak
+    identifier = await get_user_identifier(admin_token, keycloak_id)
+    if identifier is None and create:
+        # Generate a new one and store it in keycloak
+        identifier = await set_user_identifier(admin_token, keycloak_id)
+    if identifier:
+        await database.insert_user_identifier(keycloak_id, identifier)
+    return identifier
+
+
+async def sign_device_policies(device: Device) -> Tuple[str, bytes]:
+    """
+    Sign the policies of a device as JWS and in the compact layout, gateways will
+    receive always the same tokens
+
+    :param device: device to sign
+    :return: JWS and signed compact policies
+    """
+    signature, compact_signature = await asyncio.gather(
+        sign_user_policies_async(device.signature_conversion()),
+        sign_compact_policies(device),
+    )
+    return signature, compact_signature
+
 
 # ---------------------------------------------------------------------------------------
 
@@ -36,17 +213,19 @@ async def insert_user_device_policies(
     :param device: Device and it's associated policies
     """
 
-    # Obtain an admin token
-    admin_token = await get_admin_token()
-    # Extract user identifier fro keycloak
-    identifier = await get_user_identifier(admin_token, client.sub)
-    if identifier is None:
-        # Generate a new one and store it in keycloak
-        identifier = await set_user_identifier(admin_token, client.sub)
+    identifier = await resolve_user_identifier(client.sub, create=True)
+
+    signature, compact_signature = await sign_device_policies(device)
 
     # Get database
     database = get_database()
-    await database.insert_device(identifier, device, client.preferred_username)
+    await database.insert_device(
+        identifier, device, client.preferred_username, signature, compact_signature
+    )
+    get_signed_policy_store().set(device.device_id, signed_policies(signature))
+    get_compact_policy_store().set(
+        device.device_id, compact_policies(compact_signature)
+    )
     return PolicyUpdated()
 
 
@@ -63,9 +242,21 @@ async def update_user_device_policies(
     :param client: Requester
     :param device: Device and it's associated policies
     """
+    signature, compact_signature = await sign_device_policies(device)
+
     # Get database
     database = get_database()
-    await database.update_device(device, client.preferred_username)
+    if await database.update_device(
+        device, client.preferred_username, signature, compact_signature
+    ):
+        get_signed_policy_store().set(
+            device.device_id, signed_policies(signature)
+        )
+        get_compact_policy_store().set(
+            device.device_id, compact_policies(compact_signature)
+        )
+        # Tokens signed with the previous policies must be verified again
+        get_verified_token_cache().invalidate_device(device.device_id)
     return PolicyUpdated()
 
 
@@ -85,34 +276,53 @@ async def delete_user_device_policies(
     # Get database
     database = get_database()
     await database.delete_device(device_id, client.preferred_username)
+    get_signed_policy_store().pop(device_id)
+    get_compact_policy_store().pop(device_id)
+    # Tokens signed with the deleted policies must be verified again
+    get_verified_token_cache().invalidate_device(device_id)
     return PolicyUpdated()
 
 
 # ---------------------------------------------------------------------------------------
 
 
-async def get_user_device_policies(
-    client: Requester,
-) -> UserDevicesPolicy:
+async def _user_devices(client: Requester) -> List[Device]:
     """
-    Set User's devices policies
+    Extract the devices of the user, the identifier must be resolved first
 
     :param client: Requester
+    :return: devices of the user
     """
-
-    # Obtain an admin token
-    admin_token = await get_admin_token()
-    # Extract available_policy
-    available_policy = await get_available_policies(admin_token)
-    # Extract user identifier from keycloak
-    identifier = await get_user_identifier(admin_token, client.sub)
+    identifier = await DASHBOARD_LATENCY.measure(
+        "user_identifier", resolve_user_identifier(client.sub)
+    )
     if identifier is None:
-        return UserDevicesPolicy(available_policy=available_policy)
+        return []
 
     # Get database
     database = get_database()
-    device_list = await database.extract_all_devices(
-        identifier, client.preferred_username
+    return await DASHBOARD_LATENCY.measure(
+        "device_list",
+        database.extract_all_devices(identifier, client.preferred_username),
+    )
+
+
+async def get_user_device_policies(
+    client: Requester,
+) -> UserDevicesPolicy:
+    """
+    Set User's devices policies
+
+    :param client: Requester
+    """
+    # The available policies don't depend on the user, fetch them together with
+    # the devices of the user
+    available_policy, device_list = await DASHBOARD_LATENCY.measure(
+        "total",
+        asyncio.gather(
+            DASHBOARD_LATENCY.measure("available_policies", get_available_policies()),
+            _user_devices(client),
+        ),
     )
     return UserDevicesPolicy(
         available_policy=available_policy, device_policy_list=device_list
@@ -122,13 +332,70 @@ async def get_user_device_policies(
 # ---------------------------------------------------------------------------------------
 
 
-async def get_device_policies(device_id: str) -> SignedMessage:
+async def get_signed_device_policies(device_id: str) -> SignedPolicies:
     """
-    Extract a Policies from BrainPep-API
+    Extract the signed policies of a device and their version
 
     :param device_id: Device identifier
-    :return: DevicePolicyMapStrSigned
+    :return: signed policies
     """
-    database = get_database()
-    device = await database.extract_device(device_id)
-    return SignedMessage(signature=sign_user_policies(device.signature_conversion()))
+    store = get_signed_policy_store()
+    policies = store.get(device_id)
+    if policies is None:
+        database = get_database()
+        device, signature = await database.extract_device_signature(device_id)
+        if signature is None:
+            # Device stored before its policies were signed on write, store the
+            # signature so the other workers serve the same one
+            signature = await database.store_device_signature(
+                device_id,
+                await sign_user_policies_async(device.signature_conversion()),
+            )
+        policies = signed_policies(signature)
+        store.set(device_id, policies)
+    return policies
+
+
+async def get_compact_device_policies(device_id: str) -> CompactPolicies:
+    """
+    Extract the signed policies of a device in the compact layout and their version
+
+    :param device_id: Device identifier
+    :return: signed compact policies
+    """
+    store = get_compact_policy_store()
+    policies = store.get(device_id)
+    if policies is None:
+        database = get_database()
+        device, token = await database.extract_device_compact_signature(device_id)
+        if token is None:
+            # Device stored before its compact policies were signed on write, store
+            # the token so the other workers serve the same one
+            token = await database.store_device_compact_signature(
+                device_id, await sign_compact_policies(device)
+            )
+        policies = compact_policies(token)
+        store.set(device_id, policies)
+    return policies
+
+
+async def is_current_signature(device_id: str, signature: str) -> bool:
+    """
+    Check that a verified token is the one currently signed for the device, the
+    tokens signed before the last change of the device are revoked
+
+    :param device_id: Device identifier
+    :param signature: jws or compact policies in base64url format
+    :return: True if the token is the current one
+    """
+    try:
+        if "." in signature:
+            policies = await get_signed_device_policies(device_id)
+            return policies.signature == signature
+        policies = await get_compact_device_policies(device_id)
+        return policies.token == from_text(signature)
+    except HTTPException as error:
+        if error.status_code == status.HTTP_404_NOT_FOUND:
+            # The device was deleted
+            return False
+        raise
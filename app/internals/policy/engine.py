@@ -0,0 +1,140 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+# Internal
+from ...models.brain_pep.device import Device
+from ...models.brain_pep.policy import ServicePolicy
+from ...models.brain_pep.service import Service
+
+# ---------------------------------------------------------------------------------------
+
+
+POLICY_BIT = {policy.value: 1 << index for index, policy in enumerate(ServicePolicy)}
+"""Bit associated to every policy of the system"""
+
+STORAGE_BIT = POLICY_BIT[ServicePolicy.storage_policy.value]
+"""Bit of the storage policy, evaluated against the storage expiration"""
+
+
+def compile_policies(policy_list: Iterable[Optional[str]]) -> int:
+    """
+    Convert a list of policies in a bitmask
+
+    :param policy_list: policies to convert
+    :return: bitmask of the policies
+    """
+    mask = 0
+    for policy in policy_list:
+        if policy is not None:
+            mask |= POLICY_BIT[policy]
+    return mask
+
+
+class CompiledService(NamedTuple):
+    """Service with its scopes compiled in a bitmask"""
+
+    service: Service
+    """Original service"""
+
+    mask: int
+    """Required policies, storage policy excluded"""
+
+    requires_storage: bool
+    """True if the service stores the data"""
+
+
+class CompiledDevice(NamedTuple):
+    """Device with its policies compiled in a bitmask"""
+
+    device_id: str
+    """Device identifier"""
+
+    mask: int
+    """Granted policies"""
+
+    storage_expiration: Optional[float]
+    """Epoch until which the data can be stored, None if storage is not allowed"""
+
+
+def compile_service(service: Service) -> CompiledService:
+    """
+    Compile the scopes of a service
+
+    :param service: service to compile
+    :return: compiled service
+    """
+    mask = compile_policies(service.resource_scopes)
+    return CompiledService(
+        service=service,
+        mask=mask & ~STORAGE_BIT,
+        requires_storage=bool(mask & STORAGE_BIT),
+    )
+
+
+def compile_device(device: Device) -> CompiledDevice:
+    """
+    Compile the policies of a device
+
+    :param device: device to compile
+    :return: compiled device
+    """
+    return CompiledDevice(
+        device_id=device.device_id,
+        mask=compile_policies(device.policy_list),
+        storage_expiration=(
+            device.storage_policy.timestamp() if device.storage_policy else None
+        ),
+    )
+
+
+def is_allowed(
+    service: CompiledService, device: CompiledDevice, now: Optional[float] = None
+) -> bool:
+    """
+    Check if the data of the device can be forwarded to the service
+
+    :param service: compiled service
+    :param device: compiled device
+    :param now: epoch of the evaluation, current time if not given
+    :return: True if every policy required by the service is granted by the device
+    """
+    if service.mask & ~device.mask:
+        return False
+    if service.requires_storage:
+        if device.storage_expiration is None:
+            return False
+        return device.storage_expiration >= (time.time() if now is None else now)
+    return True
+
+
+def filter_services(
+    service_list: Iterable[CompiledService], device: CompiledDevice
+) -> List[Service]:
+    """
+    Filter the services allowed to receive the data of the device
+
+    :param service_list: compiled services to evaluate
+    :param device: compiled device
+    :return: allowed services, in the same order
+    """
+    now = time.time()
+    return [
+        compiled.service
+        for compiled in service_list
+        if is_allowed(compiled, device, now)
+    ]
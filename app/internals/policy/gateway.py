@@ -0,0 +1,218 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+from typing import List, Optional, Union
+
+# Third Party
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from orjson import dumps
+from pydantic import ValidationError
+
+# Internal
+from .compact import verify_compact_policies
+from .device import is_current_signature
+from .engine import CompiledDevice, compile_device
+from ..logger import get_logger
+from ...config import get_gateway_settings
+from ...db.postgresql import get_database
+from ...models.brain_pep.device import Device
+from ...models.brain_pep.service import GatewayDecision, GatewayService
+from ...security.policy_rsa import verify_signature_async
+
+# ---------------------------------------------------------------------------------------
+
+
+async def compile_signed_device(signature: str) -> CompiledDevice:
+    """
+    Verify a signed device and compile its policies
+
+    :param signature: jws or compact policies in base64url format
+    :return: compiled device
+    """
+    if "." not in signature:
+        # Only the jws contains dots
+        device = await verify_compact_policies(signature)
+    else:
+        try:
+            device = compile_device(
+                Device.parse_obj(await verify_signature_async(signature))
+            )
+        except ValidationError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid jws"
+            )
+    # A valid signature is not enough, the policies may have changed since
+    if not await is_current_signature(device.device_id, signature):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="revoked jws"
+        )
+    return device
+
+
+async def _compile_signed_device(
+    signature: str,
+) -> Union[CompiledDevice, HTTPException]:
+    """
+    Verify a signed device and compile its policies, returning the error
+
+    :param signature: jws or compact policies in base64url format
+    :return: compiled device or the reason why it was rejected
+    """
+    try:
+        return await compile_signed_device(signature)
+    except HTTPException as error:
+        return error
+
+
+async def evaluate_messages(
+    message_list: List[GatewayService],
+) -> List[GatewayDecision]:
+    """
+    Evaluate many messages verifying once every distinct signature and fetching
+    all the services at once, an invalid signature or an unknown service fails
+    only the messages containing it
+
+    :param message_list: messages of the gateways
+    :return: decision on every message, in the same order
+    """
+    signature_list = list({message.sign_device for message in message_list})
+    device_map = dict(
+        zip(
+            signature_list,
+            await asyncio.gather(
+                *(_compile_signed_device(signature) for signature in signature_list)
+            ),
+        )
+    )
+    valid_list = [
+        message
+        for message in message_list
+        if not isinstance(device_map[message.sign_device], HTTPException)
+    ]
+    database = get_database()
+    result_map = dict(
+        zip(
+            map(id, valid_list),
+            await database.filter_service_batch(
+                [
+                    (message.service_list, device_map[message.sign_device])
+                    for message in valid_list
+                ]
+            ),
+        )
+    )
+
+    decision_list = []
+    for message in message_list:
+        result = result_map.get(id(message), device_map[message.sign_device])
+        if isinstance(result, HTTPException):
+            decision = GatewayDecision(
+                status_code=result.status_code, detail=result.detail
+            )
+        else:
+            decision = GatewayDecision(status_code=status.HTTP_200_OK, services=result)
+        decision_list.append(decision)
+    return decision_list
+
+
+# ---------------------------------------------------------------------------------------
+
+
+async def _evaluate_message(raw_message: str) -> str:
+    """
+    Evaluate a message received on the decision stream
+
+    :param raw_message: json encoded GatewayService
+    :return: json encoded decision
+    """
+    try:
+        message = GatewayService.parse_raw(raw_message)
+        (decision,) = await evaluate_messages([message])
+        decision = decision.dict(exclude_none=True)
+    except ValidationError as error:
+        decision = {
+            "status_code": status.HTTP_422_UNPROCESSABLE_ENTITY,
+            "detail": error.errors(),
+        }
+    except HTTPException as error:
+        decision = {"status_code": error.status_code, "detail": error.detail}
+    except Exception as error:
+        # Only this message fails, the stream goes on
+        await get_logger().error(
+            {"msg": "Decision stream evaluation failed", "error": repr(error)}
+        )
+        decision = {
+            "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "detail": "Something went wrong evaluating the message",
+        }
+    return dumps(decision, default=str).decode()
+
+
+async def _receive_messages(websocket: WebSocket, pending: asyncio.Queue):
+    """
+    Start the evaluation of every received message, waiting while too many
+    decisions are pending so the gateway is slowed down by the socket
+
+    :param websocket: gateway connection
+    :param pending: queue of the decisions not yet sent
+    """
+    try:
+        while True:
+            raw_message = await websocket.receive_text()
+            await pending.put(asyncio.create_task(_evaluate_message(raw_message)))
+    except (WebSocketDisconnect, KeyError):
+        # Connection closed or binary frame received
+        pass
+    except Exception as error:
+        await get_logger().error(
+            {"msg": "Decision stream receiver failed", "error": repr(error)}
+        )
+    finally:
+        # Stop the sender whatever stopped the receiver, on cancellation the queue
+        # was already emptied so the sentinel doesn't wait
+        await pending.put(None)
+
+
+async def serve_decision_stream(websocket: WebSocket):
+    """
+    Evaluate the messages pipelined by a gateway on a single connection,
+    sending back the decisions in the same order of the messages
+
+    :param websocket: gateway connection
+    """
+    settings = get_gateway_settings()
+    pending: "asyncio.Queue[Optional[asyncio.Task]]" = asyncio.Queue(
+        maxsize=settings.stream_max_pending
+    )
+
+    await websocket.accept()
+    receiver = asyncio.create_task(_receive_messages(websocket, pending))
+    try:
+        while True:
+            decision = await pending.get()
+            if decision is None:
+                break
+            await websocket.send_text(await decision)
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        receiver.cancel()
+        while not pending.empty():
+            decision = pending.get_nowait()
+            if decision is not None:
+                decision.cancel()
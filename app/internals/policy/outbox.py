@@ -0,0 +1,292 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+from functools import lru_cache
+from random import uniform
+from typing import Optional, Union
+
+# Third Party
+from asyncpg import Connection
+from asyncpg.exceptions import PostgresError
+from fastapi import HTTPException, status
+
+# Internal
+from ..keycloak.resources import (
+    UNREACHABLE,
+    delete_resource,
+    insert_resource,
+    update_resource,
+)
+from ..logger import get_logger, log_postgres_error
+from ..metrics import register_metrics
+from ...config import get_keycloak_settings
+from ...db.postgresql import OutboxEntry, OutboxOperation, get_database
+from ...models.brain_pep.service import Service
+
+# ---------------------------------------------------------------------------------------
+
+REFUSED = frozenset(
+    (
+        status.HTTP_400_BAD_REQUEST,
+        status.HTTP_409_CONFLICT,
+        status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+)
+"""Answers of the resource endpoint refusing an operation, retrying it won't change
+the outcome. The other errors, token errors included, may be transient"""
+
+
+class OutboxDispatcher:
+    """
+    Push to keycloak the resource operations committed together with the services.
+    Only the oldest pending operation of every service is pushed, so the operations
+    of a service reach keycloak in order, and a single process at a time pushes them
+    using a single connection of the pool.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        poll_interval: float,
+        backoff: float,
+        max_backoff: float,
+    ):
+        """
+        :param batch_size: max number of operations pushed concurrently
+        :param poll_interval: seconds between two checks of the outbox when idle
+        :param backoff: seconds before retrying a failed operation the first time,
+                        doubled at every failure
+        :param max_backoff: max seconds before retrying a failed operation
+        """
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+        self.pushed = 0
+        """Number of operations pushed to keycloak"""
+        self.failed = 0
+        """Number of attempts failed and postponed"""
+        self.dropped = 0
+        """Number of operations refused by keycloak"""
+        self.discarded = 0
+        """Number of services removed because keycloak refused their creation"""
+        self.pending = 0
+        """Operations in the outbox at the last check"""
+        self.oldest_pending = 0.0
+        """Seconds since the oldest operation in the outbox at the last check"""
+
+    def delay(self, attempts: int) -> float:
+        """
+        Seconds before retrying an operation, spread at random among the operations
+
+        :param attempts: attempts already failed
+        :return: seconds to wait
+        """
+        return min(self.max_backoff, self.backoff * 2**attempts) * uniform(0.5, 1)
+
+    @staticmethod
+    async def _push(entry: OutboxEntry) -> Optional[str]:
+        """
+        Push an operation to keycloak
+
+        :param entry: operation to push
+        :return: identifier of the resource created, if any
+        """
+        if entry.operation is OutboxOperation.insert:
+            return await insert_resource(Service.parse_obj(entry.resource))
+
+        if entry.keycloak_identifier is None:
+            # The creation of the resource was refused
+            await get_logger().warning(
+                {"msg": "Keycloak resource never created", **entry._asdict()}
+            )
+            return None
+
+        if entry.operation is OutboxOperation.update:
+            await update_resource(
+                entry.keycloak_identifier, Service.parse_obj(entry.resource)
+            )
+        else:
+            try:
+                await delete_resource(entry.keycloak_identifier)
+            except HTTPException as error:
+                if error.status_code != status.HTTP_404_NOT_FOUND or (
+                    error.detail == UNREACHABLE
+                ):
+                    raise
+                # Already deleted by a previous attempt
+        return None
+
+    @staticmethod
+    def is_refused(result: Union[Optional[str], BaseException]) -> bool:
+        """
+        Check if keycloak refused an operation for good
+
+        :param result: identifier of the resource created or the error of the push
+        :return: True if the operation must not be retried
+        """
+        return isinstance(result, HTTPException) and result.status_code in REFUSED
+
+    async def _settle(
+        self,
+        connection: Connection,
+        entry: OutboxEntry,
+        result: Union[Optional[str], BaseException],
+    ):
+        """
+        Store the outcome of a push, postponing the operation if keycloak failed
+
+        :param connection: connection holding the outbox lock
+        :param entry: operation pushed
+        :param result: identifier of the resource created or the error of the push
+        """
+        database = get_database()
+        if self.is_refused(result):
+            self.dropped += 1
+            await get_logger().error(
+                {
+                    "msg": "Keycloak operation refused",
+                    "status_code": result.status_code,
+                    **entry._asdict(),
+                }
+            )
+            if entry.operation is OutboxOperation.insert:
+                # The service can't be served without its resource
+                await database.discard_outbox_insert(connection, entry)
+                self.discarded += 1
+                return
+            result = None
+        elif isinstance(result, Exception):
+            self.failed += 1
+            if isinstance(result, HTTPException):
+                error = str(result.detail)
+            else:
+                error = repr(result)
+            await database.postpone_outbox_entry(
+                connection, entry, self.delay(entry.attempts), error
+            )
+            return
+        elif isinstance(result, BaseException):
+            raise result
+
+        await database.complete_outbox_entry(connection, entry, result)
+        self.pushed += 1
+
+    async def dispatch(self) -> int:
+        """
+        Push a batch of operations, unless another process is pushing them
+
+        :return: number of operations handled
+        """
+        database = get_database()
+        async with database.outbox_lock() as connection:
+            if connection is None:
+                return 0
+            batch = await database.extract_outbox_batch(connection, self.batch_size)
+            # Only the requests to keycloak run concurrently, their outcomes are
+            # stored one at a time on the connection holding the lock
+            result_list = await asyncio.gather(
+                *(self._push(entry) for entry in batch), return_exceptions=True
+            )
+            for entry, result in zip(batch, result_list):
+                await self._settle(connection, entry, result)
+            self.pending, self.oldest_pending = await database.extract_outbox_backlog(
+                connection
+            )
+        return len(batch)
+
+    async def _run(self):
+        """
+        Push the operations as soon as they are committed, checking the outbox
+        periodically for the ones committed by the other processes and the retries
+        """
+        while True:
+            try:
+                if await self.dispatch():
+                    # The next operations of the services pushed may be waiting
+                    continue
+            except PostgresError as error:
+                await log_postgres_error(error)
+            except Exception as error:
+                await get_logger().error(
+                    {"msg": "Outbox dispatch failed", "error": repr(error)}
+                )
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def notify(self):
+        """
+        Wake up the dispatcher after committing an operation
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """
+        Start pushing the operations in background
+        """
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop pushing the operations, the pending ones are pushed at the next start
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+
+    def stats(self) -> dict:
+        """
+        Dispatcher statistics
+
+        :return: counters and backlog of the outbox
+        """
+        return {
+            "pushed": self.pushed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "discarded": self.discarded,
+            "pending": self.pending,
+            "oldest_pending_seconds": self.oldest_pending,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_outbox_dispatcher() -> OutboxDispatcher:
+    """Obtain as a singleton the dispatcher of the keycloak outbox"""
+    settings = get_keycloak_settings()
+    return OutboxDispatcher(
+        settings.keycloak_outbox_batch_size,
+        settings.keycloak_outbox_poll_interval,
+        settings.keycloak_outbox_backoff,
+        settings.keycloak_outbox_max_backoff,
+    )
+
+
+register_metrics("keycloak_outbox", lambda: get_outbox_dispatcher().stats())
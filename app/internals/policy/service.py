@@ -12,9 +12,13 @@
  ******************************************************************************
 """
 
+# Standard Library
+import asyncio
+
 # Internal
+from .outbox import get_outbox_dispatcher
 from ..keycloak.policy import get_available_policies
-from ..keycloak.resources import delete_resource, update_resource, insert_resource
+from ..metrics import StageLatency, register_metrics
 from ...db.postgresql import get_database
 from ...models.response import ServiceUpdated
 from ...models.security import Requester
@@ -25,6 +29,11 @@ from ...models.brain_pep.service import (
 
 # ---------------------------------------------------------------------------------------
 
+DASHBOARD_LATENCY = StageLatency()
+"""Latency of the stages of the services dashboard"""
+
+register_metrics("service_dashboard", DASHBOARD_LATENCY.stats)
+
 
 async def get_service(
     service_requested: Requester,
@@ -39,12 +48,16 @@ async def get_service(
     # Get database
     database = get_database()
 
-    # Extract available policy
-    available_policy = await get_available_policies()
-
-    # extract service list
-    service_list = await database.extract_all_services(
-        service_requested.preferred_username
+    # Extract available policy and service list together
+    available_policy, service_list = await DASHBOARD_LATENCY.measure(
+        "total",
+        asyncio.gather(
+            DASHBOARD_LATENCY.measure("available_policies", get_available_policies()),
+            DASHBOARD_LATENCY.measure(
+                "service_list",
+                database.extract_all_services(service_requested.preferred_username),
+            ),
+        ),
     )
     return UserServicesPolicies(
         available_policy=available_policy, service_policy_list=service_list
@@ -53,57 +66,41 @@ async def get_service(
 
 async def insert_service(service: Service, requester: Requester) -> ServiceUpdated:
     """
-    Set Service policies
+    Set Service policies, the resource is created on keycloak in background
 
     :param service: Service to store
     :param requester: Client
     """
-    # Store resource in keycloak
-    identifier = await insert_resource(service)
-
     # Store in the database
     database = get_database()
-    await database.insert_service(identifier, requester.preferred_username, service)
+    await database.insert_service(requester.preferred_username, service)
+    get_outbox_dispatcher().notify()
     return ServiceUpdated()
 
 
 async def update_service(service: Service, requester: Requester) -> ServiceUpdated:
     """
-    Set Service policies
+    Set Service policies, the resource is updated on keycloak in background
 
     :param service: Service to store
     :param requester: Client
     """
-
-    # Get Database
-    database = get_database()
-    identifier = await database.extract_service_keycloak_identifier(
-        service.name, requester.preferred_username
-    )
-
-    # Update resource on keycloak
-    await update_resource(identifier, service)
-
     # Update database
+    database = get_database()
     await database.update_service(service, requester.preferred_username)
+    get_outbox_dispatcher().notify()
     return ServiceUpdated()
 
 
 async def delete_service(service_id: str, client: Requester) -> ServiceUpdated:
     """
-    Update User's devices policies
+    Delete a service, the resource is deleted from keycloak in background
 
     :param service_id: Service identifier
     :param client: Requester
     """
-    # Get database
+    # Delete from the database
     database = get_database()
-    identifier = await database.extract_service_keycloak_identifier(
-        service_id, client.preferred_username
-    )
-    if identifier:
-        # Delete service from keycloak
-        await delete_resource(identifier)
-        # Delete from the database
-        await database.delete_service(service_id, client.preferred_username)
+    await database.delete_service(service_id, client.preferred_username)
+    get_outbox_dispatcher().notify()
     return ServiceUpdated()
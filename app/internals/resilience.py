@@ -0,0 +1,152 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from enum import Enum
+from random import uniform
+from time import monotonic
+from typing import NamedTuple, Optional
+
+# Third Party
+from httpx import RequestError
+
+# ----------------------------------------------------------------------------------
+
+
+class CircuitOpenError(RequestError):
+    """Request not sent because the upstream is failing"""
+
+
+class CircuitState(str, Enum):
+    closed = "closed"
+    """Requests are sent"""
+
+    open = "open"
+    """Requests fail immediately"""
+
+    half_open = "half_open"
+    """A single request is sent to probe the upstream"""
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to an upstream after consecutive failures, probing it
+    again once the reset timeout is elapsed
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: seconds after which an open circuit is probed
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.closed
+        self._failures = 0
+        self._changed_at = monotonic()
+
+        self.opened = 0
+        """Number of times the circuit opened"""
+        self.half_opened = 0
+        """Number of probes sent"""
+        self.closed = 0
+        """Number of times the circuit closed after a successful probe"""
+        self.rejected = 0
+        """Number of requests not sent"""
+
+    def _change(self, state: CircuitState):
+        self.state = state
+        self._changed_at = monotonic()
+
+    def allow(self) -> bool:
+        """
+        Check if a request can be sent
+
+        :return: True if the request can be sent
+        """
+        if self.state is CircuitState.closed:
+            return True
+        if monotonic() - self._changed_at >= self.reset_timeout:
+            # Probe the upstream, again if the previous probe never completed
+            self._change(CircuitState.half_open)
+            self.half_opened += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> bool:
+        """
+        Record a request completed
+
+        :return: True if the circuit closed
+        """
+        self._failures = 0
+        if self.state is CircuitState.closed:
+            return False
+        self._change(CircuitState.closed)
+        self.closed += 1
+        return True
+
+    def record_failure(self) -> bool:
+        """
+        Record a request failed
+
+        :return: True if the circuit opened
+        """
+        self._failures += 1
+        if self.state is CircuitState.open or (
+            self.state is CircuitState.closed
+            and self._failures < self.failure_threshold
+        ):
+            return False
+        self._change(CircuitState.open)
+        self.opened += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        Circuit statistics
+
+        :return: state and transitions of the circuit
+        """
+        return {
+            "state": self.state.value,
+            "opened": self.opened,
+            "half_opened": self.half_opened,
+            "closed": self.closed,
+            "rejected": self.rejected,
+        }
+
+
+class RetryPolicy(NamedTuple):
+    retries: int
+    """Attempts after the first one"""
+
+    backoff: float
+    """Seconds of the first backoff, doubled at every attempt"""
+
+    max_backoff: float
+    """Max seconds of a backoff"""
+
+    def delay(self, attempt: int, jitter: Optional[float] = None) -> float:
+        """
+        Seconds to wait before retrying, spread at random to not retry in sync
+        with the other workers
+
+        :param attempt: attempts already done, starting from 1
+        :param jitter: fraction of the backoff to wait, random if not given
+        :return: seconds to wait
+        """
+        backoff = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return backoff * (uniform(0, 1) if jitter is None else jitter)
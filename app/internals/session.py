@@ -13,20 +13,312 @@
 """
 
 # Standard library
+import asyncio
 from functools import lru_cache
+from time import perf_counter
+from typing import Dict, Optional, Tuple
 
 # Third Party
-from httpx import AsyncClient
+from httpx import (
+    AsyncClient,
+    AsyncHTTPTransport,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+    TransportError,
+)
+
+# Internal
+from .logger import get_logger
+from .metrics import register_metrics
+from .resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from ..config import (
+    get_brainpep_settings,
+    get_keycloak_admin_settings,
+    get_keycloak_settings,
+    get_security_settings,
+)
 
 # ----------------------------------------------------------------------------------
 
+IDEMPOTENT = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+"""Methods of the requests that can be sent again"""
+
+UNAVAILABLE = frozenset((502, 503, 504))
+"""Status codes of an upstream that is failing"""
+
+
+class EndpointStats:
+    """Latency of the requests sent to a keycloak endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        """Number of requests completed"""
+        self.errors = 0
+        """Number of requests failed before receiving a response"""
+        self.latency = 0.0
+        """Seconds spent waiting for the responses"""
+        self.max_latency = 0.0
+        """Slowest response"""
+        self.pool_wait = 0.0
+        """Seconds spent waiting for a connection of the pool"""
+        self.pool_wait_samples = 0
+        """Number of requests whose wait for a connection was measured"""
+        self.max_pool_wait = 0.0
+        """Longest wait for a connection of the pool"""
+        self.retries = 0
+        """Number of requests sent again"""
+
+    def record(self, latency: float, pool_wait: Optional[float]):
+        """
+        Record a completed request
+
+        :param latency: seconds until the response was received
+        :param pool_wait: seconds until a connection of the pool was available,
+                          None if the transport doesn't report it
+        """
+        self.requests += 1
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if pool_wait is not None:
+            self.pool_wait_samples += 1
+            self.pool_wait += pool_wait
+            self.max_pool_wait = max(self.max_pool_wait, pool_wait)
+
+    def stats(self) -> dict:
+        """
+        Endpoint statistics
+
+        :return: counters and latencies in milliseconds, the pool wait is None
+                 if it was never measured
+        """
+        requests = self.requests or 1
+        measured = self.pool_wait_samples > 0
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "mean_latency_ms": self.latency * 1000 / requests,
+            "max_latency_ms": self.max_latency * 1000,
+            "mean_pool_wait_ms": (
+                self.pool_wait * 1000 / self.pool_wait_samples if measured else None
+            ),
+            "max_pool_wait_ms": self.max_pool_wait * 1000 if measured else None,
+        }
+
+
+class KeycloakTransport(AsyncHTTPTransport):
+    """
+    Transport guarding every keycloak endpoint with a circuit breaker, retrying the
+    idempotent requests and recording the latency of the endpoints together with
+    the time spent waiting for a connection of the pool, that is the time before
+    the connection starts to connect or to send the request
+    """
+
+    def __init__(
+        self,
+        endpoints: Dict[str, str],
+        retry: RetryPolicy,
+        failure_threshold: int,
+        reset_timeout: float,
+        **kwargs,
+    ):
+        """
+        :param endpoints: names of the endpoints indexed by their url
+        :param retry: retries of the idempotent requests
+        :param failure_threshold: consecutive failures that open the circuit of an
+                                  endpoint
+        :param reset_timeout: seconds after which an open circuit is probed
+        :param kwargs: arguments of the httpx transport
+        """
+        super().__init__(**kwargs)
+        # Longest url first, so the most specific endpoint is found
+        self.endpoints: Tuple[Tuple[str, str], ...] = tuple(
+            sorted(endpoints.items(), key=lambda item: len(item[0]), reverse=True)
+        )
+        self.retry = retry
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats: Dict[str, EndpointStats] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def _endpoint(self, request: Request) -> str:
+        """
+        Name of the endpoint of a request
+
+        :param request: request sent
+        :return: name of the endpoint, the host if the url is unknown
+        """
+        url = str(request.url)
+        for prefix, name in self.endpoints:
+            if url.startswith(prefix):
+                return name
+        return request.url.host
+
+    async def _send(self, request: Request, endpoint: EndpointStats) -> Response:
+        """
+        Send a request recording its latency
+
+        :param request: request to send
+        :param endpoint: statistics of the endpoint
+        :return: response
+        """
+        start = perf_counter()
+        connected: Optional[float] = None
+        parent_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            nonlocal connected
+            if connected is None:
+                # First activity on the connection obtained from the pool
+                connected = perf_counter()
+            if parent_trace is not None:
+                await parent_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            endpoint.errors += 1
+            raise
+        finally:
+            if parent_trace is None:
+                del request.extensions["trace"]
+            else:
+                request.extensions["trace"] = parent_trace
+
+        end = perf_counter()
+        # Without the trace extension of httpcore the wait can't be told apart
+        endpoint.record(end - start, None if connected is None else connected - start)
+        return response
+
+    async def handle_async_request(self, request: Request) -> Response:
+        name = self._endpoint(request)
+        endpoint = self.stats.setdefault(name, EndpointStats())
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        attempts = 1 + (self.retry.retries if request.method in IDEMPOTENT else 0)
+
+        for attempt in range(1, attempts + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit of {name} is open", request=request)
+            try:
+                response = await self._send(request, endpoint)
+            except TransportError:
+                await self._failure(name, breaker)
+                if attempt == attempts:
+                    raise
+            else:
+                if response.status_code not in UNAVAILABLE:
+                    if breaker.record_success():
+                        await get_logger().info(
+                            {"msg": "Keycloak circuit closed", "endpoint": name}
+                        )
+                    return response
+                await self._failure(name, breaker)
+                if attempt == attempts:
+                    return response
+                await response.aclose()
+
+            endpoint.retries += 1
+            await asyncio.sleep(self.retry.delay(attempt))
+
+    @staticmethod
+    async def _failure(name: str, breaker: CircuitBreaker):
+        """
+        Record a failed request
+
+        :param name: name of the endpoint
+        :param breaker: circuit breaker of the endpoint
+        """
+        if breaker.record_failure():
+            await get_logger().warning(
+                {"msg": "Keycloak circuit opened", "endpoint": name}
+            )
+
+    def endpoint_stats(self) -> Dict[str, dict]:
+        """
+        Statistics of every endpoint
+
+        :return: latencies and circuit of every endpoint
+        """
+        return {
+            name: {**endpoint.stats(), "circuit": self.breakers[name].stats()}
+            for name, endpoint in self.stats.items()
+        }
+
+
+# ----------------------------------------------------------------------------------
+
+
+def _keycloak_endpoints() -> Dict[str, str]:
+    """
+    Names of the keycloak endpoints used by the service, indexed by their url
+
+    :return: endpoints
+    """
+    brainpep = get_brainpep_settings()
+    endpoints = {
+        get_keycloak_admin_settings().admin_token_request_url: "admin_token",
+        brainpep.client_token_request_url: "client_token",
+        brainpep.resource_request_url: "resources",
+        brainpep.policy_request_url: "policies",
+        brainpep.user_attribute_request_url: "user_attributes",
+    }
+    realm_jwks_url = get_security_settings().realm_jwks_url
+    if realm_jwks_url:
+        endpoints[realm_jwks_url] = "realm_jwks"
+    return endpoints
+
+
+def keycloak_timeout(seconds: float) -> Timeout:
+    """
+    Timeout of a keycloak operation
+
+    :param seconds: max seconds to connect, send and receive
+    :return: timeout, the wait for a connection of the pool is configured apart
+    """
+    return Timeout(seconds, pool=get_keycloak_settings().keycloak_pool_timeout)
+
+
+@lru_cache(maxsize=1)
+def get_keycloak_transport() -> KeycloakTransport:
+    """
+    Instantiate the connection pool to keycloak
+    """
+    settings = get_keycloak_settings()
+    return KeycloakTransport(
+        _keycloak_endpoints(),
+        RetryPolicy(
+            settings.keycloak_retries,
+            settings.keycloak_retry_backoff,
+            settings.keycloak_retry_max_backoff,
+        ),
+        settings.keycloak_breaker_threshold,
+        settings.keycloak_breaker_reset_timeout,
+        verify=False,
+        http2=settings.keycloak_http2,
+        limits=Limits(
+            max_connections=settings.keycloak_max_connections,
+            max_keepalive_connections=settings.keycloak_max_keepalive_connections,
+            keepalive_expiry=settings.keycloak_keepalive_expiry,
+        ),
+    )
+
 
 @lru_cache(maxsize=1)
 def get_keycloak_session() -> AsyncClient:
     """
     Instantiate a session
     """
-    return AsyncClient(verify=False)
+    return AsyncClient(
+        transport=get_keycloak_transport(),
+        timeout=keycloak_timeout(get_keycloak_settings().keycloak_timeout),
+    )
 
 
 async def close_keycloak_session():
@@ -36,3 +328,14 @@ async def close_keycloak_session():
     session = get_keycloak_session()
     await session.aclose()
     get_keycloak_session.cache_clear()
+    get_keycloak_transport.cache_clear()
+
+
+def _keycloak_session_stats() -> dict:
+    """Statistics of the keycloak endpoints, empty before the first request"""
+    if get_keycloak_transport.cache_info().currsize == 0:
+        return {}
+    return get_keycloak_transport().endpoint_stats()
+
+
+register_metrics("keycloak_session", _keycloak_session_stats)
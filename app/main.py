@@ -18,12 +18,18 @@ from fastapi.openapi.utils import get_openapi
 from fastapi.openapi.docs import get_redoc_html
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from jose.exceptions import JWKError
 
 # Internal
 from .db.postgresql import get_database
+from .internals.executor import close_crypto_executor
+from .internals.keycloak.jwks import get_realm_key_set
 from .internals.logger import get_logger
+from .internals.policy.device import invalidate_device_policies
+from .internals.policy.outbox import get_outbox_dispatcher
 from .internals.session import get_keycloak_session, close_keycloak_session
-from .routers import brain_user, gateway, brain_consumers
+from .routers import brain_user, gateway, brain_consumers, metrics
+from .security.keys import load_key_material
 
 # Instantiate app
 database = get_database()
@@ -49,21 +55,36 @@ app.add_middleware(
 app.include_router(brain_user.router)
 app.include_router(gateway.router)
 app.include_router(brain_consumers.router)
+app.include_router(metrics.router)
 
 
 # Configure logger
 @app.on_event("startup")
 async def configure_logger():
-    get_logger()
+    logger = get_logger()
     get_keycloak_session()
+    try:
+        # Parse the keys once instead of at the first request
+        load_key_material()
+    except JWKError as error:
+        await logger.warning({"msg": "Invalid key material", "error": str(error)})
+    key_set = get_realm_key_set()
+    if key_set is not None:
+        await key_set.refresh()
     await database.connect()
+    # Signed policies written by the other workers
+    database.listen_device_changes(invalidate_device_policies)
+    # Push the keycloak operations committed by the previous runs too
+    get_outbox_dispatcher().start()
 
 
 # Shutdown logger
 @app.on_event("shutdown")
 async def shutdown_logger():
     logger = get_logger()
+    await get_outbox_dispatcher().stop()
     await close_keycloak_session()
+    close_crypto_executor()
     await database.disconnect()
     await logger.shutdown()
 
@@ -56,6 +56,11 @@ class Token(OrjsonModel):
     """Token obtained from Keycloak"""
 
     access_token: str
+    expires_in: Optional[int] = None
+    """Seconds of validity of the access token"""
+    refresh_token: Optional[str] = None
+    refresh_expires_in: Optional[int] = None
+    """Seconds of validity of the refresh token, 0 if it doesn't expire"""
 
 
 class SignedMessage(OrjsonModel):
@@ -12,17 +12,26 @@
  ******************************************************************************
 """
 # Standard Library
-from typing import List
+from typing import List, Optional
 
 # Third Party
-from fastapi import APIRouter, Body, Path
+from fastapi import APIRouter, Body, Header, Path, Response, WebSocket, status
 from fastapi.responses import ORJSONResponse
 
 # Internal
 from ..db.postgresql import get_database
-from ..internals.policy.device import get_device_policies
-
-from ..models.brain_pep.service import GatewayService, Service
+from ..internals.policy.compact import COMPACT_MEDIA_TYPE
+from ..internals.policy.device import (
+    etag_matches,
+    get_compact_device_policies,
+    get_signed_device_policies,
+)
+from ..internals.policy.gateway import (
+    compile_signed_device,
+    evaluate_messages,
+    serve_decision_stream,
+)
+from ..models.brain_pep.service import GatewayDecision, GatewayService, Service
 from ..models.security import SignedMessage
 
 # --------------------------------------------------------------------------------------------
@@ -46,8 +55,40 @@ async def filter_service_list(
     This API will receive both a list of service_ids and a token containing the list of signed policies
     associated with the incoming message to be forwarded to the services.
     """
+    device = await compile_signed_device(gateway_service.sign_device)
     database = get_database()
-    return await database.filter_service_list(gateway_service)
+    return await database.filter_service_list(gateway_service.service_list, device)
+
+
+@router.post(
+    "/filter/bulk",
+    response_class=ORJSONResponse,
+    response_model=List[GatewayDecision],
+    response_model_exclude_none=True,
+    summary="Get filtered list of allowed services for many messages",
+)
+async def filter_service_list_bulk(
+    message_list: List[GatewayService] = Body(...),
+):
+    """
+    This endpoint provides a way to filter the services of many messages with a single request.
+    Every item of the list contains a list of service_ids and the token containing the list of signed
+    policies associated with the message, the response contains a decision for every item in the same
+    order, with the status_code of the item and the list of allowed services or the reason of the failure,
+    as the decisions of the stream.
+    """
+    return await evaluate_messages(message_list)
+
+
+@router.websocket("/filter/stream")
+async def filter_service_stream(websocket: WebSocket):
+    """
+    This endpoint provides a way to filter the services of a continuous stream of messages
+    over a single connection. Every text frame sent by the gateway must contain a json with
+    a list of service_ids and the token of the signed policies, the decisions are sent back
+    in the same order as json frames with the status_code and the list of allowed services.
+    """
+    await serve_decision_stream(websocket)
 
 
 @router.get(
@@ -55,18 +96,54 @@ async def filter_service_list(
     response_class=ORJSONResponse,
     response_model=SignedMessage,
     summary="Get policies of a device",
+    responses={
+        status.HTTP_200_OK: {
+            "content": {
+                COMPACT_MEDIA_TYPE: {
+                    "schema": {"type": "string", "format": "binary"},
+                }
+            },
+            "description": "Signed policies, as JWS or in the compact layout",
+        },
+        status.HTTP_304_NOT_MODIFIED: {"description": "Policies not modified"},
+    },
 )
 async def get_device_policy_mapping(
+    response: Response,
     device_id: str = Path(
         ...,
         description="The device id to look for the policies",
         example="device_a",
         max_length=30,
-    )
+    ),
+    if_none_match: Optional[str] = Header(
+        None, description="ETag of the signed policies already known"
+    ),
+    accept: Optional[str] = Header(
+        None, description=f"{COMPACT_MEDIA_TYPE} to receive the compact layout"
+    ),
 ):
     """
     This endpoint provides a way to get the list of roles/policies (signed) by providing device_id (MAC)
     Should be used by the component that wants to know the policies to be associated to
     the message before forwarding it.
+    The response contains an ETag, sending it back with If-None-Match the signed policies
+    are returned only if they changed, otherwise the answer is 304 Not Modified.
+    Constrained gateways can ask for the compact binary layout of the signed policies
+    with the Accept header, the layout is described in app/internals/policy/compact.py.
     """
-    return await get_device_policies(device_id)
+    if accept and COMPACT_MEDIA_TYPE in accept:
+        compact = await get_compact_device_policies(device_id)
+        headers = {"ETag": compact.etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+        if etag_matches(if_none_match, compact.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(
+            content=compact.token, media_type=COMPACT_MEDIA_TYPE, headers=headers
+        )
+
+    policies = await get_signed_device_policies(device_id)
+    headers = {"ETag": policies.etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag_matches(if_none_match, policies.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return SignedMessage(signature=policies.signature)
@@ -0,0 +1,44 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from typing import Dict
+
+# Third Party
+from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
+
+# Internal
+from ..internals.metrics import collect_metrics
+from ..security.jwt_bearer import Signature
+
+# --------------------------------------------------------------------------------------------
+
+router = APIRouter(prefix="/api/v1/metrics", tags=["Metrics"])
+metrics_auth = Signature(realm_access="brain_consumers")
+
+
+@router.get(
+    "",
+    response_class=ORJSONResponse,
+    response_model=Dict[str, dict],
+    summary="Get the metrics of the worker",
+    dependencies=[Depends(metrics_auth)],
+)
+async def get_metrics():
+    """
+    This endpoint provides the metrics of the caches and of the executors of the worker
+    that answers the request, useful to size them. Only the brain consumers can read them.
+    """
+    return collect_metrics()
@@ -12,23 +12,114 @@
  ******************************************************************************
 """
 # Standard Library
-from typing import List, Optional, Union
+from functools import lru_cache
+from hashlib import sha256
+from time import time
+from typing import List, NamedTuple, Optional, Union
 
 # Third Party
 from fastapi import HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import ValidationError
 from jose import jwt, JWTError
+from jose.backends.base import Key
 
 # Internal
 from ..config import get_security_settings
+from ..internals.cache import TTLCache
+from ..internals.executor import get_crypto_executor
+from ..internals.keycloak.jwks import get_realm_key_set
 from ..internals.logger import get_logger
+from ..internals.metrics import register_metrics
 from ..models.security import Requester
+from .keys import get_realm_key
 
 
 # ----------------------------------------------------------------------------------------
 
 
+async def get_bearer_key(jwt_token: str) -> Key:
+    """
+    Obtain the realm key that signed a bearer token
+
+    :param jwt_token: bearer token
+    :return: prepared key
+    """
+    key_set = get_realm_key_set()
+    if key_set is None:
+        return get_realm_key()
+    return await key_set.get_key(jwt.get_unverified_header(jwt_token).get("kid"))
+
+
+def decode_bearer_token(jwt_token: str, key: Union[Key, dict]) -> dict:
+    """
+    Verify and decode a bearer token issued by keycloak
+
+    :param jwt_token: bearer token
+    :param key: realm key, as JWK if it must be sent to another process
+    :return: claims of the token
+    """
+    settings = get_security_settings()
+    return jwt.decode(
+        jwt_token,
+        key,
+        settings.algorithm,
+        issuer=settings.issuer,
+        options={
+            "verify_aud": False,
+        },
+    )
+
+
+class VerifiedBearer(NamedTuple):
+    """Bearer token already verified"""
+
+    claims: dict
+    """Claims of the token"""
+
+    requester: Optional[Requester]
+    """Requester of the token, None if the claims don't describe it"""
+
+
+@lru_cache(maxsize=1)
+def get_bearer_token_cache() -> TTLCache:
+    """Obtain as a singleton the cache of the verified bearer tokens"""
+    settings = get_security_settings()
+    return TTLCache(settings.bearer_cache_size, settings.bearer_cache_ttl)
+
+
+register_metrics("bearer_token_cache", lambda: get_bearer_token_cache().stats())
+
+
+async def verify_bearer_token(jwt_token: str) -> VerifiedBearer:
+    """
+    Verify a bearer token, reusing the result until the token expires
+
+    :param jwt_token: bearer token
+    :return: verified token
+    """
+    cache = get_bearer_token_cache()
+    key = sha256(jwt_token.encode()).digest()
+    bearer = cache.get(key)
+    if bearer is not None:
+        return bearer
+
+    realm_key = await get_bearer_key(jwt_token)
+    executor = get_crypto_executor()
+    # Prepared keys can't be sent to the process workers
+    key_data = realm_key.to_dict() if executor.isolated else realm_key
+    claims = await executor.run(decode_bearer_token, jwt_token, key_data)
+    try:
+        requester = Requester.parse_obj(claims)
+    except ValidationError:
+        requester = None
+    bearer = VerifiedBearer(claims, requester)
+
+    expiration = claims.get("exp")
+    cache.set(key, bearer, ttl=None if expiration is None else expiration - time())
+    return bearer
+
+
 class Signature(HTTPBearer):
     def __init__(
         self,
@@ -44,26 +135,15 @@ class Signature(HTTPBearer):
         credentials: HTTPAuthorizationCredentials = await super().__call__(request)
         jwt_token = credentials.credentials
 
-        # Get Security settings
-        settings = get_security_settings()
         try:
-            token = jwt.decode(
-                jwt_token,
-                f"-----BEGIN PUBLIC KEY-----\n"
-                f"{settings.realm_public_key}"
-                f"\n-----END PUBLIC KEY-----"
-                "",
-                settings.algorithm,
-                issuer=settings.issuer,
-                options={
-                    "verify_aud": False,
-                },
-            )
+            bearer = await verify_bearer_token(jwt_token)
         except JWTError as err:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid_bearer_token"
             )
 
+        token = bearer.claims
+
         # Get Logger
         logger = get_logger()
 
@@ -76,9 +156,8 @@ class Signature(HTTPBearer):
             )
 
         if self.return_requester:
-            try:
-                return Requester.parse_obj(token)
-            except ValidationError:
+            # Requester parsed once when the token was verified
+            if bearer.requester is None:
                 # Token debug
                 await logger.debug({"msg": "Invalid keycloak settings", "token": token})
                 # Raise exception
@@ -86,3 +165,4 @@ class Signature(HTTPBearer):
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="invalid keycloak settings",
                 )
+            return bearer.requester
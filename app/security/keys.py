@@ -0,0 +1,242 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from functools import lru_cache
+from typing import Union
+
+# Third Party
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+    Ed25519PublicKey,
+)
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from jose import jwk, jws
+from jose.backends.base import Key
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWKError
+from jose.utils import base64url_encode
+
+# Internal
+from ..config import get_security_settings
+
+# ----------------------------------------------------------------------------------------
+
+EDDSA = "EdDSA"
+"""Edwards-curve signature algorithm of RFC 8037, used with Ed25519 keys"""
+
+
+class EdDSAKey(Key):
+    """
+    Ed25519 key for the EdDSA jws, an algorithm python-jose doesn't provide
+    """
+
+    def __init__(
+        self,
+        key: Union[str, bytes, Ed25519PrivateKey, Ed25519PublicKey],
+        algorithm: str,
+    ):
+        """
+        :param key: key in PEM format or already loaded
+        :param algorithm: must be EdDSA
+        """
+        if algorithm != EDDSA:
+            raise JWKError(f"hash_alg: {algorithm} is not a valid EdDSA algorithm")
+        self._algorithm = algorithm
+
+        if isinstance(key, str):
+            key = key.encode()
+        if isinstance(key, bytes):
+            try:
+                if b"PRIVATE KEY" in key:
+                    key = load_pem_private_key(key, password=None)
+                else:
+                    key = load_pem_public_key(key)
+            except ValueError as error:
+                raise JWKError(error)
+        if not isinstance(key, (Ed25519PrivateKey, Ed25519PublicKey)):
+            raise JWKError("Not an Ed25519 key")
+        self.prepared_key = key
+
+    def sign(self, msg: bytes) -> bytes:
+        return self.prepared_key.sign(msg)
+
+    def verify(self, msg: bytes, sig: bytes) -> bool:
+        try:
+            self.public_key().prepared_key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+    def is_public(self) -> bool:
+        return isinstance(self.prepared_key, Ed25519PublicKey)
+
+    def public_key(self) -> "EdDSAKey":
+        if self.is_public():
+            return self
+        return EdDSAKey(self.prepared_key.public_key(), self._algorithm)
+
+    def to_pem(self) -> bytes:
+        if self.is_public():
+            return self.prepared_key.public_bytes(
+                Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+            )
+        return self.prepared_key.private_bytes(
+            Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()
+        )
+
+    def to_dict(self) -> dict:
+        public_key = self.public_key().prepared_key
+        return {
+            "alg": self._algorithm,
+            "kty": "OKP",
+            "crv": "Ed25519",
+            "x": base64url_encode(
+                public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+            ).decode(),
+        }
+
+
+jwk.register_key(EDDSA, EdDSAKey)
+
+# ----------------------------------------------------------------------------------------
+
+
+def _private_key_label(algorithm: str) -> str:
+    """
+    PEM label of the private keys stored in the settings for an algorithm
+
+    :param algorithm: jws algorithm
+    :return: PEM label
+    """
+    if algorithm in ALGORITHMS.RSA:
+        # PKCS#1 key
+        return "RSA PRIVATE KEY"
+    if algorithm in ALGORITHMS.EC:
+        # SEC1 key, as generated by openssl ecparam
+        return "EC PRIVATE KEY"
+    # PKCS#8 key, as generated by openssl genpkey
+    return "PRIVATE KEY"
+
+
+def _armor(key: str, label: str) -> str:
+    """
+    Wrap a base64 key, as stored in the settings, in its PEM armor
+
+    :param key: key in base64 format or already in PEM format
+    :param label: PEM label
+    :return: key in PEM format
+    """
+    if key.lstrip().startswith("-----BEGIN"):
+        return key
+    return f"-----BEGIN {label}-----\n{key}\n-----END {label}-----"
+
+
+@lru_cache(maxsize=8)
+def load_key(pem: str, algorithm: str) -> Key:
+    """
+    Parse a PEM key once
+
+    :param pem: key in PEM format
+    :param algorithm: algorithm the key will be used with
+    :return: prepared key
+    """
+    return jwk.construct(pem, algorithm)
+
+
+# ----------------------------------------------------------------------------------------
+
+
+class PolicySigner:
+    """Sign the device policies with the prepared private key"""
+
+    def __init__(self, key: Key, algorithm: str):
+        self.key = key
+        self.algorithm = algorithm
+
+    def sign(self, payload: Union[bytes, dict]) -> str:
+        """
+        Sign a payload
+
+        :param payload: data to sign
+        :return: jws
+        """
+        return jws.sign(payload, self.key, algorithm=self.algorithm)
+
+
+class PolicyVerifier:
+    """Verify the device policies with the prepared public key"""
+
+    def __init__(self, key: Key, algorithm: str):
+        self.key = key
+        self.algorithm = algorithm
+
+    def verify(self, token: str) -> bytes:
+        """
+        Verify a jws
+
+        :param token: jws to verify
+        :return: signed payload
+        """
+        return jws.verify(token, self.key, algorithms=self.algorithm)
+
+
+@lru_cache(maxsize=2)
+def _policy_signer(private_key: str, algorithm: str) -> PolicySigner:
+    return PolicySigner(
+        load_key(_armor(private_key, _private_key_label(algorithm)), algorithm),
+        algorithm,
+    )
+
+
+@lru_cache(maxsize=2)
+def _policy_verifier(public_key: str, algorithm: str) -> PolicyVerifier:
+    return PolicyVerifier(
+        load_key(_armor(public_key, "PUBLIC KEY"), algorithm), algorithm
+    )
+
+
+def get_policy_signer() -> PolicySigner:
+    """Obtain the signer of the device policies"""
+    settings = get_security_settings()
+    return _policy_signer(settings.jws_private_key, settings.jws_algorithm)
+
+
+def get_policy_verifier() -> PolicyVerifier:
+    """Obtain the verifier of the device policies"""
+    settings = get_security_settings()
+    return _policy_verifier(settings.jws_public_key, settings.jws_algorithm)
+
+
+def get_realm_key() -> Key:
+    """Obtain the public key used by keycloak to sign the bearer tokens"""
+    settings = get_security_settings()
+    return load_key(_armor(settings.realm_public_key, "PUBLIC KEY"), settings.algorithm)
+
+
+def load_key_material():
+    """
+    Prepare all the keys, raising an error if one of them is not valid
+    """
+    get_realm_key()
+    get_policy_signer()
+    get_policy_verifier()
@@ -0,0 +1,360 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+
+Keycloak stand-in implementing only the endpoints used by BrainPEP, to run load and
+integration tests without any outside service:
+
+    ~$ python -m benchmarks.fake_keycloak --port 8180 --latency 0.02 --error-rate 0.01
+
+The data is kept in memory and lost at every restart. The access tokens are signed
+with a key generated at startup, published at the certs endpoint of every realm.
+"""
+
+# Standard Library
+import argparse
+import asyncio
+from random import random, uniform
+from time import time
+from typing import Dict, List
+from urllib.parse import parse_qs
+from uuid import NAMESPACE_URL, uuid4, uuid5
+
+# Third Party
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
+from fastapi import Body, FastAPI, HTTPException, Request, status
+from fastapi.responses import ORJSONResponse
+from jose import JWTError, jwk, jwt
+from pydantic import BaseModel, BaseSettings
+
+# ---------------------------------------------------------------------------------------
+
+
+class FakeKeycloakSettings(BaseSettings):
+    latency: float = 0
+    """Seconds added to every response"""
+    jitter: float = 0
+    """Max seconds added at random to the latency"""
+    error_rate: float = 0
+    """Fraction of the requests failed on purpose"""
+    error_status: int = status.HTTP_503_SERVICE_UNAVAILABLE
+    """Status code of the requests failed on purpose"""
+    token_lifespan: int = 300
+    """Seconds of validity of the access tokens"""
+    roles: List[str] = ["brain_user", "brain_consumers"]
+    """Realm roles of every user and client roles returned as available policies"""
+
+    class Config:
+        env_prefix = "fake_keycloak_"
+
+
+class Faults(BaseModel):
+    latency: float
+    jitter: float
+    error_rate: float
+    error_status: int
+
+
+SETTINGS = FakeKeycloakSettings()
+"""Settings, faults can be changed at runtime"""
+
+KID = "fake-keycloak"
+"""Identifier of the signing key"""
+
+_PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+PRIVATE_PEM = _PRIVATE_KEY.private_bytes(
+    Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption()
+).decode()
+"""Key signing the access tokens"""
+PUBLIC_PEM = (
+    _PRIVATE_KEY.public_key()
+    .public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    .decode()
+)
+"""Key verifying the access tokens, to use as REALM_PUBLIC_KEY"""
+
+ATTRIBUTES: Dict[str, dict] = {}
+"""Attributes of the users indexed by user id"""
+
+RESOURCES: Dict[str, dict] = {}
+"""Resources indexed by id"""
+
+app = FastAPI(title="Fake Keycloak", default_response_class=ORJSONResponse)
+
+# ---------------------------------------------------------------------------------------
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    """
+    Delay the responses and fail some of them as configured
+    """
+    if not request.url.path.startswith("/_fake"):
+        delay = SETTINGS.latency + uniform(0, SETTINGS.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random() < SETTINGS.error_rate:
+            return ORJSONResponse(
+                {"error": "injected failure"}, status_code=SETTINGS.error_status
+            )
+    return await call_next(request)
+
+
+def _require_bearer(request: Request):
+    """
+    Reject the admin and protection requests without an access token
+
+    :param request: request received
+    """
+    if not request.headers.get("Authorization", "").startswith("Bearer "):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+def _issuer(request: Request, realm: str) -> str:
+    """
+    Issuer of the tokens of a realm, to use as ISSUER
+
+    :param request: request received
+    :param realm: realm of the tokens
+    :return: issuer
+    """
+    return f"{str(request.base_url).rstrip('/')}/auth/realms/{realm}"
+
+
+# ---------------------------------------------------------------------------------------
+
+
+@app.get("/_fake/faults", response_model=Faults)
+async def get_faults():
+    """Current latency and error injection"""
+    return SETTINGS
+
+
+@app.put("/_fake/faults", response_model=Faults)
+async def set_faults(faults: Faults):
+    """Change latency and error injection without restarting"""
+    for field, value in faults.dict().items():
+        setattr(SETTINGS, field, value)
+    return SETTINGS
+
+
+# ---------------------------------------------------------------------------------------
+
+
+@app.post("/auth/realms/{realm}/protocol/openid-connect/token")
+async def token(realm: str, request: Request):
+    """Issue a token for any credential, refresh tokens included"""
+    form = {
+        name: values[0]
+        for name, values in parse_qs((await request.body()).decode()).items()
+    }
+    grant_type = form.get("grant_type")
+    if grant_type == "refresh_token":
+        try:
+            claims = jwt.get_unverified_claims(form.get("refresh_token", ""))
+        except JWTError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+        username = claims["preferred_username"]
+    elif grant_type in ("password", "client_credentials"):
+        username = form.get("username") or f"service-account-{form.get('client_id')}"
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+
+    now = int(time())
+    claims = {
+        "iss": _issuer(request, realm),
+        "sub": str(uuid5(NAMESPACE_URL, username)),
+        "preferred_username": username,
+        "realm_access": {"roles": SETTINGS.roles},
+        "iat": now,
+        "exp": now + SETTINGS.token_lifespan,
+    }
+    headers = {"kid": KID}
+    return {
+        "access_token": jwt.encode(claims, PRIVATE_PEM, "RS256", headers=headers),
+        "expires_in": SETTINGS.token_lifespan,
+        "refresh_token": jwt.encode(
+            {**claims, "exp": now + 6 * SETTINGS.token_lifespan, "typ": "Refresh"},
+            PRIVATE_PEM,
+            "RS256",
+            headers=headers,
+        ),
+        "refresh_expires_in": 6 * SETTINGS.token_lifespan,
+        "token_type": "Bearer",
+    }
+
+
+@app.get("/auth/realms/{realm}/protocol/openid-connect/certs")
+async def certs(realm: str):
+    """Keys of the realm, to use as REALM_JWKS_URL"""
+    key = jwk.construct(PUBLIC_PEM, "RS256").to_dict()
+    return {"keys": [{**key, "kid": KID, "use": "sig"}]}
+
+
+@app.get("/auth/realms/{realm}")
+async def realm_info(realm: str, request: Request):
+    """Public key of the realm in the format of keycloak"""
+    return {
+        "realm": realm,
+        "public_key": "".join(PUBLIC_PEM.strip().splitlines()[1:-1]),
+        "token-service": f"{_issuer(request, realm)}/protocol/openid-connect",
+    }
+
+
+# ---------------------------------------------------------------------------------------
+
+
+@app.get("/auth/admin/realms/{realm}/clients/{client}/roles")
+async def client_roles(realm: str, client: str, request: Request):
+    """Roles of the client, used as available policies"""
+    _require_bearer(request)
+    return [{"name": role} for role in ("uma_protection", *SETTINGS.roles)]
+
+
+@app.get("/auth/admin/realms/{realm}/users/{user_id}")
+async def get_user(realm: str, user_id: str, request: Request):
+    """Representation of a user, only the attributes are stored"""
+    _require_bearer(request)
+    user = {"id": user_id, "enabled": True}
+    if user_id in ATTRIBUTES:
+        user["attributes"] = ATTRIBUTES[user_id]
+    return user
+
+
+@app.put(
+    "/auth/admin/realms/{realm}/users/{user_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def update_user(
+    realm: str, user_id: str, request: Request, user: dict = Body(...)
+):
+    """Update the attributes of a user"""
+    _require_bearer(request)
+    if "attributes" in user:
+        ATTRIBUTES[user_id] = {
+            name: value if isinstance(value, list) else [value]
+            for name, value in user["attributes"].items()
+        }
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def _resource(resource_id: str) -> dict:
+    """
+    Find a resource
+
+    :param resource_id: resource identifier
+    :return: resource
+    """
+    if resource_id not in RESOURCES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return RESOURCES[resource_id]
+
+
+@app.post(
+    "/auth/realms/{realm}/authz/protection/resource_set",
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_resource(realm: str, request: Request, resource: dict = Body(...)):
+    """Create a resource"""
+    _require_bearer(request)
+    if any(stored["name"] == resource.get("name") for stored in RESOURCES.values()):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT)
+    resource_id = str(uuid4())
+    RESOURCES[resource_id] = {**resource, "_id": resource_id}
+    return RESOURCES[resource_id]
+
+
+@app.get("/auth/realms/{realm}/authz/protection/resource_set/{resource_id}")
+async def get_resource(realm: str, resource_id: str, request: Request):
+    """Read a resource"""
+    _require_bearer(request)
+    return _resource(resource_id)
+
+
+@app.put(
+    "/auth/realms/{realm}/authz/protection/resource_set/{resource_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def update_resource(
+    realm: str, resource_id: str, request: Request, resource: dict = Body(...)
+):
+    """Replace a resource"""
+    _require_bearer(request)
+    _resource(resource_id)
+    RESOURCES[resource_id] = {**resource, "_id": resource_id}
+
+
+@app.delete(
+    "/auth/realms/{realm}/authz/protection/resource_set/{resource_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+)
+async def delete_resource(realm: str, resource_id: str, request: Request):
+    """Delete a resource"""
+    _require_bearer(request)
+    _resource(resource_id)
+    del RESOURCES[resource_id]
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def print_configuration(base_url: str, realm: str, client: str):
+    """
+    Print the settings that point BrainPEP to the fake keycloak
+
+    :param base_url: url of the fake keycloak
+    :param realm: realm of BrainPEP
+    :param client: client id of BrainPEP
+    """
+    realm_url = f"{base_url}/auth/realms/{realm}"
+    admin_url = f"{base_url}/auth/admin/realms/{realm}"
+    print(
+        f"ADMIN_TOKEN_REQUEST_URL = {base_url}/auth/realms/master/protocol/openid-connect/token"
+    )
+    print(f"CLIENT_TOKEN_REQUEST_URL = {realm_url}/protocol/openid-connect/token")
+    print(f"RESOURCE_REQUEST_URL = {realm_url}/authz/protection/resource_set")
+    print(f"POLICY_REQUEST_URL = {admin_url}/clients/{client}/roles")
+    print(f"USER_ATTRIBUTE_REQUEST_URL = {admin_url}/users")
+    print(f"ISSUER = {realm_url}")
+    print(f"REALM_JWKS_URL = {realm_url}/protocol/openid-connect/certs")
+
+
+if __name__ == "__main__":
+    # Third Party
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Keycloak stand-in for BrainPEP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to bind")
+    parser.add_argument("--port", type=int, default=8180, help="port to bind")
+    parser.add_argument("--realm", default="Brainiot", help="realm of BrainPEP")
+    parser.add_argument("--client", default="brainpep", help="client of BrainPEP")
+    parser.add_argument("--latency", type=float, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, help="max random seconds added")
+    parser.add_argument("--error-rate", type=float, help="fraction of requests failed")
+    parser.add_argument("--error-status", type=int, help="status of the failures")
+    arguments = parser.parse_args()
+
+    for option in ("latency", "jitter", "error_rate", "error_status"):
+        if getattr(arguments, option) is not None:
+            setattr(SETTINGS, option, getattr(arguments, option))
+    print_configuration(
+        f"http://{arguments.host}:{arguments.port}", arguments.realm, arguments.client
+    )
+    uvicorn.run(app, host=arguments.host, port=arguments.port, log_level="warning")
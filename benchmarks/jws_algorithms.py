@@ -0,0 +1,111 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+
+Compare the algorithms available for the device policies jws:
+
+    ~$ python -m benchmarks.jws_algorithms --seconds 2
+"""
+
+# Standard Library
+import argparse
+from time import perf_counter
+from typing import Callable
+
+# Third Party
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
+
+# Internal
+from app.models.brain_pep.device import Device
+from app.models.brain_pep.policy import Policy
+from app.security.keys import PolicySigner, PolicyVerifier, load_key
+
+# ---------------------------------------------------------------------------------------
+
+ALGORITHMS = {
+    "RS256": lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    "ES256": lambda: ec.generate_private_key(ec.SECP256R1()),
+    "EdDSA": ed25519.Ed25519PrivateKey.generate,
+}
+"""Algorithms compared and the generators of their keys"""
+
+
+def throughput(operation: Callable, seconds: float) -> float:
+    """
+    Measure the operations per second
+
+    :param operation: operation to repeat
+    :param seconds: duration of the measure
+    :return: operations per second
+    """
+    count = 0
+    start = perf_counter()
+    deadline = start + seconds
+    while perf_counter() < deadline:
+        operation()
+        count += 1
+    return count / (perf_counter() - start)
+
+
+def main(seconds: float):
+    """
+    Print sign and verify throughput and token size of every algorithm
+
+    :param seconds: duration of every measure
+    """
+    payload = Device(
+        device_id="benchmark_device",
+        policy_list=list(Policy),
+    ).signature_conversion()
+
+    print(f"{'algorithm':<10}{'sign/s':>12}{'verify/s':>12}{'token bytes':>14}")
+    for algorithm, generate_key in ALGORITHMS.items():
+        private_key = generate_key()
+        signer = PolicySigner(
+            load_key(
+                private_key.private_bytes(
+                    Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()
+                ).decode(),
+                algorithm,
+            ),
+            algorithm,
+        )
+        verifier = PolicyVerifier(
+            load_key(
+                private_key.public_key()
+                .public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+                .decode(),
+                algorithm,
+            ),
+            algorithm,
+        )
+
+        token = signer.sign(payload)
+        sign = throughput(lambda: signer.sign(payload), seconds)
+        verify = throughput(lambda: verifier.verify(token), seconds)
+        print(f"{algorithm:<10}{sign:>12.0f}{verify:>12.0f}{len(token):>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the algorithms of the device policies jws"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=1.0, help="duration of every measure"
+    )
+    main(parser.parse_args().seconds)
@@ -13,6 +13,7 @@
 """
 
 # Standard Library
+import asyncio
 import os
 
 # Third Party
@@ -20,6 +21,8 @@ from gunicorn.app.base import BaseApplication
 from pydantic import BaseSettings
 
 # Internal
+from app.config import get_database_settings
+from app.db.migrations import migrate
 from app.main import app
 
 # -------------------------------------------------------------
@@ -84,4 +87,11 @@ if __name__ == "__main__":
     # Ensure connections to the database are set to the max value possible
     os.environ["CONNECTION_NUMBER"] = f'{int(settings.database_max_connection_number / options["workers"])}'
 
+    # Apply the schema migrations once, before starting the workers
+    database_settings = get_database_settings()
+    if database_settings.migrate_on_startup:
+        asyncio.run(migrate())
+        database_settings.migrate_on_startup = False
+        os.environ["MIGRATE_ON_STARTUP"] = "false"
+
     StandaloneApplication(app, options).run()
@@ -0,0 +1,36 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from datetime import datetime
+
+# Internal
+from app.db.codecs import JSONB_VERSION, decode_jsonb, encode_jsonb
+from app.models.brain_pep.device import Device
+from app.models.brain_pep.policy import Policy
+
+# ------------------------------------------------------------------------------
+
+
+def test_jsonb_codec():
+    """Test that the models stored as jsonb are decoded back unchanged"""
+    device = Device(
+        device_id="device",
+        policy_list=[Policy.commercial_policy],
+        storage_policy=datetime(2021, 5, 7, 7, 50, 39),
+    )
+    data = encode_jsonb(device.dict(exclude_none=True))
+    assert data.startswith(JSONB_VERSION)
+    assert data[1:] == device.json(exclude_none=True).encode()
+    assert Device.parse_obj(decode_jsonb(data)) == device
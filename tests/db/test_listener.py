@@ -0,0 +1,65 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+
+# Test
+import pytest
+import uvloop
+
+# Internal
+from app.db import postgresql
+from app.db.postgresql import DataBase
+from app.internals.metrics import collect_metrics
+from ..internals.logger import disable_logger
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+@pytest.mark.asyncio
+async def test_listener_failure(monkeypatch):
+    """Test that the device listener survives any failure, flushing the caches"""
+    disable_logger()
+
+    async def fail(on_change):
+        raise RuntimeError("unexpected")
+
+    monkeypatch.setattr(DataBase, "_listen_connection", fail)
+    monkeypatch.setattr(postgresql, "LISTEN_RETRY_INTERVAL", 0)
+    changes = []
+    DataBase.listen_device_changes(changes.append)
+    try:
+        for _ in range(10):
+            await asyncio.sleep(0)
+        stats = collect_metrics()["device_listener"]
+        assert stats["alive"], "Listener must survive"
+        assert not stats["connected"]
+        assert stats["failures"] > 1, "Listener must connect again"
+        assert changes and set(changes) == {None}, "Caches must be flushed"
+    finally:
+        DataBase.device_listener.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await DataBase.device_listener
+        DataBase.device_listener = None
@@ -0,0 +1,45 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Test
+import pytest
+import uvloop
+
+# Internal
+from app.db.migrations import migrate, MIGRATIONS
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+def test_migration_versions():
+    """Test that the migrations are sorted by unique versions"""
+    versions = [migration.version for migration in MIGRATIONS]
+    assert versions == sorted(set(versions)), "Versions must be unique and sorted"
+
+
+@pytest.mark.asyncio
+async def test_migrate():
+    """Test that every migration is applied only once"""
+    await migrate()
+    assert await migrate() == [], "Migrations must be already applied"
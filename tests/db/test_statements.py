@@ -0,0 +1,98 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Test
+import pytest
+import uvloop
+
+# Internal
+from app.db.query import DELETE, INSERT, NOTIFY, OUTBOX, SELECT, UPDATE
+from app.db.statements import CAN_PREPARE_CACHED, STATEMENTS, StatementRegistry
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+class Connection:
+    """Connection recording the statements prepared, answering without a database"""
+
+    def __init__(self):
+        self.prepared = []
+
+    async def _prepare(self, query: str, use_cache: bool = False):
+        self.prepared.append(query)
+
+    async def fetch(self, query: str, *args):
+        return []
+
+    async def fetchval(self, query: str, *args):
+        return args[0]
+
+    async def execute(self, query: str, *args):
+        if "fail" in args:
+            raise ValueError(query)
+        return "UPDATE 1"
+
+
+def test_registry_statements():
+    """Test that every query of the service is registered"""
+    queries = [
+        *SELECT.values(),
+        *INSERT.values(),
+        *UPDATE.values(),
+        *DELETE.values(),
+        *OUTBOX.values(),
+        *NOTIFY.values(),
+    ]
+    assert sorted(STATEMENTS.statements.values()) == sorted(queries)
+    assert STATEMENTS.statements["select_device"] == SELECT["device"]
+    assert STATEMENTS.statements["outbox_pending"] == OUTBOX["pending"]
+
+
+@pytest.mark.asyncio
+async def test_registry_stats():
+    """Test the preparation and the statistics of the statements"""
+    registry = StatementRegistry({"select": "SELECT $1;", "update": "UPDATE;"})
+    connection = Connection()
+    await registry.init(connection)
+    assert connection.prepared == ["SELECT $1;", "UPDATE;"]
+
+    assert await registry.fetchval(connection, "select", 42) == 42
+    assert await registry.execute(connection, "update") == "UPDATE 1"
+    with pytest.raises(ValueError):
+        await registry.execute(connection, "update", "fail")
+
+    stats = registry.stats()
+    assert stats["select"]["calls"] == 1
+    assert stats["select"]["errors"] == 0
+    assert stats["update"]["calls"] == 2
+    assert stats["update"]["errors"] == 1
+    assert stats["update"]["max_ms"] >= stats["update"]["mean_ms"] >= 0
+
+    with pytest.raises(KeyError):
+        await registry.fetch(connection, "unknown")
+
+
+def test_asyncpg_prepare():
+    """Test that the installed asyncpg prepares the statements in advance"""
+    assert CAN_PREPARE_CACHED, "Statements would be prepared at their first use"
@@ -0,0 +1,64 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import time
+
+# Internal
+from app.internals.cache import TTLCache
+
+# ------------------------------------------------------------------------------
+
+
+class TestTTLCache:
+    """
+    Test the in memory cache
+    """
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1, "Entry must be cached"
+        cache.set("c", 3)
+        assert cache.get("b") is None, "Least recently used entry must be evicted"
+        assert cache.get("a") == 1, "Entry must be cached"
+        assert cache.get("c") == 3, "Entry must be cached"
+        assert cache.stats()["evictions"] == 1, "Eviction must be counted"
+
+    def test_ttl(self):
+        """Test the expiration of the entries"""
+        cache = TTLCache(maxsize=2, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        assert cache.get("a") is None, "Entry must be expired"
+        assert len(cache) == 0, "Expired entry must be removed"
+
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1, ttl=0.01)
+        cache.set("b", 2, ttl=-1)
+        time.sleep(0.02)
+        assert cache.get("a") is None, "Entry must expire with its own ttl"
+        assert len(cache) == 0, "Already expired entry must not be stored"
+
+    def test_invalidation(self):
+        """Test the invalidation of the entries"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.pop("a")
+        cache.pop("missing")
+        assert cache.get("a") is None, "Entry must be invalidated"
+        stats = cache.stats()
+        assert stats["hits"] == 0 and stats["misses"] == 1, "Lookups must be counted"
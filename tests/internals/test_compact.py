@@ -0,0 +1,127 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from datetime import datetime, timedelta
+
+# Test
+import pytest
+import uvloop
+
+# Third Party
+from fastapi import HTTPException
+
+# Internal
+from app.internals.policy.compact import (
+    decode_compact_policies,
+    encode_compact_policies,
+    sign_compact_policies,
+    to_text,
+    verify_compact_policies,
+)
+from app.internals.policy.device import (
+    compact_policies,
+    get_compact_policy_store,
+    get_signed_policy_store,
+    sign_device_policies,
+    signed_policies,
+)
+from app.internals.policy.engine import compile_device
+from app.internals.policy.gateway import compile_signed_device
+from app.models.brain_pep.device import Device
+from app.models.brain_pep.policy import Policy
+from app.security.policy_rsa import sign_user_policies
+from ..security.token import change_default_security_settings
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+class TestCompactPolicies:
+    """
+    Test the compact layout of the signed policies
+    """
+
+    def test_layout(self):
+        """Test the encoding of the policies"""
+        device = Device(
+            device_id="compact",
+            policy_list=[Policy.anonymization_policy, Policy.commercial_policy],
+            storage_policy=datetime(2030, 1, 1),
+        )
+        message = encode_compact_policies(device)
+        assert message[:9] == b"\x01\x07compact", "Header must be encoded"
+        assert len(message) == 21, "Layout must be fixed"
+
+        signed, compiled, signature = decode_compact_policies(message + b"sig")
+        assert signed == message and signature == b"sig", "Must be split"
+        assert compiled == compile_device(device), "Policies must be preserved"
+
+        with pytest.raises(ValueError):
+            decode_compact_policies(b"\x02\x00")
+
+    @pytest.mark.asyncio
+    async def test_signature(self):
+        """Test the signature of the compact policies"""
+        change_default_security_settings()
+        device = Device(
+            device_id="compact_signed",
+            policy_list=[Policy.disclosure_policy],
+            storage_policy=datetime.now() + timedelta(days=1),
+        )
+        token = await sign_compact_policies(device)
+        text = to_text(token)
+        jws = sign_user_policies(device.signature_conversion())
+        get_compact_policy_store().set(device.device_id, compact_policies(token))
+        get_signed_policy_store().set(device.device_id, signed_policies(jws))
+        compiled = compile_device(device)
+        assert await verify_compact_policies(text) == compiled._replace(
+            storage_expiration=int(compiled.storage_expiration)
+        ), "Policies must be verified"
+        assert await compile_signed_device(text) == await verify_compact_policies(text)
+
+        # Both forms are accepted
+        assert (await compile_signed_device(jws)).mask == compiled.mask
+
+        policies = text[:14] + ("B" if text[14] != "B" else "C") + text[15:]
+        for tampered in (text[:-4] + "AAAA", policies, "", "?"):
+            with pytest.raises(HTTPException):
+                await compile_signed_device(tampered)
+
+    @pytest.mark.asyncio
+    async def test_revocation(self):
+        """Test that the tokens signed before a change of the device are rejected"""
+        change_default_security_settings()
+        device = Device(device_id="compact_revoked", policy_list=[])
+        old_jws, old_token = await sign_device_policies(device)
+        device.policy_list = [Policy.commercial_policy]
+        jws, token = await sign_device_policies(device)
+        get_compact_policy_store().set(device.device_id, compact_policies(token))
+        get_signed_policy_store().set(device.device_id, signed_policies(jws))
+
+        for signature in (jws, to_text(token)):
+            assert (await compile_signed_device(signature)).mask != 0
+        for signature in (old_jws, to_text(old_token)):
+            with pytest.raises(HTTPException) as error:
+                await compile_signed_device(signature)
+            assert error.value.detail == "revoked jws"
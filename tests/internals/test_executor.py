@@ -0,0 +1,99 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+import threading
+
+# Test
+import pytest
+import uvloop
+
+# Internal
+from app.internals.executor import CryptoExecutor
+from app.internals.metrics import collect_metrics
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+class TestCryptoExecutor:
+    """
+    Test the executor of the cryptographic operations
+    """
+
+    @pytest.mark.asyncio
+    async def test_inline(self):
+        """Test that the inline executor runs the operations in the event loop"""
+        executor = CryptoExecutor("inline", workers=2, max_pending=4)
+        assert await executor.run(threading.get_ident) == threading.get_ident()
+        assert executor.stats()["inline"] == 1, "Operation must be counted"
+
+    @pytest.mark.asyncio
+    async def test_thread(self):
+        """Test that the thread executor runs the operations in the workers"""
+        executor = CryptoExecutor("thread", workers=2, max_pending=4)
+        try:
+            assert await executor.run(threading.get_ident) != threading.get_ident()
+            assert await asyncio.gather(
+                *(executor.run(pow, 2, i) for i in range(8))
+            ) == [2**i for i in range(8)]
+            stats = executor.stats()
+            assert stats["pending"] == 0, "Operations must be completed"
+            assert stats["completed"] == 9, "Must be counted"
+            assert stats["max_queue_depth"] <= 4, "Queue must be bounded"
+        finally:
+            executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_backpressure(self):
+        """Test that the operations exceeding the queue wait instead of running inline"""
+        executor = CryptoExecutor("thread", workers=1, max_pending=1)
+        try:
+            assert threading.get_ident() not in await asyncio.gather(
+                *(executor.run(threading.get_ident) for _ in range(8))
+            )
+            stats = executor.stats()
+            assert stats["inline"] == 0, "Operations must not run in the event loop"
+            assert stats["completed"] == 8, "Operations must be completed"
+            assert stats["max_queue_depth"] <= 1, "Queue must be bounded"
+            assert stats["max_waiting"] > 0, "Operations must wait for a slot"
+            assert stats["waiting"] == 0, "Slots must be released"
+        finally:
+            executor.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_process(self):
+        """Test that the process executor runs the operations in the workers"""
+        executor = CryptoExecutor("process", workers=1, max_pending=4)
+        try:
+            assert await executor.run(pow, 2, 10) == 1024
+            assert executor.stats()["completed"] == 1, "Operation must be counted"
+        finally:
+            executor.shutdown()
+
+    def test_metrics(self):
+        """Test that the executor metrics are exposed"""
+        with pytest.raises(ValueError):
+            CryptoExecutor("unknown", workers=1, max_pending=1)
+        assert "crypto_executor" in collect_metrics(), "Metrics must be exposed"
@@ -0,0 +1,96 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+
+# Test
+import pytest
+import uvloop
+
+# Third Party
+from fastapi import status
+from orjson import loads
+from pydantic import ValidationError
+
+# Internal
+from app.config import GatewaySettings
+from app.internals.policy import gateway
+from app.internals.policy.gateway import _evaluate_message, _receive_messages
+from .logger import disable_logger
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+class BrokenWebSocket:
+    """Gateway connection failing after the first message"""
+
+    def __init__(self):
+        self.received = 0
+
+    async def receive_text(self) -> str:
+        self.received += 1
+        if self.received > 1:
+            raise RuntimeError("unexpected")
+        return "not a message"
+
+
+class TestDecisionStream:
+    """
+    Test the evaluation of the messages of a decision stream
+    """
+
+    @pytest.mark.asyncio
+    async def test_receiver_failure(self):
+        """Test that the sender is stopped whatever stops the receiver"""
+        disable_logger()
+        pending = asyncio.Queue(maxsize=4)
+        await asyncio.wait_for(_receive_messages(BrokenWebSocket(), pending), 1)
+        decision = await pending.get()
+        assert loads(await decision)["status_code"] == (
+            status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+        assert await pending.get() is None, "Sender must be stopped"
+
+    @pytest.mark.asyncio
+    async def test_evaluation_failure(self, monkeypatch):
+        """Test that an unexpected error fails only the decision of its message"""
+        disable_logger()
+        message = '{"service_list": [], "sign_device": "signature"}'
+        decision = loads(await _evaluate_message(message))
+        assert decision["status_code"] == status.HTTP_401_UNAUTHORIZED
+
+        async def fail(message_list):
+            raise RuntimeError("unexpected")
+
+        monkeypatch.setattr(gateway, "evaluate_messages", fail)
+        decision = loads(await _evaluate_message(message))
+        assert decision["status_code"] == status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    def test_max_pending(self):
+        """Test that the queue of the pending decisions must be bounded"""
+        assert GatewaySettings(stream_max_pending=1).stream_max_pending == 1
+        for max_pending in (0, -1):
+            with pytest.raises(ValidationError):
+                GatewaySettings(stream_max_pending=max_pending)
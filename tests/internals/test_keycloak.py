@@ -12,6 +12,9 @@
  ******************************************************************************
 """
 
+# Standard Library
+import asyncio
+
 # Test
 import respx
 import pytest
@@ -19,14 +22,26 @@ import uvloop
 from fastapi import HTTPException
 
 # Internal
-from app.internals.keycloak.attributes import get_user_identifier, set_user_identifier
-from app.internals.keycloak.policy import get_available_policies
+from app.internals.keycloak.attributes import (
+    get_user_identifier,
+    get_user_identifier_cache,
+    set_user_identifier,
+)
+from app.internals.keycloak.policy import (
+    get_available_policies,
+    get_policy_catalogue,
+)
 from app.internals.keycloak.resources import (
     insert_resource,
     update_resource,
     delete_resource,
 )
-from app.internals.keycloak.token import get_brain_pep_token, get_admin_token
+from app.internals.keycloak import token as keycloak_token
+from app.internals.keycloak.token import (
+    get_admin_token,
+    get_brain_pep_token,
+    get_client_token_manager,
+)
 from app.internals.session import close_keycloak_session
 from app.models.brain_pep.service import Service
 
@@ -37,7 +52,10 @@ from ..mock.attributes import (
     error_get_user_identifier,
     error_set_user_identifier,
 )
-from ..mock.policy import correct_get_available_policies
+from ..mock.policy import (
+    correct_get_available_policies,
+    error_get_available_policies,
+)
 from ..mock.resources import (
     correct_insert_resource,
     correct_update_resource,
@@ -95,6 +113,67 @@ class TestGetKeycloakToken:
             await get_admin_token()
         await close_keycloak_session()
 
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_token_manager(self, monkeypatch):
+        """Test the reuse of the tokens until they expire"""
+        clock = [1000.0]
+        monkeypatch.setattr(keycloak_token, "monotonic", lambda: clock[0])
+        route = correct_get_token(TokenType.client, "ClientToken", 300, "Refresh")
+        manager = get_client_token_manager()
+        manager.expiry_margin, manager.refresh_ahead = 10, 60
+        try:
+            tokens = await asyncio.gather(*(get_brain_pep_token() for _ in range(4)))
+            assert tokens == ["ClientToken"] * 4, "Token must be shared"
+            assert await get_brain_pep_token() == "ClientToken"
+            assert route.call_count == 1, "Token must be requested once"
+
+            # Token about to expire
+            route = correct_get_token(TokenType.client, "RefreshedToken", 300)
+            clock[0] += 300 - 60
+            assert await get_brain_pep_token() == "ClientToken", "Must be reused"
+            await asyncio.sleep(0)
+            assert await get_brain_pep_token() == "RefreshedToken", "Must be refreshed"
+            assert b"grant_type=refresh_token" in route.calls.last.request.content
+            assert manager.stats()["refreshes"] == 1, "Refresh token must be used"
+
+            # Token rejected before its expiration
+            route = correct_get_token(TokenType.client, "NewToken", 300)
+            manager.discard("ClientToken")
+            assert await get_brain_pep_token() == "RefreshedToken", "Must be kept"
+            manager.discard("RefreshedToken")
+            assert await get_brain_pep_token() == "NewToken", "Must be requested"
+            assert manager.stats()["discarded"] == 1
+        finally:
+            get_client_token_manager.cache_clear()
+            await close_keycloak_session()
+
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_token_manager_short_lived(self, monkeypatch):
+        """Test that a token shorter than the refresh ahead is not refreshed every call"""
+        clock = [1000.0]
+        monkeypatch.setattr(keycloak_token, "monotonic", lambda: clock[0])
+        route = correct_get_token(TokenType.client, "ClientToken", 60)
+        manager = get_client_token_manager()
+        manager.expiry_margin, manager.refresh_ahead = 10, 60
+        try:
+            for _ in range(10):
+                assert await get_brain_pep_token() == "ClientToken"
+                await asyncio.sleep(0)
+            clock[0] += 29
+            assert await get_brain_pep_token() == "ClientToken"
+            await asyncio.sleep(0)
+            assert route.call_count == 1, "Token must be refreshed at half validity"
+
+            clock[0] += 1
+            assert await get_brain_pep_token() == "ClientToken", "Must be reused"
+            await asyncio.sleep(0)
+            assert route.call_count == 2, "Token must be refreshed in background"
+        finally:
+            get_client_token_manager.cache_clear()
+            await close_keycloak_session()
+
 
 class TestKeycloakAttributes:
     """
@@ -106,10 +185,18 @@ class TestKeycloakAttributes:
     async def test_get_user_identifier(self):
         """Test the behaviour of get_user_identifier"""
 
+        get_user_identifier_cache().clear()
         # Mock the request
         correct_get_user_identifier("keycloak_id", "requested_id")
         requested_id = await get_user_identifier("fake_token", "keycloak_id")
         assert requested_id == "requested_id", "Requested id must be equal"
+
+        # The identifier is served from the cache
+        error_get_user_identifier("keycloak_id")
+        requested_id = await get_user_identifier("fake_token", "keycloak_id")
+        assert requested_id == "requested_id", "Requested id must be cached"
+
+        get_user_identifier_cache().clear()
         with pytest.raises(HTTPException):
             error_get_user_identifier("keycloak_id")
             requested_id = await get_user_identifier("fake_token", "keycloak_id")
@@ -120,9 +207,13 @@ class TestKeycloakAttributes:
     async def test_set_user_identifier(self):
         """Test the behaviour of set_user_identifier"""
 
+        get_user_identifier_cache().clear()
         # Mock the request
         correct_set_user_identifier("keycloak_id")
-        await set_user_identifier("fake_token", "keycloak_id")
+        identifier = await set_user_identifier("fake_token", "keycloak_id")
+        assert (
+            get_user_identifier_cache().get("keycloak_id") == identifier
+        ), "The identifier must be written through the cache"
         with pytest.raises(HTTPException):
             error_set_user_identifier("keycloak_id")
             await set_user_identifier("fake_token", "keycloak_id")
@@ -143,8 +234,38 @@ class TestKeycloakPolicies:
         correct_get_available_policies(["policy_1"])
         policy_list = await get_available_policies()
         assert policy_list == ["policy_1"], "Policy must be equal"
+        get_policy_catalogue.cache_clear()
         await close_keycloak_session()
 
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_policy_catalogue(self):
+        """Test the catalogue of the available policies"""
+        catalogue = get_policy_catalogue()
+        try:
+            correct_get_available_policies(["policy_1"])
+            assert await get_available_policies() == ["policy_1"]
+            assert await get_available_policies() == ["policy_1"]
+            assert catalogue.stats()["hits"] == 1, "Policies must be cached"
+
+            # Expired policies are served while refreshing them
+            correct_get_available_policies(["policy_1", "policy_2"])
+            catalogue.ttl = 0
+            assert await get_available_policies() == ["policy_1"]
+            await asyncio.sleep(0.01)
+            assert await get_available_policies() == ["policy_1", "policy_2"]
+
+            # Keycloak unreachable
+            error_get_available_policies()
+            assert await get_available_policies() == ["policy_1", "policy_2"]
+            # Wait for the retries of the refresh
+            await asyncio.sleep(0.5)
+            assert await get_available_policies() == ["policy_1", "policy_2"]
+            assert catalogue.stats()["failed_refreshes"] >= 1, "Must be counted"
+        finally:
+            get_policy_catalogue.cache_clear()
+            await close_keycloak_session()
+
 
 class TestKeycloakResources:
     """
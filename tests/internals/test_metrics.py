@@ -0,0 +1,53 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+import asyncio
+
+# Test
+import pytest
+
+# Internal
+from app.internals.metrics import StageLatency
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_stage_latency():
+    """Test the latency of concurrent stages"""
+    latency = StageLatency()
+
+    async def stage(seconds: float) -> float:
+        await asyncio.sleep(seconds)
+        return seconds
+
+    async def failed_stage():
+        raise ValueError("stage failed")
+
+    result = await latency.measure(
+        "total",
+        asyncio.gather(
+            latency.measure("slow", stage(0.05)), latency.measure("fast", stage(0.04))
+        ),
+    )
+    assert result == [0.05, 0.04]
+    with pytest.raises(ValueError):
+        await latency.measure("fast", failed_stage())
+
+    stats = latency.stats()
+    assert stats["fast"]["count"] == 2, "Failed stages must be counted"
+    assert stats["slow"]["count"] == 1
+    assert stats["slow"]["max_ms"] >= 50
+    assert stats["total"]["max_ms"] < 80, "The stages must overlap"
@@ -0,0 +1,144 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Test
+import respx
+import pytest
+import uvloop
+
+# Third Party
+from asyncpg.exceptions import InterfaceError
+from fastapi import HTTPException, status
+
+# Internal
+from app.db.postgresql import OutboxEntry, OutboxOperation
+from app.internals.keycloak.resources import UNREACHABLE
+from app.internals.policy.outbox import OutboxDispatcher
+from app.internals.session import close_keycloak_session
+from app.models.brain_pep.service import Service
+
+# Mock
+from .logger import disable_logger
+from ..mock.resources import (
+    correct_delete_resource,
+    correct_insert_resource,
+    correct_update_resource,
+    error_delete_resource,
+    error_update_resource,
+)
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+def outbox_entry(
+    operation: OutboxOperation, keycloak_identifier: str = None
+) -> OutboxEntry:
+    """
+    Generate an operation of the outbox
+
+    :param operation: operation to push
+    :param keycloak_identifier: keycloak resource
+    :return: operation
+    """
+    return OutboxEntry(
+        id=1,
+        service_id="service",
+        username="test_user",
+        operation=operation,
+        resource=Service(name="service", resource_scopes=[]).dict(),
+        keycloak_identifier=keycloak_identifier,
+        attempts=0,
+    )
+
+
+# ------------------------------------------------------------------------------
+
+
+class TestOutboxDispatcher:
+    """
+    Test the push of the outbox operations to keycloak
+    """
+
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_push(self):
+        """Test the keycloak requests of every operation"""
+        disable_logger()
+        push = OutboxDispatcher._push
+        correct_insert_resource("keycloak_id")
+        assert await push(outbox_entry(OutboxOperation.insert)) == "keycloak_id"
+
+        correct_update_resource("keycloak_id")
+        update = outbox_entry(OutboxOperation.update, "keycloak_id")
+        assert await push(update) is None
+        error_update_resource("keycloak_id")
+        with pytest.raises(HTTPException):
+            await push(update)
+
+        correct_delete_resource("keycloak_id")
+        delete = outbox_entry(OutboxOperation.delete, "keycloak_id")
+        assert await push(delete) is None
+        error_delete_resource("keycloak_id")
+        assert await push(delete) is None, "Resources already deleted are ignored"
+
+        # Resource never created
+        assert await push(outbox_entry(OutboxOperation.update)) is None
+        await close_keycloak_session()
+
+    def test_refused(self):
+        """Test that only the refusals of the resource endpoint are not retried"""
+        refused = OutboxDispatcher.is_refused
+        for status_code in (
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_409_CONFLICT,
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+        ):
+            assert refused(HTTPException(status_code, "refused")), status_code
+
+        transient = (
+            # Token endpoint down or circuit open
+            HTTPException(status.HTTP_404_NOT_FOUND, "Can't contact Keycloak service"),
+            # Credentials or cached token rejected
+            HTTPException(status.HTTP_401_UNAUTHORIZED, "Wrong credentials"),
+            HTTPException(status.HTTP_401_UNAUTHORIZED, "HTTPStatusError()"),
+            HTTPException(status.HTTP_403_FORBIDDEN, "HTTPStatusError()"),
+            HTTPException(status.HTTP_408_REQUEST_TIMEOUT, "HTTPStatusError()"),
+            HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, "HTTPStatusError()"),
+            HTTPException(status.HTTP_404_NOT_FOUND, UNREACHABLE),
+            HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "HTTPStatusError()"),
+            InterfaceError("connection closed"),
+        )
+        for error in transient:
+            assert not refused(error), error
+        assert not refused("keycloak_id"), "Pushed operations are not refused"
+        assert not refused(None), "Pushed operations are not refused"
+
+    def test_delay(self):
+        """Test the backoff of the failed operations"""
+        dispatcher = OutboxDispatcher(
+            batch_size=10, poll_interval=1, backoff=1, max_backoff=5
+        )
+        assert 0.5 <= dispatcher.delay(0) <= 1
+        assert 2 <= dispatcher.delay(2) <= 4
+        assert 2.5 <= dispatcher.delay(10) <= 5, "The backoff is capped"
@@ -0,0 +1,91 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from datetime import datetime, timedelta
+
+# Internal
+from app.internals.policy.engine import (
+    compile_device,
+    compile_service,
+    filter_services,
+    is_allowed,
+)
+from app.models.brain_pep.device import Device
+from app.models.brain_pep.policy import Policy, ServicePolicy
+from app.models.brain_pep.service import Service
+
+# ------------------------------------------------------------------------------
+
+
+class TestPolicyEngine:
+    """
+    Test the evaluation of the compiled policies
+    """
+
+    def test_subset(self):
+        """Test that a service is allowed only if the device grants all its scopes"""
+        device = compile_device(
+            Device(
+                device_id="device",
+                policy_list=[Policy.commercial_policy, Policy.disclosure_policy],
+            )
+        )
+        allowed = compile_service(
+            Service(name="allowed", resource_scopes=[ServicePolicy.commercial_policy])
+        )
+        empty = compile_service(Service(name="empty", resource_scopes=[]))
+        denied = compile_service(
+            Service(
+                name="denied",
+                resource_scopes=[
+                    ServicePolicy.commercial_policy,
+                    ServicePolicy.purpose_profiling_policy,
+                ],
+            )
+        )
+        assert is_allowed(allowed, device), "Service must be allowed"
+        assert is_allowed(empty, device), "Service without scopes must be allowed"
+        assert not is_allowed(denied, device), "Service must be denied"
+        assert filter_services([denied, allowed, empty], device) == [
+            allowed.service,
+            empty.service,
+        ], "Order must be preserved"
+
+    def test_storage(self):
+        """Test the evaluation of the storage policy"""
+        service = compile_service(
+            Service(name="storage", resource_scopes=[ServicePolicy.storage_policy])
+        )
+        assert service.mask == 0, "Storage policy must be evaluated apart"
+        assert service.requires_storage, "Storage policy must be detected"
+
+        without_storage = compile_device(Device(device_id="device", policy_list=[]))
+        expired = compile_device(
+            Device(
+                device_id="device",
+                policy_list=[],
+                storage_policy=datetime.now() - timedelta(days=1),
+            )
+        )
+        valid = compile_device(
+            Device(
+                device_id="device",
+                policy_list=[],
+                storage_policy=datetime.now() + timedelta(days=1),
+            )
+        )
+        assert not is_allowed(service, without_storage), "Storage must be denied"
+        assert not is_allowed(service, expired), "Expired storage must be denied"
+        assert is_allowed(service, valid), "Storage must be allowed"
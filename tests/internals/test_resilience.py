@@ -0,0 +1,64 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from time import sleep
+
+# Internal
+from app.internals.resilience import CircuitBreaker, CircuitState, RetryPolicy
+
+# ------------------------------------------------------------------------------
+
+
+def test_circuit_breaker():
+    """Test the transitions of the circuit breaker"""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    assert not breaker.record_failure()
+    assert breaker.record_success() is False, "A closed circuit stays closed"
+    assert not breaker.record_failure()
+    assert breaker.record_failure(), "Consecutive failures open the circuit"
+    assert breaker.state is CircuitState.open
+    assert not breaker.allow()
+
+    # Failed probe
+    sleep(0.05)
+    assert breaker.allow()
+    assert breaker.state is CircuitState.half_open
+    assert breaker.record_failure(), "A failed probe opens the circuit"
+    assert not breaker.allow()
+
+    # Successful probe
+    sleep(0.05)
+    assert breaker.allow()
+    assert breaker.record_success()
+    assert breaker.state is CircuitState.closed
+
+    assert breaker.stats() == {
+        "state": "closed",
+        "opened": 2,
+        "half_opened": 2,
+        "closed": 1,
+        "rejected": 2,
+    }
+
+
+def test_retry_policy():
+    """Test the backoff of the retries"""
+    retry = RetryPolicy(retries=3, backoff=0.1, max_backoff=0.3)
+    assert retry.delay(1, jitter=1) == 0.1
+    assert retry.delay(2, jitter=1) == 0.2
+    assert retry.delay(3, jitter=1) == 0.3, "The backoff is capped"
+    assert retry.delay(3, jitter=0.5) == 0.15
+    assert 0 <= retry.delay(2) <= 0.2
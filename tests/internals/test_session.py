@@ -0,0 +1,142 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Test
+import respx
+import pytest
+import uvloop
+
+# Third Party
+from httpx import ConnectError, Response
+
+# Internal
+from app.config import get_brainpep_settings, get_keycloak_settings
+from app.internals.metrics import collect_metrics
+from app.internals.resilience import CircuitOpenError
+from app.internals.session import (
+    EndpointStats,
+    close_keycloak_session,
+    get_keycloak_session,
+    get_keycloak_transport,
+)
+
+# Mock
+from .logger import disable_logger
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture()
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+# ------------------------------------------------------------------------------
+
+
+class TestKeycloakSession:
+    """
+    Test the connection pool to keycloak
+    """
+
+    def test_pool_wait(self):
+        """Test that the pool wait is reported only if it was measured"""
+        endpoint = EndpointStats()
+        endpoint.record(0.5, None)
+        stats = endpoint.stats()
+        assert stats["max_latency_ms"] == 500
+        assert stats["mean_pool_wait_ms"] is None, "Latency is not the pool wait"
+        assert stats["max_pool_wait_ms"] is None
+
+        endpoint.record(0.5, 0.1)
+        stats = endpoint.stats()
+        assert stats["mean_pool_wait_ms"] == stats["max_pool_wait_ms"] == 100
+
+    @pytest.mark.asyncio
+    async def test_settings(self):
+        """Test that the pool is configured from the settings"""
+        settings = get_keycloak_settings()
+        session = get_keycloak_session()
+        assert session.timeout.read == settings.keycloak_timeout
+        assert session.timeout.pool == settings.keycloak_pool_timeout
+        assert get_keycloak_transport() is session._transport
+        await close_keycloak_session()
+
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_endpoint_stats(self):
+        """Test the statistics of the keycloak endpoints"""
+        settings = get_keycloak_settings()
+        url = get_brainpep_settings().user_attribute_request_url
+        respx.get(f"{url}/keycloak_id").mock(return_value=Response(status_code=200))
+        respx.get("http://unknown.test/").mock(side_effect=ConnectError)
+
+        session = get_keycloak_session()
+        await session.get(f"{url}/keycloak_id")
+        await session.get(f"{url}/keycloak_id")
+        with pytest.raises(ConnectError):
+            await session.get("http://unknown.test/")
+
+        metrics = collect_metrics()["keycloak_session"]
+        assert metrics["user_attributes"]["requests"] == 2
+        assert metrics["user_attributes"]["errors"] == 0
+        assert metrics["user_attributes"]["max_latency_ms"] >= 0
+        assert metrics["unknown.test"]["requests"] == 0
+        assert metrics["unknown.test"]["errors"] == 1 + settings.keycloak_retries
+
+        await close_keycloak_session()
+        assert collect_metrics()["keycloak_session"] == {}
+
+    @respx.mock
+    @pytest.mark.asyncio
+    async def test_circuit_breaker(self):
+        """Test the retries and the circuit breaker of the keycloak endpoints"""
+        disable_logger()
+        settings = get_keycloak_settings()
+        url = get_brainpep_settings().resource_request_url
+        unavailable = respx.get(f"{url}/unavailable").mock(
+            return_value=Response(status_code=503)
+        )
+        refused = respx.post(url).mock(side_effect=ConnectError)
+
+        session = get_keycloak_session()
+        # Idempotent requests are retried
+        response = await session.get(f"{url}/unavailable")
+        assert response.status_code == 503
+        assert unavailable.call_count == 1 + settings.keycloak_retries
+
+        # The others are not
+        with pytest.raises(ConnectError):
+            await session.post(url)
+        assert refused.call_count == 1
+
+        # Once open the circuit fails fast
+        while get_keycloak_transport().breakers["resources"].allow():
+            with pytest.raises(ConnectError):
+                await session.post(url)
+        calls = refused.call_count
+        with pytest.raises(CircuitOpenError):
+            await session.post(url)
+        assert refused.call_count == calls
+
+        metrics = collect_metrics()["keycloak_session"]["resources"]
+        assert metrics["retries"] == settings.keycloak_retries
+        assert metrics["circuit"]["state"] == "open"
+        assert metrics["circuit"]["opened"] == 1
+        await close_keycloak_session()
@@ -0,0 +1,49 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Standard Library
+from typing import List
+
+# Third Party
+from fastapi import status
+from httpx import Response
+from jose import jwk
+import respx
+
+# Internal
+from ..security.constants import PUBLIC_KEY
+
+# ----------------------------------------------------------------------------------
+
+JWKS_URL = "https://keycloak.test/auth/realms/test/protocol/openid-connect/certs"
+"""Url of the stand-in JWKS endpoint"""
+
+
+def correct_get_jwks(kid_list: List[str]) -> respx.Route:
+    """
+    Mocked realm certs, every kid is associated to the test public key
+
+    :param kid_list: kid of the keys published
+    :return: mocked route
+    """
+    key = jwk.construct(
+        f"-----BEGIN PUBLIC KEY-----\n{PUBLIC_KEY}\n-----END PUBLIC KEY-----",
+        "RS256",
+    ).to_dict()
+    return respx.get(JWKS_URL).mock(
+        return_value=Response(
+            status_code=status.HTTP_200_OK,
+            json={"keys": [{**key, "kid": kid, "use": "sig"} for kid in kid_list]},
+        )
+    )
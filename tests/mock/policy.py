@@ -17,7 +17,7 @@ from typing import List
 
 # Third Party
 from fastapi import status
-from httpx import Response
+from httpx import ConnectError, Response
 import respx
 
 # Internal
@@ -42,3 +42,13 @@ def correct_get_available_policies(policy_list_to_return: List[str]):
             json=[{"name": policy} for policy in policy_list_to_return],
         )
     )
+
+
+def error_get_available_policies():
+    """
+    Mock keycloak unreachable
+    """
+    correct_get_token(TokenType.admin, "fake_token")
+    # Get settings
+    settings = get_brainpep_settings()
+    respx.get(settings.policy_request_url).mock(side_effect=ConnectError)
@@ -41,54 +41,58 @@ def _extract_url(identifier: Optional[str] = None) -> str:
     return settings.resource_request_url
 
 
-def correct_insert_resource(identifier_to_return: str):
+def correct_insert_resource(identifier_to_return: str) -> respx.Route:
     """
     Mock the request
 
     :param identifier_to_return: Identifier that the request must return
+    :return: mocked route
     """
     correct_get_token(TokenType.client, "Fake_token")
     url = _extract_url()
-    respx.post(url).mock(
+    return respx.post(url).mock(
         return_value=Response(
             status_code=status.HTTP_200_OK, json={"_id": identifier_to_return}
         )
     )
 
 
-def correct_update_resource(identifier: str):
+def correct_update_resource(identifier: str) -> respx.Route:
     """
     Mock the request
 
     :param identifier: identifier of the resource to update
+    :return: mocked route
     """
     correct_get_token(TokenType.client, "Fake_token")
     url = _extract_url(identifier)
-    respx.put(url).mock(return_value=Response(status_code=status.HTTP_200_OK))
+    return respx.put(url).mock(return_value=Response(status_code=status.HTTP_200_OK))
 
 
-def correct_delete_resource(identifier: str):
+def correct_delete_resource(identifier: str) -> respx.Route:
     """
     Mock the request
 
     :param identifier: identifier of the resource to delete
+    :return: mocked route
     """
     correct_get_token(TokenType.client, "Fake_token")
     url = _extract_url(identifier)
-    respx.delete(url).mock(return_value=Response(status_code=status.HTTP_200_OK))
+    return respx.delete(url).mock(return_value=Response(status_code=status.HTTP_200_OK))
 
 
 # -------------------------------------------------------------------------------------
 
 
-def error_insert_resource():
+def error_insert_resource(status_code: int = status.HTTP_404_NOT_FOUND):
     """
     Mock the request
 
+    :param status_code: status of the error
     """
     correct_get_token(TokenType.client, "Fake_token")
     url = _extract_url()
-    respx.post(url).mock(return_value=Response(status_code=status.HTTP_404_NOT_FOUND))
+    respx.post(url).mock(return_value=Response(status_code=status_code))
 
 
 def error_update_resource(identifier: str):
@@ -14,6 +14,7 @@
 
 # Standard Library
 from enum import Enum
+from typing import Optional
 
 # Third Party
 from fastapi import status
@@ -31,25 +32,34 @@ class TokenType(str, Enum):
     admin = "admin"
 
 
-def correct_get_token(token_type: TokenType, token: str):
+def correct_get_token(
+    token_type: TokenType,
+    token: str,
+    expires_in: Optional[int] = None,
+    refresh_token: Optional[str] = None,
+) -> respx.Route:
     """
     Mocked get iota user
 
     :param token_type: Must be client or user
     :param token: Mocked result token
+    :param expires_in: Mocked validity of the token
+    :param refresh_token: Mocked refresh token
+    :return: mocked route
     """
+    content = {"access_token": token}
+    if expires_in is not None:
+        content["expires_in"] = expires_in
+    if refresh_token is not None:
+        content.update({"refresh_token": refresh_token, "refresh_expires_in": 1800})
 
     if token_type == TokenType.admin:
-        respx.post(ADMIN_DATA["url"]).mock(
-            return_value=Response(
-                status_code=status.HTTP_200_OK, json={"access_token": token}
-            )
+        return respx.post(ADMIN_DATA["url"]).mock(
+            return_value=Response(status_code=status.HTTP_200_OK, json=content)
         )
     else:
-        respx.post(CLIENT_DATA["url"]).mock(
-            return_value=Response(
-                status_code=status.HTTP_200_OK, json={"access_token": token}
-            )
+        return respx.post(CLIENT_DATA["url"]).mock(
+            return_value=Response(status_code=status.HTTP_200_OK, json=content)
         )
 
 
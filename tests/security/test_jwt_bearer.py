@@ -0,0 +1,68 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Test
+import pytest
+import uvloop
+
+# Third Party
+from jose import JWTError
+
+# Internal
+from app.models.security import Requester
+from app.security.jwt_bearer import get_bearer_token_cache, verify_bearer_token
+from .model import RolesEnum
+from .token import (
+    change_default_security_settings,
+    generate_fake_token,
+    generate_valid_token,
+)
+
+# ------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def event_loop():
+    """
+    Set uvloop as the default event loop
+    """
+    loop = uvloop.Loop()
+    yield loop
+    loop.close()
+
+
+class TestBearer:
+    """
+    Test the verification of the bearer tokens
+    """
+
+    @pytest.mark.asyncio
+    async def test_bearer_token_cache(self):
+        """
+        Test the cache of the verified bearer tokens
+        """
+        change_default_security_settings()
+        cache = get_bearer_token_cache()
+        token = generate_valid_token(RolesEnum.brain_user, "test_user", "test_id")
+
+        bearer = await verify_bearer_token(token)
+        assert bearer.requester == Requester(
+            preferred_username="test_user", sub="test_id"
+        ), "Requester must be parsed"
+        hits = cache.stats()["hits"]
+        assert await verify_bearer_token(token) is bearer, "Token must be cached"
+        assert cache.stats()["hits"] == hits + 1, "Hit must be counted"
+
+        with pytest.raises(JWTError):
+            await verify_bearer_token(generate_fake_token())
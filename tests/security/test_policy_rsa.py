@@ -12,6 +12,9 @@
  ******************************************************************************
 """
 
+# Standard Library
+from time import sleep
+
 # Test
 import pytest
 
@@ -20,7 +23,12 @@ from fastapi.exceptions import HTTPException
 
 # Internal
 from app.models.brain_pep.device import Device, Policy
-from app.security.policy_rsa import sign_user_policies, verify_signature
+from app.security.policy_rsa import (
+    VerifiedTokenCache,
+    get_verified_token_cache,
+    sign_user_policies,
+    verify_signature,
+)
 from .token import change_default_security_settings
 
 # ------------------------------------------------------------------------------
@@ -44,3 +52,50 @@ class TestJWS:
 
         with pytest.raises(HTTPException):
             verify_signature("Fake signature")
+
+    def test_verified_token_cache(self):
+        """
+        Test the cache of the verified signatures
+        """
+        change_default_security_settings()
+        cache = get_verified_token_cache()
+        fake_device = Device(
+            device_id="cached_fake", policy_list=[Policy.commercial_policy]
+        )
+        signed_device = sign_user_policies(fake_device.signature_conversion())
+
+        verify_signature(signed_device)
+        hits = cache.stats()["hits"]
+        assert Device.parse_obj(verify_signature(signed_device)) == fake_device
+        assert cache.stats()["hits"] == hits + 1, "Signature must be cached"
+
+        # Every caller receives its own payload
+        verify_signature(signed_device)["policy_list"].clear()
+        assert Device.parse_obj(verify_signature(signed_device)) == fake_device
+
+        cache.invalidate_device(fake_device.device_id)
+        assert cache.get(signed_device) is None, "Signature must be invalidated"
+
+    def test_invalidated_devices(self):
+        """
+        Test that the invalidated devices are forgotten once their tokens expired
+        """
+        cache = VerifiedTokenCache(maxsize=2, max_bytes=1024, ttl=0.05)
+        cache.set("token", "device", b'{"device_id": "device"}')
+        cache.invalidate_device("device")
+        assert cache.get("token") is None, "Signature must be invalidated"
+        cache.set("token", "device", b'{"device_id": "device"}')
+        assert cache.get("token") == {"device_id": "device"}
+
+        sleep(0.05)
+        cache.invalidate_device("other")
+        assert list(cache._invalidated) == ["other"], "Expired devices are pruned"
+
+        cache = VerifiedTokenCache(maxsize=2, max_bytes=1024, ttl=60)
+        cache.set("token", "device", b'{"device_id": "device"}')
+        for device_id in ("first", "second"):
+            cache.invalidate_device(device_id)
+        assert cache.get("token") is not None
+        cache.invalidate_device("third")
+        assert len(cache._invalidated) == 0, "Invalidated devices are bounded"
+        assert cache.get("token") is None, "Tokens are forgotten with them"
@@ -12,23 +12,39 @@
  ******************************************************************************
 """
 
+# Standard Library
+import asyncio
+from time import sleep, time
+
 # Test
 import respx
 
 # Third Party
+from asyncpg import connect
 from fastapi import status
 from fastapi.testclient import TestClient
 
 # Internal
+from app.internals.keycloak.attributes import get_user_identifier_cache
+from app.internals.keycloak.policy import get_policy_catalogue
+from app.internals.policy.compact import COMPACT_MEDIA_TYPE, to_text
+from app.internals.policy.device import (
+    get_compact_policy_store,
+    get_signed_policy_store,
+    signed_policies,
+)
+from app.db.query import DEVICE_CHANNEL, SETTINGS
 from app.main import app
 from app.models.brain_pep.device import Device
 from app.models.brain_pep.policy import Policy
 from app.models.brain_pep.service import Service, ServicePolicy
+from app.security.policy_rsa import verify_signature
 from .internals.logger import disable_logger
 from .mock.resources import (
     correct_insert_resource,
     correct_delete_resource,
     correct_update_resource,
+    error_insert_resource,
 )
 from .mock.policy import correct_get_available_policies
 from .mock.attributes import correct_get_user_identifier, correct_set_user_identifier
@@ -47,6 +63,23 @@ def clear_test():
     """Clear tests"""
     disable_logger()
     change_default_security_settings()
+    get_policy_catalogue.cache_clear()
+    get_user_identifier_cache().clear()
+
+
+async def notify_device_change(device_id: str):
+    """Notify the write of a device as another worker does"""
+    connection = await connect(
+        user=SETTINGS.postgres_user,
+        password=SETTINGS.postgres_pwd,
+        database=SETTINGS.postgres_db,
+        host=SETTINGS.postgres_host,
+        port=SETTINGS.postgres_port,
+    )
+    try:
+        await connection.execute(f"NOTIFY {DEVICE_CHANNEL}, '{device_id}';")
+    finally:
+        await connection.close()
 
 
 def test_docs_and_startup_shutdown():
@@ -64,6 +97,38 @@ def test_docs_and_startup_shutdown():
     clear_test()
 
 
+def test_metrics():
+    """Test the metrics of the worker"""
+    clear_test()
+    with TestClient(app) as client:
+        response = client.get("/api/v1/metrics")
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+        token = generate_valid_token(RolesEnum.brain_user, "test_user", "test_user")
+        response = client.get(
+            "/api/v1/metrics", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+        token = generate_valid_token(
+            RolesEnum.brain_consumers, "test_user", "test_identifier"
+        )
+        response = client.get(
+            "/api/v1/metrics", headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert {
+            "crypto_executor",
+            "database_statements",
+            "device_dashboard",
+            "device_listener",
+            "service_cache",
+            "service_dashboard",
+            "signed_policy_cache",
+            "verified_token_cache",
+        } <= response.json().keys()
+
+
 class TestBrainConsumers:
     """
     Test BrainConsumers route
@@ -173,6 +238,89 @@ class TestBrainConsumers:
                 else:
                     assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
+    @respx.mock
+    def test_outbox(self):
+        """
+        Test that the service operations reach keycloak in background, in order
+        """
+        clear_test()
+        token = generate_valid_token(
+            RolesEnum.brain_consumers, "test_user", "test_identifier"
+        )
+        headers = {"Authorization": f"Bearer {token}"}
+        fake_service = Service(name="OutboxService", resource_scopes=[])
+        routes = (
+            correct_insert_resource("outbox_identifier"),
+            correct_update_resource("outbox_identifier"),
+            correct_delete_resource("outbox_identifier"),
+        )
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers=headers,
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            fake_service.resource_scopes = [ServicePolicy.commercial_policy]
+            response = client.put(
+                "/api/v1/brain_consumers/service",
+                headers=headers,
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            response = client.delete(
+                "/api/v1/brain_consumers/service/outboxservice", headers=headers
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+            deadline = time() + 5
+            while not routes[-1].called and time() < deadline:
+                sleep(0.05)
+            assert [route.call_count for route in routes] == [1, 1, 1]
+            response = client.get("/api/v1/metrics", headers=headers)
+            assert response.json()["keycloak_outbox"]["pushed"]
+
+    @respx.mock
+    def test_outbox_refused_insert(self):
+        """
+        Test that a service whose resource keycloak refuses to create is removed
+        """
+        clear_test()
+        # Name already used by another user
+        error_insert_resource(status.HTTP_409_CONFLICT)
+        token = generate_valid_token(
+            RolesEnum.brain_consumers, "test_user", "test_identifier"
+        )
+        headers = {"Authorization": f"Bearer {token}"}
+        fake_service = Service(name="RefusedService", resource_scopes=[])
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers=headers,
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers=headers,
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_409_CONFLICT
+
+            deadline = time() + 5
+            while time() < deadline:
+                response = client.get("/api/v1/metrics", headers=headers)
+                if response.json()["keycloak_outbox"]["discarded"]:
+                    break
+                sleep(0.05)
+            # The service was removed
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers=headers,
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
 
 class TestBrainUser:
     """
@@ -306,6 +454,65 @@ class TestGateway:
             response = client.get("/api/v1/gateway/device/FakeDevice")
             assert response.status_code == status.HTTP_200_OK
 
+            etag = response.headers["ETag"]
+            response = client.get(
+                "/api/v1/gateway/device/FakeDevice", headers={"If-None-Match": etag}
+            )
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+            assert response.headers["ETag"] == etag
+            response = client.get(
+                "/api/v1/gateway/device/FakeDevice",
+                headers={"If-None-Match": '"outdated"'},
+            )
+            assert response.status_code == status.HTTP_200_OK
+
+    @respx.mock
+    def test_get_device_after_update(self):
+        """
+        Test that the signed policies follow the updates of the device
+        """
+        clear_test()
+        correct_get_user_identifier("test_identifier", "fake")
+        token = generate_valid_token(
+            RolesEnum.brain_user, "test_user", "test_identifier"
+        )
+        fake_device = Device(device_id="SignedDevice", policy_list=[])
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/v1/brain_user/policy",
+                headers={"Authorization": f"Bearer {token}"},
+                json=fake_device.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+            response = client.get("/api/v1/gateway/device/SignedDevice")
+            assert response.status_code == status.HTTP_200_OK
+            signature = response.json()["signature"]
+            assert Device.parse_obj(verify_signature(signature)) == fake_device
+
+            fake_device.policy_list = [Policy.commercial_policy]
+            response = client.put(
+                "/api/v1/brain_user/policy",
+                headers={"Authorization": f"Bearer {token}"},
+                json=fake_device.dict(),
+            )
+            assert response.status_code == status.HTTP_202_ACCEPTED
+            response = client.get("/api/v1/gateway/device/SignedDevice")
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()["signature"] != signature
+            assert (
+                Device.parse_obj(verify_signature(response.json()["signature"]))
+                == fake_device
+            )
+
+            # Write notified by another worker
+            get_signed_policy_store().set("SignedDevice", signed_policies(signature))
+            asyncio.run(notify_device_change("SignedDevice"))
+            deadline = time() + 1
+            while get_signed_policy_store().get("SignedDevice") and time() < deadline:
+                sleep(0.01)
+            response = client.get("/api/v1/gateway/device/SignedDevice")
+            assert response.json()["signature"] != signature
+
     @respx.mock
     def test_filter(self):
         """
@@ -331,3 +538,127 @@ class TestGateway:
             gateway["sign_device"] = response.json()["signature"]
             response = client.post("/api/v1/gateway/filter", json=gateway)
             assert response.status_code == status.HTTP_200_OK
+            assert [service["name"] for service in response.json()] == ["fakeservice"]
+
+            gateway["service_list"] = ["fakeservice", "service_not_found"]
+            response = client.post("/api/v1/gateway/filter", json=gateway)
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+
+            # Compact signed policies
+            response = client.get(
+                "/api/v1/gateway/device/FakeDevice",
+                headers={"Accept": COMPACT_MEDIA_TYPE},
+            )
+            assert response.status_code == status.HTTP_200_OK
+            assert response.headers["content-type"] == COMPACT_MEDIA_TYPE
+            etag = response.headers["ETag"]
+            gateway = {
+                "service_list": ["fakeservice"],
+                "sign_device": to_text(response.content),
+            }
+            response = client.post("/api/v1/gateway/filter", json=gateway)
+            assert response.status_code == status.HTTP_200_OK
+            assert [service["name"] for service in response.json()] == ["fakeservice"]
+
+            response = client.get(
+                "/api/v1/gateway/device/FakeDevice",
+                headers={"Accept": COMPACT_MEDIA_TYPE, "If-None-Match": etag},
+            )
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+            # Signed on write, so every worker serves the same token
+            get_compact_policy_store().clear()
+            response = client.get(
+                "/api/v1/gateway/device/FakeDevice",
+                headers={"Accept": COMPACT_MEDIA_TYPE, "If-None-Match": etag},
+            )
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    @respx.mock
+    def test_filter_bulk(self):
+        """
+        Test bulk filter
+        """
+        clear_test()
+        correct_insert_resource("test_identifier")
+        token = generate_valid_token(
+            RolesEnum.brain_consumers, "test_user", "test_identifier"
+        )
+        fake_service = Service(name="FakeBulkService", resource_scopes=[])
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers={"Authorization": f"Bearer {token}"},
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+            response = client.get("/api/v1/gateway/device/FakeDevice")
+            assert response.status_code == status.HTTP_200_OK
+            signature = response.json()["signature"]
+            message_list = [
+                {"service_list": ["fakebulkservice"], "sign_device": signature},
+                {"service_list": [], "sign_device": signature},
+            ]
+            response = client.post("/api/v1/gateway/filter/bulk", json=message_list)
+            assert response.status_code == status.HTTP_200_OK
+            assert len(response.json()) == 2
+            assert response.json()[0]["status_code"] == status.HTTP_200_OK
+            assert [
+                service["name"] for service in response.json()[0]["services"]
+            ] == ["fakebulkservice"]
+            assert response.json()[1] == {
+                "status_code": status.HTTP_200_OK,
+                "services": [],
+            }
+
+            # A failed item doesn't fail the others
+            message_list[1]["sign_device"] = "Fake signature"
+            response = client.post("/api/v1/gateway/filter/bulk", json=message_list)
+            assert response.status_code == status.HTTP_200_OK
+            assert response.json()[0]["status_code"] == status.HTTP_200_OK
+            assert response.json()[1]["status_code"] == status.HTTP_401_UNAUTHORIZED
+            assert "services" not in response.json()[1]
+
+    @respx.mock
+    def test_filter_stream(self):
+        """
+        Test filter stream
+        """
+        clear_test()
+        correct_insert_resource("test_identifier")
+        token = generate_valid_token(
+            RolesEnum.brain_consumers, "test_user", "test_identifier"
+        )
+        fake_service = Service(name="FakeStreamService", resource_scopes=[])
+        with TestClient(app) as client:
+            response = client.post(
+                "/api/v1/brain_consumers/service",
+                headers={"Authorization": f"Bearer {token}"},
+                json=fake_service.dict(),
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+            response = client.get("/api/v1/gateway/device/FakeDevice")
+            assert response.status_code == status.HTTP_200_OK
+            signature = response.json()["signature"]
+
+            with client.websocket_connect("/api/v1/gateway/filter/stream") as websocket:
+                websocket.send_json(
+                    {"service_list": ["fakestreamservice"], "sign_device": signature}
+                )
+                websocket.send_json(
+                    {"service_list": ["service_not_found"], "sign_device": signature}
+                )
+                websocket.send_json(
+                    {"service_list": ["fakestreamservice"], "sign_device": "Fake"}
+                )
+                decision = websocket.receive_json()
+                assert decision["status_code"] == status.HTTP_200_OK
+                assert [service["name"] for service in decision["services"]] == [
+                    "fakestreamservice"
+                ]
+                decision = websocket.receive_json()
+                assert decision["status_code"] == status.HTTP_404_NOT_FOUND
+                decision = websocket.receive_json()
+                assert decision["status_code"] == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,102 @@
+"""
+
+:author: Angelo Cutaia
+*******************************************************************************
+* Copyright (C) 2021 LINKS Foundation
+*
+* This program and the accompanying materials are made
+* available under the terms of the Eclipse Public License 2.0
+* which is available at https://www.eclipse.org/legal/epl-2.0/
+*
+* SPDX-License-Identifier: EPL-2.0
+ ******************************************************************************
+"""
+
+# Third Party
+from fastapi import status
+from fastapi.testclient import TestClient
+from jose import jwk, jwt
+
+# Internal
+from app.models.keycloak.attributes import Attributes
+from app.models.keycloak.role import parse_roles
+from app.models.brain_pep.service import get_service_id
+from benchmarks.fake_keycloak import app, SETTINGS
+
+# ------------------------------------------------------------------------------
+
+REALM_URL = "/auth/realms/Brainiot"
+ADMIN_URL = "/auth/admin/realms/Brainiot"
+
+
+def test_fake_keycloak():
+    """Test the endpoints of the keycloak stand-in used by BrainPEP"""
+    with TestClient(app) as client:
+        response = client.post(
+            f"{REALM_URL}/protocol/openid-connect/token",
+            data={"grant_type": "password", "username": "user", "password": "pwd"},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        token = response.json()
+
+        # The token is verified with the published keys
+        jwks = client.get(f"{REALM_URL}/protocol/openid-connect/certs").json()
+        claims = jwt.decode(
+            token["access_token"],
+            jwk.construct(jwks["keys"][0], "RS256"),
+            "RS256",
+            issuer=f"http://testserver{REALM_URL}",
+        )
+        assert claims["preferred_username"] == "user"
+        response = client.post(
+            f"{REALM_URL}/protocol/openid-connect/token",
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": token["refresh_token"],
+            },
+        )
+        assert jwt.get_unverified_claims(response.json()["access_token"])["sub"] == (
+            claims["sub"]
+        ), "Refreshed tokens belong to the same user"
+
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+        response = client.get(f"{ADMIN_URL}/clients/brainpep/roles")
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        response = client.get(f"{ADMIN_URL}/clients/brainpep/roles", headers=headers)
+        assert parse_roles(response.content) == SETTINGS.roles
+
+        # User attributes
+        response = client.put(
+            f"{ADMIN_URL}/users/{claims['sub']}",
+            json={"attributes": {"device_policy_list": "identifier"}},
+            headers=headers,
+        )
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.get(f"{ADMIN_URL}/users/{claims['sub']}", headers=headers)
+        assert (
+            Attributes.parse_raw(response.content).attributes.device_policy_list
+            == "identifier"
+        )
+
+        # Resources
+        url = f"{REALM_URL}/authz/protection/resource_set"
+        response = client.post(url, json={"name": "service"}, headers=headers)
+        assert response.status_code == status.HTTP_201_CREATED
+        resource_id = get_service_id(response.content)
+        response = client.put(
+            f"{url}/{resource_id}", json={"name": "service"}, headers=headers
+        )
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.delete(f"{url}/{resource_id}", headers=headers)
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        response = client.delete(f"{url}/{resource_id}", headers=headers)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        # Error injection
+        faults = client.get("/_fake/faults").json()
+        client.put("/_fake/faults", json={**faults, "error_rate": 1})
+        response = client.get(f"{REALM_URL}/protocol/openid-connect/certs")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        client.put("/_fake/faults", json=faults)
+        response = client.get(f"{REALM_URL}/protocol/openid-connect/certs")
+        assert response.status_code == status.HTTP_200_OK